@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogapp', '0002_articlevideo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='articlevideo',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
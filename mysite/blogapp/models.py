@@ -27,6 +27,7 @@ class ArticleVideo(models.Model):
     title = models.CharField(max_length=200)
     body = models.TextField(null=True, blank=True)
     published_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def get_absolute_url(self):
         return reverse("blogapp:article_detail", kwargs={"pk": self.pk})
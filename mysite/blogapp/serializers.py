@@ -38,4 +38,10 @@ class ArticleSerializer(serializers.ModelSerializer):
             "author",
             "category",
             "tags",
-        )
\ No newline at end of file
+        )
+        # ?expand=author,category,tags
+        expandable_fields = {
+            "author": AuthorSerializer,
+            "category": CategorySerializer,
+            "tags": TagSerializer,
+        }
@@ -0,0 +1,25 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from shopapp.cache import invalidate_models
+from shopapp.sitemap import mark_sitemaps_dirty
+from shopapp.surrogate import purge_instances
+from .models import ArticleVideo
+
+
+@receiver(post_save, sender=ArticleVideo)
+@receiver(post_delete, sender=ArticleVideo)
+def invalidate_article_caches(sender, **kwargs):
+    invalidate_models(sender)
+
+
+@receiver(post_save, sender=ArticleVideo)
+@receiver(post_delete, sender=ArticleVideo)
+def purge_article_proxy_cache(sender, instance: ArticleVideo, **kwargs):
+    purge_instances(sender, [instance.pk])
+
+
+@receiver(post_save, sender=ArticleVideo)
+@receiver(post_delete, sender=ArticleVideo)
+def mark_article_sitemap_dirty(sender, instance: ArticleVideo, **kwargs):
+    mark_sitemaps_dirty(sender, [instance.pk])
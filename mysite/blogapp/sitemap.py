@@ -1,14 +1,14 @@
-from django.contrib.sitemaps import Sitemap
+from django.db.models import QuerySet
+
+from shopapp.sitemap import ShardedSitemap
 
 from .models import ArticleVideo
 
 
-class BlogSitemap(Sitemap):
+class BlogSitemap(ShardedSitemap):
     changefreq = "never"
     priority = 0.5
+    url_name = "blogapp:article_detail"
 
-    def items(self):
-        return ArticleVideo.objects.filter(published_at__isnull=False).order_by("-published_at")
-
-    def lastmod(self, obj: ArticleVideo):
-        return obj.published_at
\ No newline at end of file
+    def get_queryset(self) -> QuerySet:
+        return ArticleVideo.objects.filter(published_at__isnull=False)
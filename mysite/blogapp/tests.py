@@ -1,3 +1,34 @@
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import translation
 
-# Create your tests here.
+from .models import Article, Author, Category, Tag
+
+
+class ArticleExpandTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = Author.objects.create(name="Leo", bio="Writer")
+        category = Category.objects.create(name="Novels")
+        tags = [Tag.objects.create(name=name) for name in ("war", "peace")]
+        for number in range(5):
+            article = Article.objects.create(title=f"Part {number}", author=author, category=category)
+            article.tags.set(tags)
+
+    def setUp(self) -> None:
+        translation.activate("en")
+
+    def test_expand_author_category_tags(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse("blogapp:article-list"),
+                {"expand": "author,category,tags", "fields": "title,author,category,tags"},
+            )
+        article = response.json()["results"][0]
+        self.assertEqual(article["author"], {"name": "Leo", "bio": "Writer"})
+        self.assertEqual(article["category"], {"name": "Novels"})
+        self.assertEqual(sorted(tag["name"] for tag in article["tags"]), ["peace", "war"])
+        # The page with authors and categories joined, and the tags
+        self.assertEqual(len(queries), 2)
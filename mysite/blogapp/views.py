@@ -3,12 +3,18 @@ from django.shortcuts import render
 from rest_framework.viewsets import ModelViewSet
 
 from django.urls import reverse, reverse_lazy
+from django.utils.decorators import method_decorator
 from django.views.generic import ListView, DetailView
+from shopapp.cache import get_generation, get_or_recompute, model_scope
+from shopapp.conditional import conditional_on
+from shopapp.fieldsets import SparseFieldsetsMixin
+from shopapp.pagination import KeysetPagination
+from shopapp.surrogate import SurrogateKeyMixin, surrogate_keys
 from .models import Article, Author, Tag, Category, ArticleVideo
 from .serializers import AuthorSerializer, CategorySerializer, TagSerializer, ArticleSerializer
 
 
-class ArticlesListViewVideo(ListView):
+class ArticlesListViewVideo(SurrogateKeyMixin, ListView):
     template_name = "blogapp/article_video_list.html"
     queryset = (
         ArticleVideo.objects
@@ -17,16 +23,31 @@ class ArticlesListViewVideo(ListView):
     )
 
 
+def published_articles(request, *args, **kwargs):
+    return ArticleVideo.objects.filter(published_at__isnull=False)
+
+
 class LatestArticlesFeed(Feed):
     title = "Blog articles (latest)"
     description = "Updates on changes and addition blog articles"
     link = reverse_lazy("blogapp:articles_video")
 
+    @method_decorator(surrogate_keys(ArticleVideo))
+    @method_decorator(conditional_on(published_articles))
+    def __call__(self, request, *args, **kwargs):
+        return super().__call__(request, *args, **kwargs)
+
     def items(self):
-        return (
-            ArticleVideo.objects
-            .filter(published_at__isnull=False)
-            .order_by("-published_at")[:5]
+        generation = get_generation(model_scope(ArticleVideo))
+        return get_or_recompute(
+            "latest_articles_feed",
+            lambda: list(
+                ArticleVideo.objects
+                .filter(published_at__isnull=False)
+                .order_by("-published_at")[:5]
+            ),
+            timeout=60,
+            generation=generation,
         )
 
     def item_title(self, item: ArticleVideo):
@@ -36,7 +57,7 @@ class LatestArticlesFeed(Feed):
         return item.body[:200]
 
 
-class ArticleDetailView(DetailView):
+class ArticleDetailView(SurrogateKeyMixin, DetailView):
     model = ArticleVideo
 
 
@@ -67,9 +88,10 @@ class TagViewSet(ModelViewSet):
     serializer_class = TagSerializer
 
 
-class ArticleViewSet(ModelViewSet):
+class ArticleViewSet(SparseFieldsetsMixin, ModelViewSet):
     queryset = Article.objects.all()
     serializer_class = ArticleSerializer
+    pagination_class = KeysetPagination
 
 
 
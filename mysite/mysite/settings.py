@@ -134,8 +134,44 @@ CACHES = {
     }
 }
 
+# One shared-memory cache for all gunicorn workers of the host
+if getenv("DJANGO_CACHE_MMAP_PATH"):
+    CACHES["default"] = {
+        "BACKEND": "shopapp.cache_backends.MmapCache",
+        "LOCATION": getenv("DJANGO_CACHE_MMAP_PATH"),
+        "OPTIONS": {
+            "SLOTS": int(getenv("DJANGO_CACHE_MMAP_SLOTS", "16384")),
+            "SLOT_SIZE": int(getenv("DJANGO_CACHE_MMAP_SLOT_SIZE", "4096")),
+            # Values larger than a slot (cached pages, exports)
+            "FALLBACK": "mmap_overflow",
+        },
+    }
+    CACHES["mmap_overflow"] = {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": getenv("DJANGO_CACHE_MMAP_OVERFLOW_PATH", "/var/tmp/django_cache_overflow"),
+    }
+
 CACHE_MIDDLEWARE_SECONDS = 200
 
+# Surrogate keys and purging for the caching reverse proxy (shopapp.surrogate)
+SURROGATE_MAX_AGE = int(getenv("DJANGO_SURROGATE_MAX_AGE", str(6 * 60 * 60)))
+SURROGATE_PURGER = getenv("DJANGO_SURROGATE_PURGER", "shopapp.surrogate.LogPurger")
+SURROGATE_PURGER_OPTIONS = {
+    "URL": getenv("DJANGO_SURROGATE_PURGE_URL", ""),
+    "TOKEN": getenv("DJANGO_SURROGATE_PURGE_TOKEN", ""),
+}
+
+# Resized product image variants (shopapp.images)
+IMAGE_VARIANT_WIDTHS = (160, 320, 640, 1280)
+IMAGE_VARIANT_FORMATS = ("webp", "jpeg")
+IMAGE_VARIANT_WORKERS = int(getenv("DJANGO_IMAGE_VARIANT_WORKERS", "2"))
+IMAGE_UPLOAD_THREADS = int(getenv("DJANGO_IMAGE_UPLOAD_THREADS", "8"))
+
+# Sharded sitemaps pre-rendered to files (shopapp.sitemap)
+SITEMAP_SECTIONS = "mysite.sitemaps.sitemaps"
+SITEMAP_ROOT = BASE_DIR / "sitemaps"
+SITEMAP_BASE_URL = getenv("DJANGO_SITEMAP_BASE_URL", "http://localhost:8000")
+
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
 
@@ -186,6 +222,16 @@ STATIC_ROOT = BASE_DIR / "static_root"
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "uploads"
 
+# Uploads are stored once per content, see shopapp.storage
+STORAGES = {
+    "default": {
+        "BACKEND": "shopapp.storage.DeduplicatingFileSystemStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
 
@@ -4,5 +4,5 @@ from shopapp.sitemap import ProductSitemap
 
 sitemaps = {
     "blog": BlogSitemap,
-    "shopapp/products": ProductSitemap
+    "products": ProductSitemap,
 }
\ No newline at end of file
@@ -21,9 +21,11 @@ from django.conf.urls.static import static
 from django.conf.urls.i18n import i18n_patterns
 
 from drf_spectacular.views import SpectacularAPIView, SpectacularRedocView, SpectacularSwaggerView
-from django.contrib.sitemaps.views import sitemap
 
-from .sitemaps import sitemaps
+from blogapp.models import ArticleVideo
+from shopapp.models import Product
+from shopapp.sitemap import sitemap_index, sitemap_shard
+from shopapp.surrogate import surrogate_keys
 
 urlpatterns = []
 
@@ -38,7 +40,12 @@ urlpatterns += i18n_patterns(
     path("api/", include("myapiapp.urls")),
     path("blog/", include("blogapp.urls")),
 
-    path("sitemap.xml/", sitemap, {"sitemaps": sitemaps}, name="sitemaps")
+    path("sitemap.xml/", surrogate_keys(Product, ArticleVideo)(sitemap_index), name="sitemaps"),
+    path(
+        "sitemap-<slug:section>-<int:shard>.xml.gz",
+        surrogate_keys(Product, ArticleVideo)(sitemap_shard),
+        name="sitemap_shard",
+    ),
 )
 
 if settings.DEBUG:
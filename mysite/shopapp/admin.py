@@ -1,40 +1,66 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.db.models import QuerySet
+from django.db.models.functions import Substr
 from django.http import HttpRequest, HttpResponse
 from django.shortcuts import render, redirect
 from django.urls import path
+from django.utils import timezone
 
-from .common import save_csv_products, save_csv_orders
+from .cache import invalidate_models
+from .common import CSVImportResult, save_csv_products, save_csv_orders
 from .models import Product, Order, ProductImage
-from .admin_mixins import ExportAsCSVMixin
+from .admin_mixins import ExportAsCSVMixin, FastChangeListMixin, PaginatedInlineMixin, prefix_range
 from .forms import CSVImportForm
+from .search import fts_enabled, search_products
+from .sitemap import mark_sitemaps_dirty
+from .surrogate import purge_instances
 
 
 class ProductImageInline(admin.StackedInline):
     model = ProductImage
 
 
-class OrderInline(admin.TabularInline):
+class OrderInline(PaginatedInlineMixin, admin.TabularInline):
     model = Product.orders.through
+    autocomplete_fields = "order",
+
+
+def message_import_result(modeladmin: admin.ModelAdmin, request: HttpRequest, result: CSVImportResult):
+    modeladmin.message_user(
+        request,
+        f"Data from CSV was imported: {result.imported} rows, rejected {result.rejected}",
+        level=messages.WARNING if result.rejected else messages.SUCCESS,
+    )
+    for error in result.errors[:10]:
+        modeladmin.message_user(request, f"Line {error['line']}: {error['errors']}", level=messages.WARNING)
 
 
 @admin.action(description="Archive products")
 def mark_archived(modeladmin: admin.ModelAdmin, request: HttpRequest, queryset: QuerySet):
-    queryset.update(archived=True)
+    pks = list(queryset.values_list("pk", flat=True))
+    queryset.update(archived=True, updated_at=timezone.now())
+    invalidate_models(Product)
+    purge_instances(Product, pks)
+    mark_sitemaps_dirty(Product, pks)
 
 
 @admin.action(description="Unarchive products")
 def mark_unarchived(modeladmin: admin.ModelAdmin, request: HttpRequest, queryset: QuerySet):
-    queryset.update(archived=False)
+    pks = list(queryset.values_list("pk", flat=True))
+    queryset.update(archived=False, updated_at=timezone.now())
+    invalidate_models(Product)
+    purge_instances(Product, pks)
+    mark_sitemaps_dirty(Product, pks)
 
 
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
+class ProductAdmin(FastChangeListMixin, admin.ModelAdmin, ExportAsCSVMixin):
     change_list_template = "shopapp/products_changelist.html"
     actions = [
         mark_archived,
         mark_unarchived,
-        "export_csv",
+        "export_as_csv",
+        "export_as_xlsx",
     ]
     inlines = [
         OrderInline,
@@ -43,6 +69,8 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
     # list_display = "pk", "name", "description", "price", "discount"
     list_display = "pk", "name", "description_short", "price", "discount", "archived"
     list_display_links = "pk", "name"
+    # One character more than shown tells whether the description was cut
+    changelist_annotations = {"description_preview": Substr("description", 1, 49)}
     ordering = "-name", "pk"
     search_fields = "name", "description"
     fieldsets = [
@@ -63,10 +91,18 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
         })
     ]
 
+    def get_search_results(self, request: HttpRequest, queryset: QuerySet, search_term: str):
+        if not search_term or not fts_enabled():
+            return super().get_search_results(request, queryset, search_term)
+        return search_products(queryset, search_term.split()), False
+
     def description_short(self, obj: Product) -> str:
-        if len(obj.description) < 48:
-            return obj.description
-        return obj.description[:48] + "..."
+        description = getattr(obj, "description_preview", None)
+        if description is None:
+            description = obj.description
+        if len(description) < 48:
+            return description
+        return description[:48] + "..."
 
     def import_csv(self, request: HttpRequest) -> HttpResponse:
         if request.method == "GET":
@@ -82,11 +118,18 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
             }
             return render(request, "admin/csv_form.html", context, status=400)
 
-        csv_file = save_csv_products(
-            file=form.files["csv_file"].file,
-            encoding=request.encoding
-        )
-        self.message_user(request, "Data from CSV was imported")
+        try:
+            result = save_csv_products(
+                file=form.files["csv_file"].file,
+                encoding=request.encoding
+            )
+        except ValueError as exc:
+            form.add_error("csv_file", str(exc))
+            context = {
+                "form": form,
+            }
+            return render(request, "admin/csv_form.html", context, status=400)
+        message_import_result(self, request, result)
         return redirect("..")
 
     def get_urls(self):
@@ -102,21 +145,46 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
 # admin.site.register(Product, ProductAdmin)
 
 
-# class ProductInline(admin.TabularInline):
-class ProductInline(admin.StackedInline):
+class ProductInline(PaginatedInlineMixin, admin.TabularInline):
     model = Order.products.through
+    autocomplete_fields = "product",
+    raw_id_fields = "product",
+
+    def get_autocomplete_fields(self, request):
+        # Without the full-text index the lookup is a LIKE scan: raw id input is used instead
+        return super().get_autocomplete_fields(request) if fts_enabled() else ()
 
 
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(FastChangeListMixin, admin.ModelAdmin, ExportAsCSVMixin):
     change_list_template = "shopapp/orders_changelist.html"
+    actions = [
+        "export_as_csv",
+        "export_as_xlsx",
+    ]
+    export_fields = "id", "delivery_address", "promocode", "created_at", "user__username", "total", "products_count"
+    export_many = {"products": "name"}
     inlines = [
         ProductInline,
     ]
     list_display = "delivery_address", "promocode", "created_at", "user_verbose"
+    changelist_only = "user__first_name", "user__username"
+    search_fields = "=id", "user__username"
+    ordering = "-pk",
 
     def get_queryset(self, request):
-        return Order.objects.select_related("user").prefetch_related("products")
+        return super().get_queryset(request).select_related("user")
+
+    def get_search_results(self, request: HttpRequest, queryset: QuerySet, search_term: str):
+        """
+        Orders are looked up by pk or by a username prefix, both served by indexes.
+        """
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        if search_term.isdigit():
+            return queryset.filter(pk=int(search_term)), False
+        return queryset.filter(prefix_range("user__username", search_term)), False
 
     def user_verbose(self, obj: Order) -> str:
         return obj.user.first_name or obj.user.username
@@ -136,11 +204,18 @@ class OrderAdmin(admin.ModelAdmin):
             }
             return render(request, "admin/csv_form.html", context, status=400)
 
-        csv_file = save_csv_orders(
-            file=form.files["csv_file"].file,
-            encoding=request.encoding
-        )
-        self.message_user(request, "Data from CSV was imported")
+        try:
+            result = save_csv_orders(
+                file=form.files["csv_file"].file,
+                encoding=request.encoding
+            )
+        except ValueError as exc:
+            form.add_error("csv_file", str(exc))
+            context = {
+                "form": form,
+            }
+            return render(request, "admin/csv_form.html", context, status=400)
+        message_import_result(self, request, result)
         return redirect("..")
 
     def get_urls(self):
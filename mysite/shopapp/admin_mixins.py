@@ -1,23 +1,213 @@
-import csv
+import tempfile
+from collections import defaultdict
 
-from django.db.models import QuerySet
+from django.contrib.admin.views.main import ChangeList
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Q, QuerySet
+from django.forms import BaseInlineFormSet
 from django.db.models.options import Options
-from django.http import HttpRequest, HttpResponse
+from django.http import FileResponse, HttpRequest, QueryDict, StreamingHttpResponse
+from xlsxwriter import Workbook
+
+from .common import iter_csv
+from .pagination import EstimatedCountPaginator
+from .utils import batched
 
 
 class ExportAsCSVMixin:
-    def export_as_csv(self, request: HttpRequest, queryset: QuerySet):
-        meta: Options = self.model._meta
-        field_names = [field.name for field in meta.fields]
+    """
+    Admin actions exporting the selected objects as CSV or XLSX.
 
-        response = HttpResponse(content_type="text/csv")
-        response["Content-Disposition"] = f"attachment; filename={meta}-export.csv"
-        writer = csv.writer(response)
+    Rows are read with ``values_list().iterator()`` in chunks of
+    ``export_chunk_size``, so memory does not grow with the selection.
+    ``export_fields`` may follow foreign keys (``"user__username"`` is a join),
+    ``export_many`` maps many-to-many fields to the related field exported
+    as a ';'-separated list; they are fetched with one query per chunk.
+    """
+    export_fields = None
+    export_many = {}
+    export_chunk_size = 2000
+
+    def get_export_fields(self) -> list:
+        if self.export_fields is not None:
+            return list(self.export_fields)
+        return [field.attname for field in self.model._meta.concrete_fields]
 
-        writer.writerow(field_names)
-        for obj in queryset:
-            writer.writerow([getattr(obj, field) for field in field_names])
+    def get_export_header(self) -> list:
+        return [*self.get_export_fields(), *self.export_many]
 
+    def iter_export_rows(self, queryset: QuerySet):
+        rows = (
+            queryset
+            .prefetch_related(None)
+            .values_list("pk", *self.get_export_fields())
+            .iterator(chunk_size=self.export_chunk_size)
+        )
+        for chunk in batched(rows, self.export_chunk_size):
+            pks = [row[0] for row in chunk]
+            related = {name: self._fetch_many(name, attr, pks) for name, attr in self.export_many.items()}
+            for pk, *values in chunk:
+                yield [*values, *(";".join(related[name].get(pk, ())) for name in self.export_many)]
+
+    def _fetch_many(self, name: str, attr: str, pks: list) -> dict:
+        field = self.model._meta.get_field(name)
+        source, target = field.m2m_field_name(), field.m2m_reverse_field_name()
+        found = defaultdict(list)
+        rows = (
+            field.remote_field.through.objects
+            .filter(**{f"{source}__in": pks})
+            .order_by(source, "pk")
+            .values_list(source, f"{target}__{attr}")
+        )
+        for pk, value in rows:
+            found[pk].append(str(value))
+        return found
+
+    def export_as_csv(self, request: HttpRequest, queryset: QuerySet):
+        meta: Options = self.model._meta
+        response = StreamingHttpResponse(
+            iter_csv(self.get_export_header(), self.iter_export_rows(queryset), chunk_size=self.export_chunk_size),
+            content_type="text/csv",
+        )
+        response["Content-Disposition"] = f"attachment; filename={meta}-export.csv"
         return response
 
     export_as_csv.short_description = "Export as CSV"
+
+    def export_as_xlsx(self, request: HttpRequest, queryset: QuerySet):
+        meta: Options = self.model._meta
+        output = tempfile.TemporaryFile()
+        # constant_memory flushes every row to disk as soon as the next one starts
+        workbook = Workbook(output, {
+            "constant_memory": True,
+            "remove_timezone": True,
+            "default_date_format": "yyyy-mm-dd hh:mm:ss",
+            "strings_to_formulas": False,
+            "strings_to_urls": False,
+        })
+        worksheet = workbook.add_worksheet(meta.model_name)
+        worksheet.write_row(0, 0, self.get_export_header(), workbook.add_format({"bold": True}))
+        for row_number, row in enumerate(self.iter_export_rows(queryset), start=1):
+            worksheet.write_row(row_number, 0, row)
+        workbook.close()
+        output.seek(0)
+        return FileResponse(
+            output,
+            as_attachment=True,
+            filename=f"{meta}-export.xlsx",
+            content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        )
+
+    export_as_xlsx.short_description = "Export as XLSX"
+
+
+class FastChangeList(ChangeList):
+    def get_queryset(self, request, *args, **kwargs):
+        queryset = super().get_queryset(request, *args, **kwargs)
+        return self.model_admin.get_changelist_queryset(request, queryset)
+
+
+class FastChangeListMixin:
+    """
+    Admin performance mode for changelists of large tables.
+
+    The count of unfiltered tables is estimated and never computed twice per
+    page, rows load only the concrete fields of ``list_display`` plus
+    ``changelist_only``, and ``changelist_annotations`` let previews be
+    computed by the database (e.g. ``Substr`` of a long text).
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    changelist_only = ()
+    changelist_annotations = {}
+
+    def get_changelist(self, request, **kwargs):
+        return FastChangeList
+
+    def get_changelist_fields(self, request) -> list:
+        fields = ["pk", *self.changelist_only]
+        for name in self.get_list_display(request):
+            try:
+                field = self.model._meta.get_field(name)
+            except FieldDoesNotExist:
+                continue
+            if field.concrete:
+                fields.append(name)
+        return fields
+
+    def get_changelist_queryset(self, request, queryset: QuerySet) -> QuerySet:
+        return queryset.only(*self.get_changelist_fields(request)).annotate(**self.changelist_annotations)
+
+
+class PaginatedInlineFormSet(BaseInlineFormSet):
+    """
+    Inline formset holding one page of the related objects (``?<prefix>-page=N``).
+
+    One object more than the page is fetched to tell whether a next page
+    exists, so no COUNT(*) runs however many objects are related.
+    """
+    per_page = 20
+    page = 1
+    has_next = False
+    query = None
+
+    @classmethod
+    def page_param(cls) -> str:
+        return f"{cls.get_default_prefix()}-page"
+
+    def page_query(self, page: int) -> str:
+        """
+        Query string of the change form with only the page of this inline replaced,
+        so the page of the other inlines and ``_changelist_filters`` are kept.
+        """
+        query = self.query.copy() if self.query is not None else QueryDict(mutable=True)
+        query[self.page_param()] = page
+        return query.urlencode()
+
+    @property
+    def previous_query(self) -> str:
+        return self.page_query(self.page - 1)
+
+    @property
+    def next_query(self) -> str:
+        return self.page_query(self.page + 1)
+
+    def get_queryset(self):
+        if not hasattr(self, "_queryset"):
+            start = (self.page - 1) * self.per_page
+            objects = list(super().get_queryset()[start:start + self.per_page + 1])
+            self.has_next = len(objects) > self.per_page
+            self._queryset = objects[:self.per_page]
+        return self._queryset
+
+
+class PaginatedInlineMixin:
+    """
+    Inline rendering a page of related objects with previous/next links.
+
+    Combine with ``autocomplete_fields`` (or ``raw_id_fields``) so the forms
+    do not render a ``<select>`` of the whole related table.
+    """
+    formset = PaginatedInlineFormSet
+    template = "admin/edit_inline/paginated_tabular.html"
+    per_page = 20
+    ordering = ("pk",)
+    extra = 1
+
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super().get_formset(request, obj, **kwargs)
+        formset.per_page = self.per_page
+        formset.query = request.GET
+        try:
+            formset.page = max(1, int(request.GET.get(formset.page_param(), 1)))
+        except ValueError:
+            formset.page = 1
+        return formset
+
+
+def prefix_range(field: str, prefix: str) -> Q:
+    """
+    Case-sensitive prefix lookup as a range, which any B-tree index on ``field`` serves
+    (unlike ``LIKE 'prefix%'``).
+    """
+    return Q(**{f"{field}__gte": prefix, f"{field}__lt": prefix + "\U0010ffff"})
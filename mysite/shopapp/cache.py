@@ -0,0 +1,156 @@
+"""
+Cache helpers of the shop.
+
+Generation counters: writers bump the generation of a scope instead of
+deleting keys. Cached pages are stored under keys that include the current
+generations, so old pages are never read again and simply expire.
+
+Stale-while-revalidate: :func:`get_or_recompute` keeps the generation inside
+the entry under a stable key. An entry of another generation is a miss and is
+never returned; an expired entry of the current generation is rebuilt by
+exactly one worker while the others keep serving it.
+"""
+import math
+import random
+import time
+from functools import wraps
+
+from django.core.cache import cache
+from django.db import transaction
+from django.views.decorators.cache import cache_page
+
+from .models import Order
+
+GENERATION_KEY = "generation:{scope}"
+
+
+def user_orders_scope(user_pk) -> str:
+    return f"user-orders:{user_pk}"
+
+
+def model_scope(model) -> str:
+    return f"model:{model._meta.label_lower}"
+
+
+def get_generation(scope: str) -> int:
+    key = GENERATION_KEY.format(scope=scope)
+    generation = cache.get(key)
+    if generation is None:
+        # Start from the current time, so an evicted counter never goes back
+        # to a generation that still has entries in the cache.
+        cache.add(key, time.time_ns() // 1000, None)
+        generation = cache.get(key, 0)
+    return generation
+
+
+def bump_generation(scope: str):
+    key = GENERATION_KEY.format(scope=scope)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns() // 1000, None)
+
+
+def get_generations(scopes) -> list:
+    keys = [GENERATION_KEY.format(scope=scope) for scope in scopes]
+    found = cache.get_many(keys)
+    return [
+        found[key] if key in found else get_generation(scope)
+        for scope, key in zip(scopes, keys)
+    ]
+
+
+def bump_generations(scopes):
+    for scope in set(scopes):
+        bump_generation(scope)
+
+
+def invalidate_models(*models):
+    """
+    Bumps generations of the models once the transaction commits.
+
+    Call it after writes that bypass model signals: queryset.update(), bulk_create(), ...
+    """
+    scopes = [model_scope(model) for model in models]
+    transaction.on_commit(lambda: bump_generations(scopes))
+
+
+def cache_page_for_models(timeout, *models):
+    """
+    Like cache_page, but the cache key includes generations of ``models``,
+    so any write to them makes the cached pages unreachable at once.
+    """
+    scopes = [model_scope(model) for model in models]
+
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            generations = "-".join(str(generation) for generation in get_generations(scopes))
+            cached_view = cache_page(timeout, key_prefix=f"models:{generations}")(view_func)
+            return cached_view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def invalidate_users_orders(user_pks):
+    """
+    Bumps cache generations of the users' order exports once the transaction commits.
+    """
+    user_pks = set(user_pks)
+    if user_pks:
+        transaction.on_commit(lambda: bump_generations(user_orders_scope(pk) for pk in user_pks))
+
+
+def users_of_orders(**filters):
+    return Order.objects.filter(**filters).values_list("user_id", flat=True).distinct()
+
+
+def get_or_recompute(key, compute, timeout=300, stale_timeout=None, lock_timeout=30, beta=1.0,
+                     generation=None, wait_timeout=5):
+    """
+    Returns the cached value of ``key``, recomputing it with ``compute()`` when needed.
+
+    After ``timeout`` seconds the value is stale: the first caller takes a short
+    lock and recomputes it while the others keep getting the stale value, for
+    at most ``stale_timeout`` seconds (10 * timeout by default). Shortly before
+    expiry callers refresh early with a probability that grows as the expiry
+    gets closer and with the recompute time (XFetch), so refreshes are spread out.
+
+    A value computed for another ``generation`` is never returned: like a miss,
+    one caller recomputes it and the others wait up to ``wait_timeout`` seconds
+    for the lock holder before recomputing themselves.
+    """
+    lock_key = f"{key}:lock"
+    entry = cache.get(key)
+    if entry is not None and entry[3] == generation:
+        value, expires_at, compute_time, _ = entry
+        early = compute_time * beta * -math.log(1.0 - random.random())
+        if time.time() + early < expires_at:
+            return value
+        if not cache.add(lock_key, 1, lock_timeout):
+            return value
+        locked = True
+    else:
+        locked = cache.add(lock_key, 1, lock_timeout)
+        if not locked:
+            # Nothing to serve for this generation: wait for the worker that recomputes the value
+            deadline = time.monotonic() + wait_timeout
+            while time.monotonic() < deadline:
+                time.sleep(0.05)
+                entry = cache.get(key)
+                if entry is not None and entry[3] == generation:
+                    return entry[0]
+
+    try:
+        started = time.monotonic()
+        value = compute()
+        compute_time = time.monotonic() - started
+        cache.set(
+            key,
+            (value, time.time() + timeout, compute_time, generation),
+            stale_timeout if stale_timeout is not None else timeout * 10,
+        )
+    finally:
+        if locked:
+            cache.delete(lock_key)
+    return value
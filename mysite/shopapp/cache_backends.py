@@ -0,0 +1,383 @@
+"""
+Shared-memory cache backend for several worker processes on one host.
+
+All gunicorn workers map the same file (LOCATION) and share one warm cache.
+The file is a fixed table of equally sized slots; a key may live in any of
+``PROBE`` slots after its home slot. Readers never take a lock: every slot
+has a sequence counter that writers make odd while they change the slot, so a
+reader that sees an odd or changed counter simply reads again (seqlock).
+Writers are serialized with flock() between processes and a threading lock
+inside a process. When the probe window is full the victim is chosen with
+the CLOCK algorithm: reads set a reference bit, eviction clears it and takes
+the first slot that has not been used since.
+
+Settings::
+
+    CACHES = {
+        "default": {
+            "BACKEND": "shopapp.cache_backends.MmapCache",
+            "LOCATION": "/var/tmp/django_cache.mmap",
+            "OPTIONS": {"SLOTS": 16384, "SLOT_SIZE": 4096, "FALLBACK": "overflow"},
+        },
+        "overflow": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": "/var/tmp/django_cache_overflow",
+        },
+    }
+
+A pickled key and value must fit into ``SLOT_SIZE`` minus a 32 byte header.
+Larger values (cached pages, exports) are stored in the ``FALLBACK`` cache
+with a marker in the slot; without a fallback they are not cached, a
+warning is logged and ``set_many()`` returns their keys. ``clear()`` removes
+only the spilled keys from the fallback, so its alias may be shared.
+
+The mapped file is ``LOCATION`` suffixed with the format version and the
+layout (``.v2-16384x4096``), so changing SLOTS or SLOT_SIZE creates a new
+file instead of resizing one that other workers still map.
+"""
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"DJMMAPC2"
+FILE_VERSION = 2
+# magic, slots, slot size
+FILE_HEADER = struct.Struct("<8sII")
+FILE_HEADER_SIZE = 64
+# seq, reference bit, key hash, expires at (0 - never), key length, value length
+SLOT_HEADER = struct.Struct("<IB3xQdHI")
+SEQ = struct.Struct("<I")
+REF_OFFSET = 4
+READ_RETRIES = 16
+
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+
+class _Spilled:
+    """
+    Slot value of an entry stored in the fallback cache.
+    """
+
+
+SPILLED = _Spilled()
+
+
+def _thread_lock(path) -> threading.Lock:
+    with _thread_locks_guard:
+        return _thread_locks.setdefault(path, threading.RLock())
+
+
+class _WriteLock:
+    def __init__(self, cache: "MmapCache"):
+        self.cache = cache
+
+    def __enter__(self):
+        self.cache._thread_lock.acquire()
+        fcntl.flock(self.cache._file.fileno(), fcntl.LOCK_EX)
+
+    def __exit__(self, *exc_info):
+        fcntl.flock(self.cache._file.fileno(), fcntl.LOCK_UN)
+        self.cache._thread_lock.release()
+
+
+class MmapCache(BaseCache):
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self.slots = int(options.get("SLOTS", 16384))
+        self.slot_size = int(options.get("SLOT_SIZE", 4096))
+        self.path = f"{location}.v{FILE_VERSION}-{self.slots}x{self.slot_size}"
+        self.probe = min(int(options.get("PROBE", 8)), self.slots)
+        self.payload_size = self.slot_size - SLOT_HEADER.size
+        self.fallback_alias = options.get("FALLBACK")
+        self._thread_lock = _thread_lock(self.path)
+        self._pid = None
+        self._file = None
+        self._map = None
+
+    # Mapping
+
+    def _mapping(self) -> mmap.mmap:
+        if self._pid != os.getpid():
+            self._open()
+        return self._map
+
+    def _open(self):
+        size = FILE_HEADER_SIZE + self.slots * self.slot_size
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = os.fdopen(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600), "r+b")
+        with self._thread_lock:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            try:
+                # The file name holds the layout, so it is only ever created here,
+                # never shrunk under the mappings of other workers.
+                if os.fstat(self._file.fileno()).st_size < size:
+                    self._file.truncate(size)
+                self._file.seek(0)
+                if self._file.read(FILE_HEADER.size) != FILE_HEADER.pack(MAGIC, self.slots, self.slot_size):
+                    self._file.seek(0)
+                    self._file.write(FILE_HEADER.pack(MAGIC, self.slots, self.slot_size))
+                    self._file.flush()
+            finally:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._file.fileno(), size)
+        self._pid = os.getpid()
+
+    def _write_lock(self) -> _WriteLock:
+        self._mapping()
+        return _WriteLock(self)
+
+    # Slots
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little") or 1
+
+    def _offset(self, index: int) -> int:
+        return FILE_HEADER_SIZE + index * self.slot_size
+
+    def _window(self, key_hash: int):
+        home = key_hash % self.slots
+        return [(home + step) % self.slots for step in range(self.probe)]
+
+    def _read_slot(self, index: int):
+        """
+        Consistent snapshot (key hash, expires at, key, value bytes) of a slot
+        or None if it keeps changing under the reader.
+        """
+        data = self._mapping()
+        offset = self._offset(index)
+        for _ in range(READ_RETRIES):
+            seq, = SEQ.unpack_from(data, offset)
+            if seq % 2:
+                continue
+            _, _, key_hash, expires_at, key_len, value_len = SLOT_HEADER.unpack_from(data, offset)
+            if key_hash == 0 or key_len + value_len > self.payload_size:
+                payload = b""
+            else:
+                start = offset + SLOT_HEADER.size
+                payload = data[start:start + key_len + value_len]
+            if SEQ.unpack_from(data, offset)[0] != seq:
+                continue
+            return key_hash, expires_at, payload[:key_len], payload[key_len:]
+        return None
+
+    def _write_slot(self, index: int, key_hash: int, expires_at: float, key: bytes, value: bytes):
+        data = self._map
+        offset = self._offset(index)
+        seq, = SEQ.unpack_from(data, offset)
+        # Odd under the write lock: a writer died mid-write, the slot is reclaimed
+        seq += seq % 2
+        SEQ.pack_into(data, offset, seq + 1)
+        SLOT_HEADER.pack_into(data, offset, seq + 1, 1, key_hash, expires_at, len(key), len(value))
+        start = offset + SLOT_HEADER.size
+        data[start:start + len(key) + len(value)] = key + value
+        SEQ.pack_into(data, offset, seq + 2)
+
+    def _clear_slot(self, index: int):
+        self._write_slot(index, 0, 0.0, b"", b"")
+
+    def _find(self, key: str):
+        """
+        Returns (slot index, expires at, value bytes) of a live entry or None.
+        """
+        key_hash = self._hash(key)
+        encoded = key.encode()
+        for index in self._window(key_hash):
+            snapshot = self._read_slot(index)
+            if snapshot is None or snapshot[0] != key_hash or snapshot[2] != encoded:
+                continue
+            expires_at = snapshot[1]
+            if expires_at and expires_at <= time.time():
+                return None
+            return index, expires_at, snapshot[3]
+        return None
+
+    def _choose_slot(self, key: str) -> int:
+        """
+        Slot for writing ``key``: its current slot, a free or expired one, or a CLOCK victim.
+        """
+        key_hash = self._hash(key)
+        encoded = key.encode()
+        window = self._window(key_hash)
+        now = time.time()
+        free = None
+        for index in window:
+            snapshot = self._read_slot(index)
+            if snapshot is None:
+                # Only a dead writer leaves a slot changing under the write lock
+                if free is None:
+                    free = index
+                continue
+            slot_hash, expires_at, slot_key, _ = snapshot
+            if slot_hash == key_hash and slot_key == encoded:
+                return index
+            if free is None and (slot_hash == 0 or (expires_at and expires_at <= now)):
+                free = index
+        if free is not None:
+            return free
+        data = self._map
+        for _ in range(2):
+            for index in window:
+                offset = self._offset(index) + REF_OFFSET
+                if data[offset] == 0:
+                    return index
+                data[offset] = 0
+        return window[0]
+
+    def _store(self, key: str, value, timeout) -> bool:
+        expires_at = self.get_backend_timeout(timeout)
+        if expires_at is not None and expires_at <= time.time():
+            # Stored and expired at once, like in the other backends
+            self._delete(key)
+            return True
+        encoded = key.encode()
+        pickled = pickle.dumps(value, self.pickle_protocol)
+        if len(encoded) + len(pickled) > self.payload_size:
+            fallback = self._fallback()
+            if fallback is None:
+                log.warning(
+                    "Value of %s is %d bytes, more than SLOT_SIZE allows: not cached, configure FALLBACK",
+                    key, len(pickled),
+                )
+                self._delete(key)
+                return False
+            fallback.set(key, value, timeout)
+            pickled = pickle.dumps(SPILLED, self.pickle_protocol)
+        self._write_slot(self._choose_slot(key), self._hash(key), expires_at or 0.0, encoded, pickled)
+        return True
+
+    def _delete(self, key: str) -> bool:
+        found = self._find(key)
+        if found is None:
+            return False
+        if self._load(key, found[2]) is SPILLED:
+            self._fallback().delete(key)
+        self._clear_slot(found[0])
+        return True
+
+    def _fallback(self):
+        return caches[self.fallback_alias] if self.fallback_alias else None
+
+    def _load(self, key: str, value: bytes):
+        """
+        Unpickled slot value; SPILLED when the fallback cache holds it.
+        """
+        loaded = pickle.loads(value)
+        return SPILLED if isinstance(loaded, _Spilled) else loaded
+
+    # Django cache API
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        found = self._find(key)
+        if found is None:
+            return default
+        index, _, value = found
+        self._map[self._offset(index) + REF_OFFSET] = 1
+        value = self._load(key, value)
+        if value is SPILLED:
+            return self._fallback().get(key, default)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        with self._write_lock():
+            self._store(key, value, timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed_keys = []
+        for key, value in data.items():
+            validated_key = self.make_and_validate_key(key, version=version)
+            with self._write_lock():
+                if not self._store(validated_key, value, timeout):
+                    failed_keys.append(key)
+        return failed_keys
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        with self._write_lock():
+            if self._find(key) is not None:
+                return False
+            return self._store(key, value, timeout)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        with self._write_lock():
+            found = self._find(key)
+            if found is None:
+                return False
+            value = self._load(key, found[2])
+            if value is SPILLED and not self._fallback().touch(key, timeout):
+                self._delete(key)
+                return False
+            # A SPILLED value stores the marker again with the new expiry
+            self._store(key, value, timeout)
+            return True
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        with self._write_lock():
+            return self._delete(key)
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        with self._write_lock():
+            found = self._find(key)
+            if found is None:
+                raise ValueError("Key '%s' not found" % key)
+            _, expires_at, value = found
+            value = self._load(key, value)
+            if value is SPILLED:
+                value = self._fallback().get(key)
+                if value is None:
+                    raise ValueError("Key '%s' not found" % key)
+            new_value = value + delta
+            encoded = key.encode()
+            pickled = pickle.dumps(new_value, self.pickle_protocol)
+            self._write_slot(found[0], self._hash(key), expires_at, encoded, pickled)
+        return new_value
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return self._find(key) is not None
+
+    def clear(self):
+        spilled = []
+        with self._write_lock():
+            for index in range(self.slots):
+                snapshot = self._read_slot(index)
+                if snapshot is not None and snapshot[0]:
+                    key = snapshot[2].decode()
+                    try:
+                        if self._load(key, snapshot[3]) is SPILLED:
+                            spilled.append(key)
+                    except Exception:
+                        # A slot that does not unpickle is cleared like any other
+                        pass
+                if snapshot is None or snapshot[0]:
+                    self._clear_slot(index)
+            # Only the keys of this cache, other entries of the fallback alias stay
+            fallback = self._fallback()
+            if fallback is not None and spilled:
+                fallback.delete_many(spilled)
+
+    def close(self, **kwargs):
+        # The mapping is kept open between requests on purpose.
+        pass
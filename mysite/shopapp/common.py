@@ -1,37 +1,406 @@
-from csv import DictReader
+import hashlib
+from csv import DictReader, writer as csv_writer
+from dataclasses import dataclass, field
+from decimal import Decimal
 from io import TextIOWrapper
+from typing import NamedTuple, Optional
 
-from shopapp.models import Product, Order
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import DecimalField
+from django.utils import timezone
 
+from shopapp.cache import invalidate_models, invalidate_users_orders, users_of_orders
+from shopapp.models import Product, Order, effective_price
+from shopapp.search import index_products
+from shopapp.sitemap import mark_sitemaps_dirty
+from shopapp.surrogate import purge_instances
+from shopapp.totals import effective_prices, recompute_orders_for_products
+from shopapp.utils import batched
 
-def save_csv_products(file, encoding):
-    csv_file = TextIOWrapper(
-        file,
-        encoding=encoding
-    )
+PRODUCT_CSV_FIELDS = (
+    "name",
+    "description",
+    "price",
+    "discount",
+    "archived",
+)
+ORDER_CSV_SCALAR_FIELDS = (
+    "delivery_address",
+    "promocode",
+)
+ORDER_CSV_FIELDS = ORDER_CSV_SCALAR_FIELDS + (
+    "user_id",
+    "username",
+    "product_ids",
+    "product_names",
+)
 
-    reader = DictReader(csv_file)
-    products = [
-        Product(**row)
-        for row in reader
-    ]
-    Product.objects.bulk_create(products)
-    return products
 
+@dataclass
+class CSVImportResult:
+    """
+    Summary of a CSV import: how many rows were written and which were rejected.
+
+    Only the first ``max_errors`` rejected rows keep their error details,
+    so a broken file cannot blow up memory.
+    """
+    imported: int = 0
+    rejected: int = 0
+    errors: list = field(default_factory=list)
+    max_errors: int = 1000
+
+    def reject(self, line: int, errors: dict):
+        self.rejected += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"line": line, "errors": errors})
 
-def save_csv_orders(file, encoding):
+    def as_dict(self) -> dict:
+        return {
+            "imported": self.imported,
+            "rejected": self.rejected,
+            "errors": self.errors,
+        }
+
+
+def read_csv(file, encoding, allowed_fields, required_fields=()) -> DictReader:
     csv_file = TextIOWrapper(
         file,
         encoding=encoding
     )
-
     reader = DictReader(csv_file)
-    #for row in reader:
-    #    print(row, 1)
-    orders = [
-        Order(**row)
-        for row in reader
-    ]
-
-    Order.objects.bulk_create(orders)
-    return orders
\ No newline at end of file
+    unknown = set(reader.fieldnames or ()) - set(allowed_fields)
+    if unknown:
+        raise ValueError(f"Unknown CSV columns: {', '.join(sorted(unknown))}")
+    missing = set(required_fields) - set(reader.fieldnames or ())
+    if missing:
+        raise ValueError(f"Missing CSV columns: {', '.join(sorted(missing))}")
+    return reader
+
+
+def clean_csv_row(model, row: dict) -> dict:
+    """
+    Converts raw CSV strings to python values with the model field definitions.
+
+    Empty cells fall back to the field default. Raises ValidationError
+    with a per-column error dict.
+    """
+    if None in row:
+        raise ValidationError({"__all__": ["Row has more values than the header"]})
+    values = {}
+    errors = {}
+    for name, raw in row.items():
+        model_field = model._meta.get_field(name)
+        if raw in ("", None) and model_field.has_default():
+            continue
+        try:
+            values[model_field.attname] = model_field.clean(raw, None)
+        except ValidationError as exc:
+            errors[name] = exc.messages
+    if errors:
+        raise ValidationError(errors)
+    return values
+
+
+def iter_clean_rows(reader: DictReader, model, result: CSVImportResult):
+    """
+    Yields (line number, cleaned values) for valid rows, rejected rows go to ``result``.
+    """
+    for row in reader:
+        try:
+            values = clean_csv_row(model, row)
+        except ValidationError as exc:
+            result.reject(reader.line_num, exc.message_dict)
+            continue
+        yield reader.line_num, values
+
+
+def save_csv_products(file, encoding, batch_size=1000) -> CSVImportResult:
+    """
+    Imports products from a CSV file without loading it into memory.
+
+    Rows are validated one by one and written in ``batch_size`` chunks,
+    each chunk in its own transaction.
+    """
+    reader = read_csv(file, encoding, PRODUCT_CSV_FIELDS, required_fields={"name"})
+    result = CSVImportResult()
+    rows = iter_clean_rows(reader, Product, result)
+    for batch in batched(rows, batch_size):
+        with transaction.atomic():
+            products = Product.objects.bulk_create(
+                Product(**values)
+                for line, values in batch
+            )
+            index_products([product.pk for product in products])
+            invalidate_models(Product)
+            purge_instances(Product, [product.pk for product in products])
+            mark_sitemaps_dirty(Product, [product.pk for product in products])
+        result.imported += len(batch)
+    return result
+
+
+@dataclass
+class CSVSyncResult(CSVImportResult):
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    archived: int = 0
+
+    def as_dict(self) -> dict:
+        data = super().as_dict()
+        data.update(
+            inserted=self.inserted,
+            updated=self.updated,
+            unchanged=self.unchanged,
+            archived=self.archived,
+        )
+        return data
+
+
+def _content_hash(model, columns, values: dict) -> bytes:
+    digest = hashlib.blake2b(digest_size=16)
+    for name in columns:
+        model_field = model._meta.get_field(name)
+        value = values[name]
+        if isinstance(model_field, DecimalField) and value is not None:
+            value = value.quantize(Decimal(1).scaleb(-model_field.decimal_places))
+        digest.update(repr(value).encode())
+        digest.update(b"\0")
+    return digest.digest()
+
+
+def sync_csv_products(file, encoding, key="name", archive_missing=False, batch_size=1000) -> CSVSyncResult:
+    """
+    Upserts products from a CSV feed keyed on the ``key`` column.
+
+    Existing products are loaded once as a key -> (pk, content hash) map, so only
+    new rows are inserted and only changed rows are updated. With ``archive_missing``
+    products absent from the feed are archived and returning ones are unarchived.
+    """
+    # New products are created from the feed, so it needs their names too
+    reader = read_csv(file, encoding, PRODUCT_CSV_FIELDS, required_fields={key, "name"})
+    columns = [name for name in reader.fieldnames if name != key]
+    if archive_missing and "archived" not in columns:
+        columns.append("archived")
+    defaults = {
+        name: Product._meta.get_field(name).get_default()
+        for name in columns
+    }
+
+    # Rows come in descending pk order, so the oldest product wins for duplicated keys.
+    existing = {}
+    rows = Product.objects.order_by("-pk").values_list("pk", key, *columns)
+    for pk, key_value, *values in rows.iterator(chunk_size=batch_size):
+        existing[key_value] = (pk, _content_hash(Product, columns, dict(zip(columns, values))))
+
+    result = CSVSyncResult()
+    seen = set()
+    for batch in batched(iter_clean_rows(reader, Product, result), batch_size):
+        to_create = []
+        to_update = []
+        for line, values in batch:
+            key_value = values.pop(key, None)
+            if key_value is None:
+                result.reject(line, {key: ["Key value is required"]})
+                continue
+            if key_value in seen:
+                result.reject(line, {key: [f"Duplicate key {key_value!r}"]})
+                continue
+            seen.add(key_value)
+            values = {**defaults, **values}
+            if key_value not in existing:
+                to_create.append(Product(**{key: key_value}, **values))
+                continue
+            pk, content_hash = existing[key_value]
+            if content_hash == _content_hash(Product, columns, values):
+                result.unchanged += 1
+            else:
+                # bulk_update() skips auto_now, so the timestamp is set by hand
+                to_update.append(Product(pk=pk, updated_at=timezone.now(), **values))
+
+        with transaction.atomic():
+            Product.objects.bulk_create(to_create)
+            if to_update:
+                Product.objects.bulk_update(to_update, [*columns, "updated_at"])
+            index_products([product.pk for product in to_create + to_update])
+            invalidate_models(Product)
+            purge_instances(Product, [product.pk for product in to_create + to_update])
+            mark_sitemaps_dirty(Product, [product.pk for product in to_create + to_update])
+            if {"price", "discount"} & set(columns):
+                recompute_orders_for_products([product.pk for product in to_update])
+            if "name" in columns:
+                invalidate_users_orders(users_of_orders(products__in=[product.pk for product in to_update]))
+        result.inserted += len(to_create)
+        result.updated += len(to_update)
+
+    result.imported = result.inserted + result.updated
+    if archive_missing:
+        missing = [pk for key_value, (pk, _) in existing.items() if key_value not in seen]
+        for pks in batched(missing, batch_size):
+            result.archived += (
+                Product.objects
+                .filter(pk__in=pks, archived=False)
+                .update(archived=True, updated_at=timezone.now())
+            )
+            purge_instances(Product, pks)
+            mark_sitemaps_dirty(Product, pks)
+        invalidate_models(Product)
+    return result
+
+
+class OrderRow(NamedTuple):
+    line: int
+    values: dict
+    user_id: Optional[int]
+    username: Optional[str]
+    product_ids: set
+    product_names: set
+
+
+def _split_list(raw) -> list:
+    return [item.strip() for item in (raw or "").split(";") if item.strip()]
+
+
+def iter_order_rows(reader: DictReader, result: CSVImportResult):
+    """
+    Yields parsed order rows; users and products are resolved later per batch.
+    """
+    for row in reader:
+        errors = {}
+        try:
+            values = clean_csv_row(Order, {
+                name: row[name]
+                for name in ORDER_CSV_SCALAR_FIELDS
+                if name in row
+            })
+        except ValidationError as exc:
+            values = {}
+            errors.update(exc.message_dict)
+        if None in row:
+            errors["__all__"] = ["Row has more values than the header"]
+
+        user_id = username = None
+        try:
+            if row.get("user_id"):
+                user_id = int(row["user_id"])
+            elif row.get("username"):
+                username = row["username"].strip()
+            else:
+                errors["user_id"] = ["Either user_id or username is required"]
+        except ValueError:
+            errors["user_id"] = ["Enter a whole number."]
+
+        try:
+            product_ids = {int(pk) for pk in _split_list(row.get("product_ids"))}
+        except ValueError:
+            errors["product_ids"] = ["Product ids must be whole numbers separated by ';'"]
+            product_ids = set()
+        product_names = set(_split_list(row.get("product_names")))
+
+        if errors:
+            result.reject(reader.line_num, errors)
+            continue
+        yield OrderRow(reader.line_num, values, user_id, username, product_ids, product_names)
+
+
+def _save_orders_batch(batch: list, result: CSVImportResult):
+    """
+    Resolves users and products of the whole batch with a few set-based queries,
+    then writes orders and their product links with one bulk_create each.
+    """
+    user_ids = {row.user_id for row in batch if row.user_id is not None}
+    usernames = {row.username for row in batch if row.username is not None}
+    product_ids = set().union(*(row.product_ids for row in batch))
+    product_names = set().union(*(row.product_names for row in batch))
+
+    known_user_ids = set(User.objects.filter(pk__in=user_ids).values_list("pk", flat=True))
+    user_by_name = dict(User.objects.filter(username__in=usernames).values_list("username", "pk"))
+    prices = effective_prices(product_ids)
+    product_by_name = {}
+    ambiguous_names = set()
+    named_products = Product.objects.filter(name__in=product_names).values_list("name", "pk", "price", "discount")
+    for name, pk, price, discount in named_products:
+        if name in product_by_name:
+            ambiguous_names.add(name)
+        product_by_name[name] = pk
+        prices[pk] = effective_price(price, discount)
+
+    orders = []
+    links = []
+    for row in batch:
+        errors = {}
+        user_id = row.user_id
+        if row.username is not None:
+            user_id = user_by_name.get(row.username)
+            if user_id is None:
+                errors["username"] = [f"Unknown user {row.username!r}"]
+        elif user_id not in known_user_ids:
+            errors["user_id"] = [f"Unknown user id {user_id}"]
+
+        missing_ids = row.product_ids - prices.keys()
+        if missing_ids:
+            errors["product_ids"] = [f"Unknown product ids: {sorted(missing_ids)}"]
+        missing_names = row.product_names - product_by_name.keys()
+        if missing_names:
+            errors["product_names"] = [f"Unknown products: {sorted(missing_names)}"]
+        if row.product_names & ambiguous_names:
+            errors.setdefault("product_names", []).append(
+                f"Ambiguous products: {sorted(row.product_names & ambiguous_names)}"
+            )
+        if errors:
+            result.reject(row.line, errors)
+            continue
+
+        order_product_ids = row.product_ids | {product_by_name[name] for name in row.product_names}
+        orders.append(Order(
+            user_id=user_id,
+            total=sum((prices[pk] for pk in order_product_ids), Decimal(0)),
+            products_count=len(order_product_ids),
+            **row.values,
+        ))
+        links.append(order_product_ids)
+
+    with transaction.atomic():
+        Order.objects.bulk_create(orders)
+        Order.products.through.objects.bulk_create(
+            Order.products.through(order_id=order.pk, product_id=product_id)
+            for order, order_product_ids in zip(orders, links)
+            for product_id in order_product_ids
+        )
+        invalidate_users_orders(order.user_id for order in orders)
+        invalidate_models(Order)
+        purge_instances(Order, [order.pk for order in orders])
+    result.imported += len(orders)
+
+
+def save_csv_orders(file, encoding, batch_size=1000) -> CSVImportResult:
+    """
+    Imports orders from a CSV file in batches.
+
+    The user is given by ``user_id`` or ``username``, products by ``product_ids``
+    and/or ``product_names`` columns holding ';'-separated lists.
+    """
+    reader = read_csv(file, encoding, ORDER_CSV_FIELDS)
+    result = CSVImportResult()
+    for batch in batched(iter_order_rows(reader, result), batch_size):
+        _save_orders_batch(batch, result)
+    return result
+
+
+class Echo:
+    """
+    Pseudo-buffer for csv.writer: write() returns the line instead of storing it.
+    """
+    def write(self, value):
+        return value
+
+
+def iter_csv(header, rows, chunk_size=1000):
+    """
+    Lazily renders rows as CSV text, one chunk of ``chunk_size`` rows at a time.
+    """
+    writer = csv_writer(Echo())
+    yield writer.writerow(header)
+    for chunk in batched(rows, chunk_size):
+        yield "".join(writer.writerow(row) for row in chunk)
@@ -0,0 +1,116 @@
+"""
+Facet counts of product lists.
+
+Every facet is a set of named buckets (a range of a field). All buckets of
+all facets are counted over the filtered queryset with one aggregate query
+of conditional ``COUNT``\\ s, and the result is cached per filter signature
+with the ``Product`` cache generation: paging through one result set reuses
+it, and after a product write one request recounts while the others wait
+for the new counts instead of getting the previous ones.
+"""
+import hashlib
+from datetime import timedelta
+
+from django.db.models import Count, Q, QuerySet
+from django.utils import timezone
+
+from .cache import get_generation, get_or_recompute, model_scope
+from .models import Product
+
+# facet -> [(bucket, lower bound or None, upper bound or None)], lower bound included
+PRICE_BUCKETS = [
+    ("0-50", None, 50),
+    ("50-100", 50, 100),
+    ("100-500", 100, 500),
+    ("500-1000", 500, 1000),
+    ("1000+", 1000, None),
+]
+DISCOUNT_BUCKETS = [
+    ("0", None, 1),
+    ("1-10", 1, 10),
+    ("10-25", 10, 25),
+    ("25-50", 25, 50),
+    ("50+", 50, None),
+]
+# created_at buckets are ages
+CREATED_BUCKETS = [
+    ("day", timedelta(days=1)),
+    ("week", timedelta(weeks=1)),
+    ("month", timedelta(days=30)),
+    ("year", timedelta(days=365)),
+]
+
+# Query parameters that page or order the list without changing its rows
+NON_FILTER_PARAMS = {"cursor", "page_size", "with_count", "ordering", "format", "fields", "omit", "expand"}
+
+FACETS_TIMEOUT = 5 * 60
+
+
+def range_q(field: str, low, high) -> Q:
+    q = Q()
+    if low is not None:
+        q &= Q(**{f"{field}__gte": low})
+    if high is not None:
+        q &= Q(**{f"{field}__lt": high})
+    return q
+
+
+def created_q(bucket: str, now=None) -> Q:
+    """
+    Products created within the age of ``bucket``; "older" is everything past a year.
+    """
+    now = now or timezone.now()
+    ages = dict(CREATED_BUCKETS)
+    if bucket == "older":
+        return Q(created_at__lt=now - ages["year"])
+    return Q(created_at__gte=now - ages[bucket])
+
+
+def bucket_q(facet: str, bucket: str) -> Q:
+    if facet == "created":
+        return created_q(bucket)
+    field, buckets = {"price": ("price", PRICE_BUCKETS), "discount": ("discount", DISCOUNT_BUCKETS)}[facet]
+    for name, low, high in buckets:
+        if name == bucket:
+            return range_q(field, low, high)
+    raise KeyError(bucket)
+
+
+def facet_counts(queryset: QuerySet) -> dict:
+    """
+    Counts every bucket of every facet over ``queryset`` with one query.
+    """
+    now = timezone.now()
+    aggregates = {}
+    for name, low, high in PRICE_BUCKETS:
+        aggregates[f"price:{name}"] = Count("pk", filter=range_q("price", low, high))
+    for name, low, high in DISCOUNT_BUCKETS:
+        aggregates[f"discount:{name}"] = Count("pk", filter=range_q("discount", low, high))
+    for name, _ in [*CREATED_BUCKETS, ("older", None)]:
+        aggregates[f"created:{name}"] = Count("pk", filter=created_q(name, now))
+    aggregates["archived:active"] = Count("pk", filter=Q(archived=False))
+    aggregates["archived:archived"] = Count("pk", filter=Q(archived=True))
+
+    counts = queryset.order_by().aggregate(**aggregates)
+    facets = {}
+    for key, count in counts.items():
+        facet, bucket = key.split(":", 1)
+        facets.setdefault(facet, {})[bucket] = count
+    return facets
+
+
+def filter_signature(params) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for name in sorted(set(params) - NON_FILTER_PARAMS):
+        for value in sorted(params.getlist(name)):
+            digest.update(f"{name}={value}\0".encode())
+    return digest.hexdigest()
+
+
+def get_facets(queryset: QuerySet, params) -> dict:
+    """
+    Facet counts of the filtered ``queryset``, cached per filter signature of the query ``params``.
+    """
+    generation = get_generation(model_scope(Product))
+    key = f"product-facets:{filter_signature(params)}"
+    return get_or_recompute(key, lambda: facet_counts(queryset), timeout=FACETS_TIMEOUT, generation=generation)
@@ -0,0 +1,261 @@
+"""
+Fast read-only path for list endpoints.
+
+Rows are fetched with ``values()`` instead of model instances, every
+serializer field is compiled once per request into a plain converter of
+the column value (``Decimal`` quantizing, timezone-aware ISO 8601
+datetimes, file URLs...), many-to-many pks are read with one query per
+page, and the response is encoded with ``orjson``. The output is
+byte-identical to ``ModelSerializer`` + ``JSONRenderer``; serializers with
+fields that need model instances (methods, nested serializers, properties)
+are not compiled and take the regular path.
+"""
+import decimal
+from collections import defaultdict
+
+import orjson
+from rest_framework import fields as drf_fields
+from rest_framework import relations
+from rest_framework.renderers import JSONRenderer
+from rest_framework.serializers import BaseSerializer
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+from django.core.exceptions import FieldDoesNotExist
+from django.http import HttpResponse
+
+from .pagination import KeysetPagination
+
+# Fields whose to_representation() is a plain type conversion of the column value
+SIMPLE_FIELDS = {
+    drf_fields.CharField: str,
+    drf_fields.IntegerField: int,
+}
+# Fields whose to_representation() needs more than the column value,
+# or whose output orjson would encode differently from json.dumps (floats)
+UNSUPPORTED_FIELDS = (
+    drf_fields.SerializerMethodField,
+    drf_fields.HiddenField,
+    drf_fields.FloatField,
+    BaseSerializer,
+    relations.HyperlinkedRelatedField,
+    relations.SlugRelatedField,
+    relations.StringRelatedField,
+)
+
+_encoder = JSONEncoder()
+
+
+class Unsupported(Exception):
+    pass
+
+
+def dumps(data) -> bytes:
+    """
+    ``JSONRenderer`` output (compact, unicode) encoded with orjson.
+    """
+    content = orjson.dumps(
+        data,
+        default=_encoder.default,
+        option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_SUBCLASS | orjson.OPT_PASSTHROUGH_DATACLASS,
+    )
+    # JSONRenderer escapes them to stay a strict javascript subset
+    return content.replace("\u2028".encode(), b"\\u2028").replace("\u2029".encode(), b"\\u2029")
+
+
+def decimal_converter(field: drf_fields.DecimalField):
+    coerce_to_string = getattr(field, "coerce_to_string", api_settings.COERCE_DECIMAL_TO_STRING)
+    if not coerce_to_string or field.localize or field.normalize_output or field.decimal_places is None:
+        return field.to_representation
+    exponent = decimal.Decimal(".1") ** field.decimal_places
+    context = decimal.getcontext().copy()
+    if field.max_digits is not None:
+        context.prec = field.max_digits
+    rounding = field.rounding
+
+    def convert(value):
+        if not isinstance(value, decimal.Decimal):
+            value = decimal.Decimal(str(value).strip())
+        return f"{value.quantize(exponent, rounding=rounding, context=context):f}"
+    return convert
+
+
+def datetime_converter(field: drf_fields.DateTimeField):
+    output_format = getattr(field, "format", api_settings.DATETIME_FORMAT)
+    field_timezone = field.timezone if hasattr(field, "timezone") else field.default_timezone()
+    if output_format is None or output_format.lower() != drf_fields.ISO_8601 or field_timezone is None:
+        return field.to_representation
+
+    def convert(value):
+        if value.tzinfo is None:
+            return field.to_representation(value)
+        value = value.astimezone(field_timezone).isoformat()
+        if value.endswith("+00:00"):
+            value = value[:-6] + "Z"
+        return value
+    return convert
+
+
+def file_converter(field: drf_fields.FileField, model_field):
+    use_url = getattr(field, "use_url", api_settings.UPLOADED_FILES_USE_URL)
+    request = field.context.get("request")
+    storage = model_field.storage
+
+    def convert(name):
+        if not name:
+            return None
+        if not use_url:
+            return name
+        url = storage.url(name)
+        return request.build_absolute_uri(url) if request is not None else url
+    return convert
+
+
+class RowSerializer:
+    """
+    Serializer fields compiled into converters of ``values()`` rows.
+    """
+
+    def __init__(self, serializer):
+        self.model = serializer.Meta.model
+        self.fields = []
+        self.many = {}
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            self.fields.append((name, *self.compile(name, field)))
+
+    def compile(self, name: str, field) -> tuple:
+        """
+        Returns (values() column or None for many-to-many, converter or None for identity).
+        """
+        if isinstance(field, UNSUPPORTED_FIELDS) or "." in field.source or field.source == "*":
+            raise Unsupported(name)
+        meta = self.model._meta
+        if field.source == "pk":
+            model_field = meta.pk
+        else:
+            try:
+                model_field = meta.get_field(field.source)
+            except FieldDoesNotExist:
+                raise Unsupported(name)
+        if isinstance(field, relations.ManyRelatedField):
+            child = field.child_relation
+            if not model_field.many_to_many or not isinstance(child, relations.PrimaryKeyRelatedField) or child.pk_field:
+                raise Unsupported(name)
+            self.many[name] = model_field
+            return None, None
+        if not model_field.concrete or model_field.many_to_many:
+            raise Unsupported(name)
+        column = "pk" if field.source == "pk" else model_field.name
+        if isinstance(field, relations.PrimaryKeyRelatedField):
+            if field.pk_field:
+                raise Unsupported(name)
+            return column, None
+        if isinstance(field, relations.RelatedField):
+            raise Unsupported(name)
+        if isinstance(field, drf_fields.DecimalField):
+            return column, decimal_converter(field)
+        if isinstance(field, drf_fields.DateTimeField):
+            return column, datetime_converter(field)
+        if isinstance(field, drf_fields.FileField):
+            return column, file_converter(field, model_field)
+        if type(field) is drf_fields.ReadOnlyField:
+            return column, None
+        if type(field) is drf_fields.BooleanField and model_field.get_internal_type() == "BooleanField":
+            return column, None
+        if type(field) in SIMPLE_FIELDS:
+            return column, SIMPLE_FIELDS[type(field)]
+        # Choice, JSON, UUID, date... fields convert the column value itself
+        return column, field.to_representation
+
+    @property
+    def columns(self) -> list:
+        return [column for _, column, _ in self.fields if column is not None]
+
+    def fetch_many(self, model_field, pks: list) -> dict:
+        """
+        pks of the related objects per row, in the order a prefetch of the relation returns them.
+        """
+        related_name = model_field.related_query_name()
+        rows = (
+            model_field.related_model._default_manager
+            .filter(**{f"{related_name}__in": pks})
+            .values_list(related_name, "pk")
+        )
+        found = defaultdict(list)
+        for pk, related_pk in rows:
+            found[pk].append(related_pk)
+        return found
+
+    def to_representation(self, rows: list) -> list:
+        pks = [row["pk"] for row in rows]
+        many = {name: self.fetch_many(model_field, pks) for name, model_field in self.many.items()} if pks else {}
+        results = []
+        for row in rows:
+            item = {}
+            for name, column, convert in self.fields:
+                if column is None:
+                    item[name] = many[name].get(row["pk"], []) if many else []
+                    continue
+                value = row[column]
+                item[name] = value if value is None or convert is None else convert(value)
+            results.append(item)
+        return results
+
+
+def compile_serializer(serializer):
+    """
+    RowSerializer of ``serializer`` or None when some of its fields need model instances.
+    """
+    try:
+        return RowSerializer(serializer)
+    except Unsupported:
+        return None
+
+
+class FastJSONListMixin:
+    """
+    ModelViewSet mixin rendering JSON lists from ``values()`` rows.
+
+    Taken only for plain JSON responses (no ``?expand=``, no ``indent``) and
+    keyset-paginated or unpaginated lists; everything else goes through the
+    serializer as usual.
+    """
+    fast_json = True
+
+    def get_row_serializer(self, request):
+        if not self.fast_json:
+            return None
+        renderer = getattr(request, "accepted_renderer", None)
+        if (
+            type(renderer) is not JSONRenderer
+            or renderer.ensure_ascii
+            or not renderer.compact
+            or renderer.get_indent(request.accepted_media_type, {}) is not None
+        ):
+            return None
+        if getattr(self, "get_expand", dict)():
+            return None
+        if self.paginator is not None and not isinstance(self.paginator, KeysetPagination):
+            return None
+        return compile_serializer(self.get_serializer())
+
+    def list(self, request, *args, **kwargs):
+        rows = self.get_row_serializer(request)
+        if rows is None:
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        columns = {"pk", *rows.columns}
+        if self.paginator is not None:
+            columns.update(name for name, _ in self.paginator.get_ordering(queryset))
+        values = queryset.prefetch_related(None).values(*columns)
+
+        page = self.paginate_queryset(values)
+        if page is None:
+            response_data = rows.to_representation(list(values))
+            status = 200
+        else:
+            response = self.get_paginated_response(rows.to_representation(page))
+            response_data, status = response.data, response.status_code
+        return HttpResponse(dumps(response_data), content_type=request.accepted_media_type, status=status)
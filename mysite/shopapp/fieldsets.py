@@ -0,0 +1,236 @@
+"""
+Sparse fieldsets for REST viewsets: ``?fields=pk,name,price`` / ``?omit=description``,
+and expansion of relations: ``?expand=products,user``.
+
+The requested fields trim the serializer output and the SQL itself: only the
+model columns behind them (plus pk and the ordering columns the pagination
+needs) are selected with ``only()``, and many-to-many relations are
+prefetched only when they are serialized.
+
+Expanded relations are rendered with the nested serializers listed in
+``Meta.expandable_fields`` of the serializer; dotted paths
+(``products.images``) expand the nested serializer in turn. The expansion
+tree is turned into ``select_related()`` for to-one relations and
+``Prefetch()`` objects for to-many ones, so an expanded page costs one
+query per to-many level however many rows it holds.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch, QuerySet
+from rest_framework.exceptions import ValidationError
+from rest_framework.relations import ManyRelatedField
+from rest_framework.permissions import SAFE_METHODS
+
+
+def split_names(value) -> list:
+    return [name.strip() for name in (value or "").split(",") if name.strip()]
+
+
+def model_sources(serializer, names) -> tuple:
+    """
+    Returns (columns, relations to prefetch, whether all fields map to the model)
+    for the serializer fields ``names``.
+    """
+    meta = serializer.Meta.model._meta
+    columns, prefetch, mapped = set(), [], True
+    for name in names:
+        source = serializer.fields[name].source.split(".")[0]
+        if source == "pk":
+            columns.add(meta.pk.name)
+            continue
+        try:
+            field = meta.get_field(source)
+        except FieldDoesNotExist:
+            # A property or a method: the columns it reads are unknown
+            mapped = False
+            continue
+        if field.many_to_many or field.one_to_many:
+            prefetch.append(source)
+        elif field.concrete:
+            columns.add(field.name)
+        else:
+            mapped = False
+    return columns, prefetch, mapped
+
+
+def ordering_columns(queryset: QuerySet) -> set:
+    meta = queryset.model._meta
+    columns = set()
+    for name in queryset.query.order_by or meta.ordering:
+        if not isinstance(name, str):
+            continue
+        name = name.lstrip("-")
+        if name == "pk":
+            columns.add(meta.pk.name)
+            continue
+        try:
+            field = meta.get_field(name)
+        except FieldDoesNotExist:
+            continue
+        if field.concrete and not field.many_to_many:
+            columns.add(field.name)
+    return columns
+
+
+def parse_expand(value) -> dict:
+    """
+    ``"products,user.groups"`` -> ``{"products": {}, "user": {"groups": {}}}``
+    """
+    tree = {}
+    for path in split_names(value):
+        node = tree
+        for name in path.split("."):
+            node = node.setdefault(name, {})
+    return tree
+
+
+def expandable_fields(serializer_class) -> dict:
+    return getattr(serializer_class.Meta, "expandable_fields", {})
+
+
+def unknown_expansions(serializer_class, tree: dict, prefix="") -> list:
+    unknown = []
+    for name, subtree in tree.items():
+        nested_class = expandable_fields(serializer_class).get(name)
+        if nested_class is None:
+            unknown.append(prefix + name)
+        else:
+            unknown += unknown_expansions(nested_class, subtree, f"{prefix}{name}.")
+    return unknown
+
+
+def expand_serializer(serializer, tree: dict):
+    """
+    Replaces the relation fields named in ``tree`` by their nested serializers, in place.
+    """
+    for name, subtree in tree.items():
+        field = serializer.fields.get(name)
+        if field is None:
+            continue
+        kwargs = {"many": isinstance(field, ManyRelatedField), "read_only": True}
+        if field.source != name:
+            kwargs["source"] = field.source
+        nested = expandable_fields(type(serializer))[name](**kwargs)
+        serializer.fields[name] = nested
+        expand_serializer(getattr(nested, "child", nested), subtree)
+
+
+def expansion_plan(serializer_class, tree: dict) -> tuple:
+    """
+    Returns (``select_related`` paths, ``Prefetch`` objects) loading the expansion ``tree``.
+    """
+    model = serializer_class.Meta.model
+    fields = serializer_class().fields
+    select, prefetch = [], []
+    for name, subtree in tree.items():
+        nested_class = expandable_fields(serializer_class)[name]
+        source = fields[name].source
+        field = model._meta.get_field(source)
+        nested_select, nested_prefetch = expansion_plan(nested_class, subtree)
+        if field.many_to_many or field.one_to_many:
+            queryset = (
+                field.related_model._default_manager
+                .select_related(*nested_select)
+                .prefetch_related(*nested_prefetch)
+            )
+            prefetch.append(Prefetch(source, queryset=queryset))
+        else:
+            select += [source, *(f"{source}__{path}" for path in nested_select)]
+            prefetch += [
+                Prefetch(f"{source}__{lookup.prefetch_through}", queryset=lookup.queryset)
+                for lookup in nested_prefetch
+            ]
+    return select, prefetch
+
+
+class SparseFieldsetsMixin:
+    """
+    ModelViewSet mixin: ``?fields=`` / ``?omit=`` / ``?expand=`` on read requests.
+
+    Writes always use the complete serializer, so input fields are never dropped.
+    """
+    fields_query_param = "fields"
+    omit_query_param = "omit"
+    expand_query_param = "expand"
+    # Top-level expansion -> permission classes the request must pass to expand it
+    expand_permissions = {}
+
+    def get_sparse_fields(self):
+        """
+        Names of the requested serializer fields, None when all of them are.
+        """
+        if not hasattr(self, "_sparse_fields"):
+            self._sparse_fields = self._parse_sparse_fields()
+        return self._sparse_fields
+
+    def _parse_sparse_fields(self):
+        if self.request is None or self.request.method not in SAFE_METHODS:
+            return None
+        fields = split_names(self.request.query_params.get(self.fields_query_param))
+        omit = split_names(self.request.query_params.get(self.omit_query_param))
+        if not fields and not omit:
+            return None
+        available = list(self.get_serializer_class()().fields)
+        unknown = sorted(set(fields + omit) - set(available))
+        if unknown:
+            raise ValidationError({
+                self.fields_query_param if set(unknown) & set(fields) else self.omit_query_param:
+                    [f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(available)}."]
+            })
+        return [name for name in available if (not fields or name in fields) and name not in omit]
+
+    def get_expand(self) -> dict:
+        """
+        Expansion tree of the serialized relations, ``{}`` when nothing is expanded.
+        """
+        if not hasattr(self, "_expand"):
+            self._expand = self._parse_expand()
+        return self._expand
+
+    def _parse_expand(self) -> dict:
+        if self.request is None or self.request.method not in SAFE_METHODS:
+            return {}
+        tree = parse_expand(self.request.query_params.get(self.expand_query_param))
+        serializer_class = self.get_serializer_class()
+        unknown = unknown_expansions(serializer_class, tree)
+        if unknown:
+            raise ValidationError({
+                self.expand_query_param: [
+                    f"Cannot expand: {', '.join(unknown)}. "
+                    f"Expandable: {', '.join(expandable_fields(serializer_class))}."
+                ]
+            })
+        for name in tree:
+            for permission in self.expand_permissions.get(name, ()):
+                if not permission().has_permission(self.request, self):
+                    self.permission_denied(self.request, message=f"Not allowed to expand {name}.")
+        fields = self.get_sparse_fields()
+        return {name: subtree for name, subtree in tree.items() if fields is None or name in fields}
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        fields = self.get_sparse_fields()
+        target = getattr(serializer, "child", serializer)
+        if fields is not None:
+            for name in list(target.fields):
+                if name not in fields:
+                    target.fields.pop(name)
+        expand_serializer(target, self.get_expand())
+        return serializer
+
+    def filter_queryset(self, queryset: QuerySet) -> QuerySet:
+        queryset = super().filter_queryset(queryset)
+        serializer_class = self.get_serializer_class()
+        serializer = serializer_class()
+        fields = self.get_sparse_fields()
+        expand = self.get_expand()
+        columns, prefetch, mapped = model_sources(serializer, list(serializer.fields) if fields is None else fields)
+        select, expanded = expansion_plan(serializer_class, expand)
+        expanded_sources = {serializer.fields[name].source for name in expand}
+        prefetch = [*(source for source in prefetch if source not in expanded_sources), *expanded]
+        if select:
+            queryset = queryset.select_related(*select)
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        if fields is not None and mapped:
+            queryset = queryset.only(queryset.model._meta.pk.name, *columns, *ordering_columns(queryset))
+        return queryset
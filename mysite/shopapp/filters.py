@@ -0,0 +1,61 @@
+import django_filters
+from rest_framework.filters import SearchFilter
+
+from .facets import CREATED_BUCKETS, DISCOUNT_BUCKETS, PRICE_BUCKETS, bucket_q
+from .models import Product
+from .search import fts_enabled, search_products
+
+
+class ProductFullTextSearchFilter(SearchFilter):
+    """
+    ``?search=`` backed by the FTS5 index and ordered by relevance.
+
+    Falls back to the regular SearchFilter when the index is unavailable.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms or not fts_enabled():
+            return super().filter_queryset(request, queryset, view)
+        return search_products(queryset, terms)
+
+
+def _choices(buckets) -> list:
+    return [(bucket[0], bucket[0]) for bucket in buckets]
+
+
+class ProductFilter(django_filters.FilterSet):
+    """
+    Exact, range and bucket filters of products; bucket names are the ones of the facet counts.
+    """
+    price_min = django_filters.NumberFilter(field_name="price", lookup_expr="gte")
+    price_max = django_filters.NumberFilter(field_name="price", lookup_expr="lte")
+    price_bucket = django_filters.ChoiceFilter(choices=_choices(PRICE_BUCKETS), method="filter_bucket")
+    discount_min = django_filters.NumberFilter(field_name="discount", lookup_expr="gte")
+    discount_max = django_filters.NumberFilter(field_name="discount", lookup_expr="lte")
+    discount_bucket = django_filters.ChoiceFilter(choices=_choices(DISCOUNT_BUCKETS), method="filter_bucket")
+    on_sale = django_filters.BooleanFilter(method="filter_on_sale")
+    created_after = django_filters.IsoDateTimeFilter(field_name="created_at", lookup_expr="gte")
+    created_before = django_filters.IsoDateTimeFilter(field_name="created_at", lookup_expr="lt")
+    created_bucket = django_filters.ChoiceFilter(
+        choices=_choices([*CREATED_BUCKETS, ("older",)]),
+        method="filter_bucket",
+    )
+
+    class Meta:
+        model = Product
+        fields = [
+            "name",
+            "description",
+            "price",
+            "discount",
+            "archived",
+        ]
+
+    def filter_bucket(self, queryset, name, value):
+        return queryset.filter(bucket_q(name.removesuffix("_bucket"), value))
+
+    def filter_on_sale(self, queryset, name, value):
+        if value:
+            return queryset.filter(discount__gt=0)
+        return queryset.filter(discount__lte=0)
@@ -1,8 +1,82 @@
 from shopapp.models import Order, Product
+from shopapp.suggest import product_index
 from django import forms
+from django.core.exceptions import ValidationError
+from django.urls import reverse_lazy
+
+
+class ProductTypeaheadWidget(forms.Widget):
+    """
+    Text input suggesting products from the JSON endpoint; chosen products
+    are submitted as hidden inputs, so no <option> per product is rendered.
+    """
+    template_name = "shopapp/widgets/product_typeahead.html"
+
+    def __init__(self, attrs=None, suggest_url=reverse_lazy("shopapp:products_suggest")):
+        super().__init__(attrs)
+        self.suggest_url = suggest_url
+
+    def format_value(self, value):
+        if not value:
+            return []
+        return [getattr(item, "pk", item) for item in value]
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        context["widget"]["suggest_url"] = self.suggest_url
+        context["widget"]["selected"] = [
+            (pk, product_index.name(pk) or f"#{pk}")
+            for pk in context["widget"]["value"]
+        ]
+        return context
+
+    def value_from_datadict(self, data, files, name):
+        return data.getlist(name) if hasattr(data, "getlist") else data.get(name)
+
+    def value_omitted_from_data(self, data, files, name):
+        return False
+
+    def use_required_attribute(self, initial):
+        # The text input only searches, the chosen products are the value
+        return False
+
+
+class ProductsField(forms.Field):
+    """
+    Multiple products by pk, validated with one in_bulk() query
+    whatever the size of the catalog.
+    """
+    widget = ProductTypeaheadWidget
+    default_error_messages = {
+        "invalid_pk_value": "“%(pk)s” is not a valid value.",
+        "invalid_choice": "Select a valid choice. %(value)s is not one of the available choices.",
+    }
+
+    def to_python(self, value) -> list:
+        if not value:
+            return []
+        pks = []
+        for item in value:
+            try:
+                pk = int(getattr(item, "pk", item))
+            except (TypeError, ValueError):
+                raise ValidationError(self.error_messages["invalid_pk_value"], code="invalid_pk_value", params={"pk": item})
+            if pk not in pks:
+                pks.append(pk)
+        return pks
+
+    def clean(self, value) -> list:
+        pks = super().clean(value)
+        products = Product.objects.filter(archived=False).only("pk", "name").in_bulk(pks)
+        for pk in pks:
+            if pk not in products:
+                raise ValidationError(self.error_messages["invalid_choice"], code="invalid_choice", params={"value": pk})
+        return [products[pk] for pk in pks]
 
 
 class OrderForm(forms.ModelForm):
+    products = ProductsField()
+
     class Meta:
         model = Order
         fields = "delivery_address", "promocode", "user", "products"
@@ -0,0 +1,258 @@
+"""
+Resized JPEG / WebP variants of product images.
+
+After an image is saved (product preview or gallery image) a dispatcher
+thread reads it and its variants are rendered in a pool of worker
+processes, stored beside the original and
+recorded in :class:`ImageVariant`. Templates render them with the
+``{% picture %}`` tag as ``srcset``, so browsers download only the size they need.
+
+Variants are keyed by the content digest as well, so a picture uploaded again
+(as another preview or gallery image) reuses them instead of being rendered;
+with :class:`shopapp.storage.DeduplicatingFileSystemStorage` the copies share
+their blobs on disk too.
+
+Bulk uploads (:func:`save_product_images`) verify, decode and write files
+in a pool of threads and insert all rows at once.
+
+Settings: ``IMAGE_VARIANT_WIDTHS``, ``IMAGE_VARIANT_FORMATS``,
+``IMAGE_VARIANT_WORKERS`` (0 renders in the calling thread) and ``IMAGE_UPLOAD_THREADS``.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import DatabaseError, connections, transaction
+from django.utils import timezone
+
+from .cache import invalidate_models
+from .imaging import inspect_image, render_variants, variant_name
+from .models import ImageVariant, Product, ProductImage
+from .storage import content_digest
+from .surrogate import purge_instances
+
+log = logging.getLogger(__name__)
+
+_executor = None
+_dispatcher = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _start_pools():
+    global _executor, _dispatcher, _executor_pid
+    # Pools inherited from the parent of a forked worker are not usable.
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.IMAGE_VARIANT_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        _dispatcher = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_VARIANT_WORKERS,
+            thread_name_prefix="image-variants",
+        )
+        _executor_pid = os.getpid()
+
+
+def get_executor() -> ProcessPoolExecutor:
+    with _executor_lock:
+        _start_pools()
+        return _executor
+
+
+def get_dispatcher() -> ThreadPoolExecutor:
+    with _executor_lock:
+        _start_pools()
+        return _dispatcher
+
+
+def wait_for_variants():
+    """
+    Waits until every submitted image has its variants saved.
+    """
+    get_dispatcher().shutdown(wait=True)
+    get_executor().shutdown(wait=True)
+
+
+def generate_variants(name: str, product_pk):
+    """
+    Renders variants of the stored image ``name`` once the transaction commits.
+    """
+    if name:
+        transaction.on_commit(lambda: _submit(name, product_pk))
+
+
+def _submit(name: str, product_pk):
+    # Runs after the commit in the request: it only hands the image over,
+    # so a storage or database failure cannot turn a saved product into an error
+    if not settings.IMAGE_VARIANT_WORKERS:
+        _dispatch(name, product_pk)
+        return
+    get_dispatcher().submit(_dispatch, name, product_pk)
+
+
+def _dispatch(name: str, product_pk):
+    try:
+        with default_storage.open(name, "rb") as file:
+            content = file.read()
+        digest = content_digest(content)
+        rendered = _rendered_elsewhere(digest)
+        if rendered is not None:
+            # The same picture was uploaded before: reuse its variants instead of rendering
+            save_variants(name, product_pk, rendered, digest)
+            return
+        args = (content, settings.IMAGE_VARIANT_WIDTHS, settings.IMAGE_VARIANT_FORMATS)
+        if not settings.IMAGE_VARIANT_WORKERS:
+            save_variants(name, product_pk, render_variants(*args), digest)
+            return
+        future = get_executor().submit(render_variants, *args)
+        future.add_done_callback(lambda future: _save_rendered(name, product_pk, digest, future))
+    except Exception:
+        log.exception("Failed to render variants of %s", name)
+    finally:
+        if settings.IMAGE_VARIANT_WORKERS:
+            # A thread of the dispatcher closes its own database connections
+            connections.close_all()
+
+
+def _rendered_elsewhere(digest: str):
+    """
+    Returns (width, height, format, bytes) of variants already rendered
+    for the content ``digest`` or None.
+    """
+    source = ImageVariant.objects.filter(digest=digest).values_list("source", flat=True).first()
+    if source is None:
+        return None
+    rendered = []
+    try:
+        for variant in ImageVariant.objects.filter(source=source):
+            with variant.file.open("rb") as file:
+                rendered.append((variant.width, variant.height, variant.format, file.read()))
+    except OSError:
+        return None
+    return rendered
+
+
+def _save_rendered(name: str, product_pk, digest: str, future):
+    # Runs in a thread of the pool, so it closes its own database connections.
+    try:
+        save_variants(name, product_pk, future.result(), digest)
+    except Exception:
+        log.exception("Failed to render variants of %s", name)
+    finally:
+        connections.close_all()
+
+
+def save_variants(name: str, product_pk, rendered, digest=""):
+    """
+    Stores rendered variants and replaces the recorded ones of ``name``.
+    """
+    variants = [
+        ImageVariant(
+            source=name,
+            digest=digest,
+            file=default_storage.save(variant_name(name, width, fmt), ContentFile(content)),
+            width=width,
+            height=height,
+            format=fmt,
+        )
+        for width, height, fmt, content in rendered
+    ]
+    with transaction.atomic():
+        delete_variants([name])
+        ImageVariant.objects.bulk_create(variants)
+        # Страница товара теперь отдаёт srcset, поэтому меняются её ETag и кэш
+        Product.objects.filter(pk=product_pk).update(updated_at=timezone.now())
+        invalidate_models(Product)
+        purge_instances(Product, [product_pk])
+
+
+def delete_variants(names):
+    variants = ImageVariant.objects.filter(source__in=list(names))
+    for variant in variants:
+        variant.file.delete(save=False)
+    variants.delete()
+
+
+def variants_for(names) -> dict:
+    """
+    Returns source name -> variants (by width) for the given images with one query.
+    """
+    found = defaultdict(list)
+    for variant in ImageVariant.objects.filter(source__in=[name for name in names if name]).order_by("width"):
+        found[variant.source].append(variant)
+    return found
+
+
+@dataclass
+class ImageUploadResult:
+    uploaded: list = field(default_factory=list)
+    errors: list = field(default_factory=list)
+
+    def reject(self, name: str, error):
+        self.errors.append({"file": name, "error": str(error)})
+
+    def as_dict(self) -> dict:
+        return {
+            "uploaded": [{"pk": image.pk, "image": image.image.url} for image in self.uploaded],
+            "errors": self.errors,
+        }
+
+
+def _store_image(name: str, content: bytes) -> str:
+    inspect_image(content)
+    return default_storage.save(name, ContentFile(content))
+
+
+def save_product_images(product: Product, files, description="") -> ImageUploadResult:
+    """
+    Bulk upload of gallery images of ``product``.
+
+    Every file is verified, decoded and written to the storage in a pool of
+    threads (Pillow releases the GIL while decoding, so they run in parallel
+    without copying the files to other processes). Valid images are inserted
+    with one ``bulk_create``; broken files are reported in the result and
+    do not abort the batch.
+    """
+    result = ImageUploadResult()
+    if not files:
+        # Nothing changed, post_save has already invalidated the product
+        return result
+    image_field = ProductImage._meta.get_field("image")
+    uploads = [(ProductImage(product=product, description=description), file) for file in files]
+    with ThreadPoolExecutor(max_workers=settings.IMAGE_UPLOAD_THREADS) as pool:
+        futures = [
+            pool.submit(_store_image, image_field.generate_filename(image, file.name), file.read())
+            for image, file in uploads
+        ]
+    saved = []
+    for (image, file), future in zip(uploads, futures):
+        try:
+            image.image = future.result()
+        except (ValueError, OSError) as exc:
+            result.reject(file.name, exc)
+        else:
+            saved.append(image)
+
+    try:
+        with transaction.atomic():
+            ProductImage.objects.bulk_create(saved)
+            # bulk_create() sends no post_save, so the signal side effects are repeated here
+            Product.objects.filter(pk=product.pk).update(updated_at=timezone.now())
+            invalidate_models(Product, ProductImage)
+            purge_instances(Product, [product.pk])
+            for image in saved:
+                generate_variants(image.image.name, product.pk)
+    except DatabaseError:
+        for image in saved:
+            default_storage.delete(image.image.name)
+        raise
+    result.uploaded = saved
+    return result
@@ -0,0 +1,67 @@
+"""
+Rendering of resized image variants with Pillow.
+
+The module does not depend on Django, so worker processes of the variant
+pool (see :mod:`shopapp.images`) start quickly and never touch the database.
+"""
+import posixpath
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+# format -> (Pillow format, file extension, save options)
+FORMATS = {
+    "webp": ("WEBP", ".webp", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", ".jpg", {"quality": 82, "optimize": True, "progressive": True}),
+}
+
+
+def variant_name(name: str, width: int, fmt: str) -> str:
+    """
+    Storage name of a variant: ``variants/`` beside the original image.
+    """
+    directory, filename = posixpath.split(name)
+    stem = posixpath.splitext(filename)[0]
+    return posixpath.join(directory, "variants", f"{stem}-{width}w{FORMATS[fmt][1]}")
+
+
+def render_variants(content: bytes, widths, formats) -> list:
+    """
+    Returns (width, height, format, bytes) for every width and format.
+
+    Images are never upscaled: widths above the original one collapse into it.
+    """
+    with Image.open(BytesIO(content)) as image:
+        image = ImageOps.exif_transpose(image)
+        widths = sorted({min(width, image.width) for width in widths})
+        rendered = []
+        for width in widths:
+            height = max(1, round(image.height * width / image.width))
+            resized = image.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=3.0)
+            for fmt in formats:
+                pil_format, _, options = FORMATS[fmt]
+                if pil_format == "JPEG" and resized.mode not in ("RGB", "L"):
+                    converted = resized.convert("RGB")
+                else:
+                    converted = resized
+                output = BytesIO()
+                converted.save(output, pil_format, **options)
+                rendered.append((width, height, fmt, output.getvalue()))
+        return rendered
+
+
+def inspect_image(content: bytes) -> tuple:
+    """
+    Verifies and fully decodes an image, returns (format, width, height).
+
+    Raises ValueError for files that are not valid images.
+    """
+    try:
+        with Image.open(BytesIO(content)) as image:
+            image.verify()
+        # verify() leaves the image unusable, so it is opened again to decode the pixels
+        with Image.open(BytesIO(content)) as image:
+            image.load()
+            return image.format, image.width, image.height
+    except (OSError, SyntaxError, Image.DecompressionBombError) as exc:
+        raise ValueError(f"Not a valid image: {exc}") from exc
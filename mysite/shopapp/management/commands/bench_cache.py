@@ -0,0 +1,70 @@
+import multiprocessing
+import tempfile
+import time
+from pathlib import Path
+
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import BaseCommand
+
+from shopapp.cache_backends import MmapCache
+
+
+def run_gets(cache, keys, rounds):
+    for _ in range(rounds):
+        for key in keys:
+            cache.get(key)
+
+
+class Command(BaseCommand):
+    """
+    Compares throughput of locmem, filebased and mmap cache backends
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--keys", type=int, default=2000)
+        parser.add_argument("--rounds", type=int, default=5)
+        parser.add_argument("--processes", type=int, default=4)
+
+    def handle(self, *args, **options):
+        keys = [f"product:{number}" for number in range(options["keys"])]
+        value = {"pk": 1, "name": "Laptop" * 10, "price": "1999.99", "tags": list(range(20))}
+        rounds = options["rounds"]
+        processes = options["processes"]
+
+        with tempfile.TemporaryDirectory() as directory:
+            backends = {
+                "locmem": LocMemCache("bench", {"OPTIONS": {"MAX_ENTRIES": len(keys) * 2}}),
+                "filebased": FileBasedCache(
+                    str(Path(directory) / "filebased"),
+                    {"OPTIONS": {"MAX_ENTRIES": len(keys) * 2}},
+                ),
+                "mmap": MmapCache(
+                    str(Path(directory) / "cache.mmap"),
+                    {"OPTIONS": {"SLOTS": len(keys) * 4, "SLOT_SIZE": 1024}},
+                ),
+            }
+            self.stdout.write(f"{'backend':<10} {'set/s':>10} {'get/s':>10} {f'get/s x{processes}':>12}")
+            for name, cache in backends.items():
+                started = time.perf_counter()
+                for key in keys:
+                    cache.set(key, value)
+                sets = len(keys) / (time.perf_counter() - started)
+
+                started = time.perf_counter()
+                run_gets(cache, keys, rounds)
+                gets = len(keys) * rounds / (time.perf_counter() - started)
+
+                context = multiprocessing.get_context("fork")
+                workers = [
+                    context.Process(target=run_gets, args=(cache, keys, rounds))
+                    for _ in range(processes)
+                ]
+                started = time.perf_counter()
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+                parallel_gets = len(keys) * rounds * processes / (time.perf_counter() - started)
+
+                self.stdout.write(f"{name:<10} {sets:>10.0f} {gets:>10.0f} {parallel_gets:>12.0f}")
@@ -0,0 +1,62 @@
+import time
+from decimal import Decimal
+
+from django.core.management import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from shopapp.fastjson import compile_serializer, dumps
+from shopapp.models import Product
+from shopapp.serializers import ProductSerializer
+
+
+class Command(BaseCommand):
+    """
+    Compares ProductSerializer + JSONRenderer with the values() fast path on pages of products
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+        parser.add_argument("--rounds", type=int, default=3)
+
+    def handle(self, *args, **options):
+        request = Request(APIRequestFactory().get("/shop/api/products/"))
+        serializer = ProductSerializer(context={"request": request})
+        renderer = JSONRenderer()
+        sizes = options["sizes"]
+        rounds = options["rounds"]
+
+        # The products are created for the benchmark only and rolled back
+        with transaction.atomic():
+            Product.objects.bulk_create(
+                Product(
+                    name=f"Bench product {number}",
+                    description="Benchmark product description " * 5,
+                    price=Decimal(number % 5000) + Decimal("0.99"),
+                    discount=number % 50,
+                    preview=f"products/product_{number}/preview/image.png" if number % 2 else "",
+                )
+                for number in range(max(sizes))
+            )
+            queryset = Product.objects.order_by("pk")
+            self.stdout.write(f"{'rows':>8} {'serializer, s':>14} {'fast, s':>10} {'speedup':>8}")
+            for size in sizes:
+                started = time.perf_counter()
+                for _ in range(rounds):
+                    products = list(queryset[:size])
+                    regular = renderer.render(ProductSerializer(products, many=True, context={"request": request}).data)
+                regular_time = (time.perf_counter() - started) / rounds
+
+                started = time.perf_counter()
+                for _ in range(rounds):
+                    rows = compile_serializer(serializer)
+                    values = list(queryset.values("pk", *rows.columns)[:size])
+                    fast = dumps(rows.to_representation(values))
+                fast_time = (time.perf_counter() - started) / rounds
+
+                if fast != regular:
+                    self.stderr.write(f"Output of {size} rows differs")
+                self.stdout.write(f"{size:>8} {regular_time:>14.3f} {fast_time:>10.3f} {regular_time / fast_time:>7.1f}x")
+            transaction.set_rollback(True)
@@ -2,6 +2,7 @@ from typing import Sequence
 
 from django.core.management import BaseCommand
 from django.contrib.auth.models import User
+from django.utils import timezone
 from shopapp.models import Order, Product
 
 
@@ -11,7 +12,7 @@ class Command(BaseCommand):
 
         result = Product.objects.filter(
             name__contains="Smartphone",
-        ).update(discount=10)
+        ).update(discount=10, updated_at=timezone.now())
 
         print(result)
 
@@ -0,0 +1,15 @@
+from django.core.files.storage import default_storage
+from django.core.management import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    """
+    Removes deduplicated media blobs that no file refers to anymore
+    """
+
+    def handle(self, *args, **options):
+        if not hasattr(default_storage, "collect_blobs"):
+            raise CommandError("The default storage does not deduplicate files")
+        self.stdout.write("Collect media blobs")
+        removed = default_storage.collect_blobs()
+        self.stdout.write(self.style.SUCCESS(f"Removed {removed} blobs"))
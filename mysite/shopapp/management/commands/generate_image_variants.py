@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from shopapp.images import generate_variants, wait_for_variants
+from shopapp.models import ImageVariant, Product, ProductImage
+
+
+class Command(BaseCommand):
+    """
+    Renders missing variants of product previews and images
+    """
+
+    def handle(self, *args, **options):
+        self.stdout.write("Generate image variants")
+        rendered = set(ImageVariant.objects.values_list("source", flat=True).distinct())
+        count = 0
+        previews = Product.objects.exclude(preview="").exclude(preview__isnull=True).values_list("pk", "preview")
+        images = ProductImage.objects.values_list("product_id", "image")
+        for product_pk, name in [*previews, *images]:
+            if name not in rendered:
+                generate_variants(name, product_pk)
+                count += 1
+        if settings.IMAGE_VARIANT_WORKERS:
+            wait_for_variants()
+        self.stdout.write(self.style.SUCCESS(f"Rendered variants of {count} images"))
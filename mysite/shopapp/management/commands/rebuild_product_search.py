@@ -0,0 +1,17 @@
+from django.core.management import BaseCommand
+
+from shopapp.search import fts_enabled, rebuild_index
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds the full-text search index of products
+    """
+
+    def handle(self, *args, **options):
+        if not fts_enabled():
+            self.stdout.write(self.style.WARNING("Full-text index is only available on SQLite"))
+            return
+        self.stdout.write("Rebuild product search index")
+        rebuild_index()
+        self.stdout.write(self.style.SUCCESS("Product search index rebuilt"))
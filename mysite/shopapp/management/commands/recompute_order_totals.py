@@ -0,0 +1,26 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from shopapp.models import Order
+from shopapp.totals import recompute_orders
+from shopapp.utils import batched
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds denormalized order totals and products counts
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        self.stdout.write("Recompute order totals")
+        chunk_size = options["chunk_size"]
+        pks = Order.objects.order_by("pk").values_list("pk", flat=True)
+        count = 0
+        for chunk in batched(pks.iterator(chunk_size=chunk_size), chunk_size):
+            with transaction.atomic():
+                recompute_orders(chunk)
+            count += len(chunk)
+        self.stdout.write(self.style.SUCCESS(f"Recomputed {count} orders"))
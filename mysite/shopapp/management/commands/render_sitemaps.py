@@ -0,0 +1,25 @@
+from django.core.management import BaseCommand
+
+from shopapp.sitemap import write_dirty_sitemaps, write_sitemaps
+
+
+class Command(BaseCommand):
+    """
+    Pre-renders the sitemap index and gzipped sitemap shards to SITEMAP_ROOT
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dirty",
+            action="store_true",
+            help="Rewrite only the shards of objects changed since the last run",
+        )
+
+    def handle(self, *args, **options):
+        if options["dirty"]:
+            count = write_dirty_sitemaps()
+            self.stdout.write(self.style.SUCCESS(f"Rewrote {count} dirty sitemap shards"))
+            return
+        self.stdout.write("Render sitemaps")
+        count = write_sitemaps()
+        self.stdout.write(self.style.SUCCESS(f"Rendered {count} sitemap shards"))
@@ -0,0 +1,35 @@
+from django.core.management import BaseCommand
+
+from shopapp.common import sync_csv_products
+
+
+class Command(BaseCommand):
+    """
+    Re-syncs products with a CSV feed, writing only new and changed rows
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--key", default="name")
+        parser.add_argument("--encoding", default="utf-8")
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--archive-missing", action="store_true")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Sync products from {options['path']}")
+        with open(options["path"], "rb") as file:
+            result = sync_csv_products(
+                file=file,
+                encoding=options["encoding"],
+                key=options["key"],
+                archive_missing=options["archive_missing"],
+                batch_size=options["batch_size"],
+            )
+
+        for error in result.errors:
+            self.stdout.write(self.style.WARNING(f"Line {error['line']}: {error['errors']}"))
+        self.stdout.write(self.style.SUCCESS(
+            f"Inserted {result.inserted}, updated {result.updated}, "
+            f"unchanged {result.unchanged}, archived {result.archived}, "
+            f"rejected {result.rejected}"
+        ))
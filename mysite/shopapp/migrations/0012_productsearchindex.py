@@ -0,0 +1,52 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+import shopapp.models
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE shopapp_product_fts USING fts5("
+        "name, description, prefix='2 3', tokenize='unicode61 remove_diacritics 2')"
+    )
+    schema_editor.execute(
+        "INSERT INTO shopapp_product_fts(shopapp_product_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0)')"
+    )
+    schema_editor.execute(
+        "INSERT INTO shopapp_product_fts(rowid, name, description) "
+        "SELECT id, name, description FROM shopapp_product"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    schema_editor.execute("DROP TABLE shopapp_product_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0011_alter_order_options_alter_product_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchIndex',
+            fields=[
+                ('product', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='shopapp.product')),
+                ('name', models.TextField()),
+                ('description', models.TextField()),
+                ('document', shopapp.models.FullTextField(db_column='shopapp_product_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'shopapp_product_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:50
+
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import migrations, models
+
+
+def compute_totals(apps, schema_editor):
+    Order = apps.get_model("shopapp", "Order")
+    OrderProducts = Order.products.through
+    totals = {}
+    rows = OrderProducts.objects.values_list("order_id", "product__price", "product__discount")
+    for order_id, price, discount in rows.iterator():
+        price = (Decimal(price) * (100 - discount) / 100).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+        total, count = totals.get(order_id, (Decimal(0), 0))
+        totals[order_id] = (total + price, count + 1)
+    Order.objects.bulk_update(
+        [
+            Order(pk=pk, total=total, products_count=count)
+            for pk, (total, count) in totals.items()
+        ],
+        ["total", "products_count"],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0012_productsearchindex'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='products_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(compute_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:56
+
+from django.db import migrations, models
+
+
+def copy_created_at(apps, schema_editor):
+    Product = apps.get_model("shopapp", "Product")
+    Product.objects.update(updated_at=models.F("created_at"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0013_order_total_products_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.RunPython(copy_created_at, migrations.RunPython.noop),
+    ]
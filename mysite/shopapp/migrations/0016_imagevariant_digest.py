@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0015_imagevariant'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagevariant',
+            name='digest',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+    ]
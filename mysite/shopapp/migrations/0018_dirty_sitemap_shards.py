@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0017_product_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirtySitemapShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('section', models.CharField(max_length=50)),
+                ('shard', models.PositiveIntegerField()),
+                ('marked_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='dirtysitemapshard',
+            constraint=models.UniqueConstraint(fields=('section', 'shard'), name='shopapp_dirty_sitemap_shard_unique'),
+        ),
+    ]
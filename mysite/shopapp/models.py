@@ -1,5 +1,8 @@
+from decimal import Decimal, ROUND_HALF_UP
+
 from django.contrib.auth.models import User
 from django.db import models
+from django.db.models import Lookup, Q
 from django.utils.translation import gettext_lazy as _
 from django.urls import reverse
 
@@ -21,12 +24,22 @@ class Product(models.Model):
     class Meta:
         ordering = ["name", "price"]
         verbose_name = _("Product")
+        indexes = [
+            # Facet counts and filters of the whole catalog
+            models.Index(fields=["archived", "price"], name="shopapp_product_arch_price"),
+            # Storefront filters only see active products
+            models.Index(fields=["price"], name="shopapp_product_active_price", condition=Q(archived=False)),
+            models.Index(fields=["discount"], name="shopapp_product_active_disc", condition=Q(archived=False)),
+            models.Index(fields=["created_at"], name="shopapp_product_active_new", condition=Q(archived=False)),
+        ]
 
     name = models.CharField(max_length=100, db_index=True) # db_index = True позволяет быстрее работать с запросами к БД
     description = models.TextField(null=False, blank=True, db_index=True)
     price = models.DecimalField(default=0, max_digits=8, decimal_places=2)
     discount = models.SmallIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Меняется при любой правке товара, по нему считаются ETag и Last-Modified
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     archived = models.BooleanField(default=False)
     preview = models.ImageField(null=True, blank=True, upload_to=product_preview_directory_path)
 
@@ -36,6 +49,18 @@ class Product(models.Model):
     def get_absolute_url(self):
         return reverse("shopapp:product_details", kwargs={"pk": self.pk})
 
+    @property
+    def effective_price(self) -> Decimal:
+        return effective_price(self.price, self.discount)
+
+
+def effective_price(price, discount) -> Decimal:
+    """
+    Цена товара с учётом скидки в процентах, округлённая до копеек.
+    """
+    price = Decimal(price) * (100 - int(discount)) / 100
+    return price.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+
 
 def product_images_directory_path(instance: "ProductImage", filename: str) -> str:
     return "products/product_{pk}/images/{filename}".format(
@@ -50,6 +75,28 @@ class ProductImage(models.Model):
     description = models.CharField(max_length=200, null=False, blank=True)
 
 
+class ImageVariant(models.Model):
+    """
+    Уменьшенная копия изображения товара (превью или картинки из галереи)
+    в формате JPEG или WebP. Лежит рядом с оригиналом в папке ``variants``.
+    """
+    class Meta:
+        unique_together = ("source", "width", "format")
+
+    FORMAT_CHOICES = [
+        ("jpeg", "JPEG"),
+        ("webp", "WebP"),
+    ]
+
+    source = models.CharField(max_length=255, db_index=True)
+    # sha256 содержимого оригинала: одинаковые картинки не рендерятся повторно
+    digest = models.CharField(max_length=64, blank=True, db_index=True)
+    file = models.ImageField(max_length=255)
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    format = models.CharField(max_length=4, choices=FORMAT_CHOICES)
+
+
 
 
 class Order(models.Model):
@@ -61,4 +108,75 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     user = models.ForeignKey(User, on_delete=models.PROTECT)
     products = models.ManyToManyField(Product, related_name="orders")
-    receipt = models.FileField(null=True, upload_to="orders/receipts/")
\ No newline at end of file
+    receipt = models.FileField(null=True, upload_to="orders/receipts/")
+    # Денормализованные значения, их поддерживает shopapp.totals
+    total = models.DecimalField(default=0, max_digits=12, decimal_places=2, db_index=True)
+    products_count = models.PositiveIntegerField(default=0)
+
+
+class FullTextField(models.TextField):
+    """
+    Скрытая колонка FTS5-таблицы, по которой выполняется MATCH.
+    """
+
+
+@FullTextField.register_lookup
+class FullTextMatch(Lookup):
+    lookup_name = "match"
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} MATCH {rhs}", lhs_params + rhs_params
+
+
+class ProductSearchIndex(models.Model):
+    """
+    Полнотекстовый индекс по названию и описанию товаров.
+
+    Это виртуальная таблица SQLite FTS5, её rowid совпадает с pk товара.
+    Таблица заполняется через :mod:`shopapp.search`, а не через ORM.
+    """
+    class Meta:
+        managed = False
+        db_table = "shopapp_product_fts"
+
+    product = models.OneToOneField(
+        Product,
+        primary_key=True,
+        db_column="rowid",
+        db_constraint=False,
+        on_delete=models.DO_NOTHING,
+        related_name="search_index",
+    )
+    name = models.TextField()
+    description = models.TextField()
+    document = FullTextField(db_column="shopapp_product_fts")
+    rank = models.FloatField()
+
+
+class DirtySitemapShard(models.Model):
+    """
+    Шард карты сайта, который нужно перерисовать (см. :mod:`shopapp.sitemap`).
+
+    Строки добавляются после изменений объектов, а файлы переписывает
+    ``render_sitemaps --dirty``, поэтому запросы не рендерят карту сайта.
+    """
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["section", "shard"], name="shopapp_dirty_sitemap_shard_unique"),
+        ]
+
+    section = models.CharField(max_length=50)
+    shard = models.PositiveIntegerField()
+    marked_at = models.DateTimeField()
+
+
+class ProductTombstone(models.Model):
+    """
+    Удалённый товар: по этим записям индекс подсказок (:mod:`shopapp.suggest`)
+    в других процессах узнаёт об удалениях. Старые записи удаляются при
+    перестроении индекса.
+    """
+    product_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(db_index=True)
@@ -0,0 +1,303 @@
+"""
+Keyset-пагинация (по курсору) для списков REST API.
+
+Вместо OFFSET страница ищется по значениям полей сортировки последней
+записи предыдущей страницы, поэтому глубокие страницы стоят столько же,
+сколько первая. COUNT(*) выполняется только по запросу (?with_count=1).
+
+EstimatedCountPaginator для списков админки берёт число строк
+нефильтрованной таблицы из статистики БД вместо COUNT(*).
+"""
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.core.exceptions import FieldDoesNotExist
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.db import connections
+from django.db.models import F, Q, QuerySet
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def _to_json(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginates by the queryset ordering (as set by OrderingFilter or Meta.ordering)
+    with pk as the tie-breaker and opaque cursors in the ``cursor`` query parameter.
+    """
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    cursor_query_param = "cursor"
+    count_query_param = "with_count"
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+        cursor = self.decode_cursor(request)
+
+        self.count = None
+        if request.query_params.get(self.count_query_param) in ("1", "true"):
+            self.count = queryset.count()
+
+        reverse = bool(cursor and cursor["r"])
+        ordering = [(name, not desc) for name, desc in self.ordering] if reverse else self.ordering
+        if cursor is not None:
+            queryset = queryset.filter(self.build_after_filter(queryset.model, ordering, cursor["v"]))
+        queryset = queryset.order_by(*self.build_order_by(queryset.model, ordering))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        self.page = results
+        return results
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, queryset):
+        """
+        Returns [(field name, descending)] with pk appended as the tie-breaker.
+        """
+        ordering = []
+        for item in queryset.query.order_by or queryset.model._meta.ordering:
+            if not isinstance(item, str) or item == "?" or "__" in item:
+                continue
+            name = item.lstrip("-")
+            if name in ("pk", queryset.model._meta.pk.name):
+                name = "pk"
+            elif name not in queryset.query.annotations:
+                try:
+                    queryset.model._meta.get_field(name)
+                except FieldDoesNotExist:
+                    continue
+            ordering.append((name, item.startswith("-")))
+            if name == "pk":
+                break
+        if not ordering or ordering[-1][0] != "pk":
+            ordering.append(("pk", False))
+        return ordering
+
+    @staticmethod
+    def _field(model, name):
+        """
+        Model field for ``name`` or None for annotations (e.g. search rank).
+        """
+        if name == "pk":
+            return model._meta.pk
+        try:
+            return model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return None
+
+    def _nullable(self, model, name) -> bool:
+        model_field = self._field(model, name)
+        return model_field is not None and model_field.null
+
+    def build_order_by(self, model, ordering):
+        order_by = []
+        for name, desc in ordering:
+            if self._nullable(model, name):
+                # NULL всегда считается наименьшим значением
+                order_by.append(F(name).desc(nulls_last=True) if desc else F(name).asc(nulls_first=True))
+            else:
+                order_by.append(f"-{name}" if desc else name)
+        return order_by
+
+    def build_after_filter(self, model, ordering, values) -> Q:
+        """
+        (f1 > v1) OR (f1 = v1 AND f2 > v2) OR ... with NULL treated as the smallest value.
+        """
+        condition = Q(pk__in=[])
+        equal = Q()
+        for (name, desc), value in zip(ordering, values):
+            if value is None:
+                after = Q(pk__in=[]) if desc else Q(**{f"{name}__isnull": False})
+                same = Q(**{f"{name}__isnull": True})
+            else:
+                after = Q(**{f"{name}__lt" if desc else f"{name}__gt": value})
+                if desc and self._nullable(model, name):
+                    after |= Q(**{f"{name}__isnull": True})
+                same = Q(**{name: value})
+            condition |= equal & after
+            equal &= same
+        return condition
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode()))
+            ordering = [(name, bool(desc)) for name, desc in cursor["o"]]
+            values = list(cursor["v"])
+            reverse = bool(cursor["r"])
+        except (BinasciiError, ValueError, TypeError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if ordering != self.ordering or len(values) != len(ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return {"v": values, "r": reverse}
+
+    def encode_cursor(self, item, reverse: bool) -> str:
+        values = []
+        for name, desc in self.ordering:
+            if isinstance(item, dict):
+                # Строка values(): ключи совпадают с именами полей сортировки
+                values.append(_to_json(item[name]))
+                continue
+            model_field = self._field(type(item), name)
+            values.append(_to_json(getattr(item, model_field.attname if model_field else name)))
+        cursor = {"o": self.ordering, "v": values, "r": int(reverse)}
+        encoded = urlsafe_b64encode(json.dumps(cursor, separators=(",", ":")).encode()).decode()
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        response = {
+            "next": self.get_next_link(),
+            "previous": self.get_previous_link(),
+            "results": data,
+        }
+        if self.count is not None:
+            response = {"count": self.count, **response}
+        return Response(response)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "count": {"type": "integer", "example": 123},
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+            "required": ["results"],
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                "name": self.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": "The pagination cursor value.",
+                "schema": {"type": "string"},
+            },
+            {
+                "name": self.page_size_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Number of results to return per page.",
+                "schema": {"type": "integer"},
+            },
+            {
+                "name": self.count_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Include the total number of results.",
+                "schema": {"type": "boolean"},
+            },
+        ]
+
+
+def estimate_count(model, using="default"):
+    """
+    Approximate number of rows of the model table from the database statistics or None.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [table])
+        elif connection.vendor == "mysql":
+            cursor.execute(
+                "SELECT table_rows FROM information_schema.tables"
+                " WHERE table_schema = DATABASE() AND table_name = %s",
+                [table],
+            )
+        elif connection.vendor == "sqlite":
+            # The last key of the rowid b-tree: no scan, an overestimate after deletes
+            cursor.execute(f"SELECT MAX(rowid) FROM {connection.ops.quote_name(table)}")
+        else:
+            return None
+        row = cursor.fetchone()
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that estimates the count of unfiltered large tables instead of COUNT(*).
+
+    Filtered querysets and tables below ``estimate_threshold`` rows are counted
+    exactly. Pages past an overestimated count are empty instead of invalid.
+    """
+    estimate_threshold = 100000
+
+    @cached_property
+    def estimated_count(self):
+        queryset = self.object_list
+        if not isinstance(queryset, QuerySet) or queryset.query.where or queryset.query.distinct:
+            return None
+        estimate = estimate_count(queryset.model, queryset.db)
+        if estimate is None or estimate < self.estimate_threshold:
+            return None
+        return estimate
+
+    @cached_property
+    def count(self) -> int:
+        if self.estimated_count is not None:
+            return self.estimated_count
+        return super().count
+
+    def validate_number(self, number):
+        if self.estimated_count is None:
+            return super().validate_number(number)
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(_("That page number is not an integer"))
+        if number < 1:
+            raise EmptyPage(_("That page number is less than 1"))
+        return number
@@ -0,0 +1,82 @@
+"""
+Full-text search over products backed by the SQLite FTS5 table ``shopapp_product_fts``.
+
+On other database backends the index is not created and callers fall back
+to the regular ``LIKE`` search.
+"""
+from django.db import connection
+from django.db.models import F, QuerySet
+
+from .models import Product, ProductSearchIndex
+from .utils import batched
+
+FTS_TABLE = ProductSearchIndex._meta.db_table
+
+
+def fts_enabled() -> bool:
+    return connection.vendor == "sqlite"
+
+
+def index_products(pks, batch_size=500):
+    """
+    Inserts or refreshes index rows for the given product pks.
+    """
+    if not fts_enabled():
+        return
+    with connection.cursor() as cursor:
+        for batch in batched(pks, batch_size):
+            placeholders = ", ".join(["%s"] * len(batch))
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})", batch)
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE}(rowid, name, description) "
+                f"SELECT id, name, description FROM {Product._meta.db_table} WHERE id IN ({placeholders})",
+                batch,
+            )
+
+
+def unindex_products(pks, batch_size=500):
+    if not fts_enabled():
+        return
+    with connection.cursor() as cursor:
+        for batch in batched(pks, batch_size):
+            placeholders = ", ".join(["%s"] * len(batch))
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})", batch)
+
+
+def rebuild_index():
+    if not fts_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE}(rowid, name, description) "
+            f"SELECT id, name, description FROM {Product._meta.db_table}"
+        )
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+
+
+def to_match_query(terms) -> str:
+    """
+    Turns user input into an FTS5 query: every term is quoted and matched as a prefix.
+    """
+    return " ".join(
+        '"{}"*'.format(term.replace('"', '""'))
+        for term in terms
+        if term.strip()
+    )
+
+
+def search_products(queryset: QuerySet, terms) -> QuerySet:
+    """
+    Filters ``queryset`` by the full-text index and orders it by relevance
+    (the ``search_rank`` annotation, lower is better).
+    """
+    query = to_match_query(terms)
+    if not query:
+        return queryset
+    return (
+        queryset
+        .filter(search_index__document__match=query)
+        .annotate(search_rank=F("search_index__rank"))
+        .order_by("search_rank", "pk")
+    )
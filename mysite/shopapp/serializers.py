@@ -1,7 +1,19 @@
+from django.contrib.auth.models import User
 from rest_framework import serializers
 from .models import Product, Order
 
 
+class UserSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = (
+            "pk",
+            "username",
+            "first_name",
+            "last_name",
+        )
+
+
 class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
@@ -26,4 +38,15 @@ class OrderSerializer(serializers.ModelSerializer):
             "created_at",
             "user",
             "products",
-        ]
\ No newline at end of file
+            "total",
+            "products_count",
+        ]
+        read_only_fields = [
+            "total",
+            "products_count",
+        ]
+        # ?expand=user,products
+        expandable_fields = {
+            "user": UserSerializer,
+            "products": ProductSerializer,
+        }
@@ -0,0 +1,187 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .cache import invalidate_models, invalidate_users_orders, users_of_orders
+from .images import delete_variants, generate_variants
+from .models import ImageVariant, Order, Product, ProductImage, ProductTombstone, effective_price
+from .search import index_products, unindex_products
+from .sitemap import mark_sitemaps_dirty
+from .suggest import product_index
+from .surrogate import purge_instances
+from .totals import add_products, recompute_orders, reprice_product
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def invalidate_model_caches(sender, **kwargs):
+    invalidate_models(sender)
+
+
+@receiver(m2m_changed, sender=Order.products.through)
+def invalidate_order_products_caches(sender, action: str, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        invalidate_models(Order)
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def touch_image_product(sender, instance: ProductImage, **kwargs):
+    # Картинки показываются на странице товара, поэтому меняют его ETag
+    Product.objects.filter(pk=instance.product_id).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Product)
+def index_saved_product(sender, instance: Product, **kwargs):
+    index_products([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_deleted_product(sender, instance: Product, **kwargs):
+    unindex_products([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+def suggest_saved_product(sender, instance: Product, **kwargs):
+    if product_index.is_built():
+        pk, name, archived = instance.pk, instance.name, instance.archived
+        transaction.on_commit(lambda: product_index.apply(pk, name, archived))
+
+
+@receiver(post_delete, sender=Product)
+def forget_deleted_product(sender, instance: Product, **kwargs):
+    pk = instance.pk
+    # Индексы подсказок других процессов узнают об удалении из надгробия
+    ProductTombstone.objects.create(product_id=pk, deleted_at=timezone.now())
+    transaction.on_commit(lambda: product_index.discard(pk))
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_state(sender, instance: Product, update_fields=None, **kwargs):
+    instance._old_effective_price = instance._old_name = None
+    if instance.pk is None or (update_fields is not None and not {"price", "discount", "name"} & set(update_fields)):
+        return
+    old = Product.objects.filter(pk=instance.pk).values_list("price", "discount", "name").first()
+    if old is not None:
+        instance._old_effective_price = effective_price(old[0], old[1])
+        instance._old_name = old[2]
+
+
+@receiver(post_save, sender=Product)
+def reprice_orders(sender, instance: Product, created: bool, **kwargs):
+    old_price = getattr(instance, "_old_effective_price", None)
+    if not created and old_price is not None:
+        reprice_product(instance.pk, old_price, instance.effective_price)
+
+
+@receiver(pre_delete, sender=Product)
+def recompute_orders_of_deleted_product(sender, instance: Product, **kwargs):
+    # Каскадное удаление строк order_products не шлёт m2m_changed
+    order_pks = list(instance.orders.values_list("pk", flat=True))
+    if order_pks:
+        transaction.on_commit(lambda: recompute_orders(order_pks))
+
+
+@receiver(m2m_changed, sender=Order.products.through)
+def update_order_totals(sender, instance, action: str, reverse: bool, pk_set, **kwargs):
+    # reverse=True значит, что изменение пришло со стороны товара: product.orders.add(...)
+    if action == "post_add":
+        if reverse:
+            add_products(pk_set, [instance.pk])
+        else:
+            add_products([instance.pk], pk_set)
+    elif action == "post_remove":
+        recompute_orders(list(pk_set) if reverse else [instance.pk])
+    elif action == "pre_clear" and reverse:
+        instance._cleared_order_pks = list(instance.orders.values_list("pk", flat=True))
+    elif action == "post_clear":
+        recompute_orders(getattr(instance, "_cleared_order_pks", []) if reverse else [instance.pk])
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def invalidate_order_user(sender, instance: Order, **kwargs):
+    invalidate_users_orders([instance.user_id])
+
+
+@receiver(m2m_changed, sender=Order.products.through)
+def invalidate_order_products_users(sender, instance, action: str, reverse: bool, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        invalidate_users_orders([instance.user_id])
+    elif action == "post_clear":
+        invalidate_users_orders(users_of_orders(pk__in=getattr(instance, "_cleared_order_pks", [])))
+    else:
+        invalidate_users_orders(users_of_orders(pk__in=pk_set))
+
+
+@receiver(post_save, sender=Product)
+def invalidate_renamed_product_users(sender, instance: Product, created: bool, **kwargs):
+    old_name = getattr(instance, "_old_name", None)
+    if not created and old_name is not None and old_name != instance.name:
+        invalidate_users_orders(users_of_orders(products=instance.pk))
+
+
+@receiver(pre_delete, sender=Product)
+def invalidate_deleted_product_users(sender, instance: Product, **kwargs):
+    invalidate_users_orders(list(users_of_orders(products=instance.pk)))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def purge_proxy_cache(sender, instance, **kwargs):
+    purge_instances(sender, [instance.pk])
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def purge_image_product_proxy_cache(sender, instance: ProductImage, **kwargs):
+    purge_instances(Product, [instance.product_id])
+
+
+@receiver(m2m_changed, sender=Order.products.through)
+def purge_order_products_proxy_cache(sender, instance, action: str, reverse: bool, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        purge_instances(Order, [instance.pk])
+    elif action == "post_clear":
+        purge_instances(Order, getattr(instance, "_cleared_order_pks", []))
+    else:
+        purge_instances(Order, pk_set)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def mark_product_sitemap_dirty(sender, instance: Product, **kwargs):
+    mark_sitemaps_dirty(sender, [instance.pk])
+
+
+@receiver(post_save, sender=Product)
+def render_preview_variants(sender, instance: Product, update_fields=None, **kwargs):
+    if update_fields is not None and "preview" not in update_fields:
+        return
+    if instance.preview and not ImageVariant.objects.filter(source=instance.preview.name).exists():
+        generate_variants(instance.preview.name, instance.pk)
+
+
+@receiver(post_save, sender=ProductImage)
+def render_image_variants(sender, instance: ProductImage, **kwargs):
+    if not ImageVariant.objects.filter(source=instance.image.name).exists():
+        generate_variants(instance.image.name, instance.product_id)
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=ProductImage)
+def delete_image_variants(sender, instance, **kwargs):
+    name = instance.preview.name if sender is Product else instance.image.name
+    if name:
+        delete_variants([name])
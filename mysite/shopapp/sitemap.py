@@ -1,11 +1,235 @@
+"""
+Sharded sitemaps pre-rendered to files.
+
+Every section (see ``SITEMAP_SECTIONS``) is split into shards by pk range:
+shard ``n`` holds objects with ``n * shard_size <= pk < (n + 1) * shard_size``,
+so a change to an object touches exactly one shard. Shards are written as
+gzipped files to ``SITEMAP_ROOT`` together with the sitemap index, and the
+views only stream those files: crawlers never reach the database.
+
+``render_sitemaps`` writes all files. Writes only record the shards of
+changed objects as dirty (:func:`mark_sitemaps_dirty`), and
+``render_sitemaps --dirty`` (run it periodically) rewrites those shards
+and the index with their new ``lastmod``. Until ``render_sitemaps`` has
+run the views answer 404.
+"""
+import gzip
+import os
+from xml.sax.saxutils import escape
+
+from django.conf import settings
 from django.contrib.sitemaps import Sitemap
+from django.db import transaction
+from django.db.models import BigIntegerField, ExpressionWrapper, F, Max, QuerySet
+from django.http import FileResponse, Http404
+from django.urls import reverse
+from django.utils import timezone, translation
+from django.utils.module_loading import import_string
+
+from .models import DirtySitemapShard, Product
+
+INDEX_FILENAME = "sitemap.xml"
+
+
+class ShardedSitemap(Sitemap):
+    """
+    Sitemap section rendered from ``(pk, lastmod)`` rows only.
+    """
+    shard_size = 50000
+    url_name = None
+    lastmod_field = "updated_at"
+
+    def get_queryset(self) -> QuerySet:
+        raise NotImplementedError
+
+    def items(self):
+        return self.get_queryset().only("pk", self.lastmod_field).order_by("pk")
+
+    def lastmod(self, obj):
+        return getattr(obj, self.lastmod_field)
+
+    def shard_of(self, pk) -> int:
+        return int(pk) // self.shard_size
 
-from .models import Product
+    def shards(self) -> dict:
+        """
+        Returns shard number -> last modification time of its objects with one grouped query.
+        """
+        rows = (
+            self.get_queryset()
+            .order_by()
+            .annotate(shard=ExpressionWrapper(F("pk") / self.shard_size, output_field=BigIntegerField()))
+            .values("shard")
+            .annotate(lastmod=Max(self.lastmod_field))
+            .values_list("shard", "lastmod")
+        )
+        return dict(rows)
 
+    def rows(self, shard: int):
+        start = shard * self.shard_size
+        return (
+            self.get_queryset()
+            .filter(pk__gte=start, pk__lt=start + self.shard_size)
+            .order_by("pk")
+            .values_list("pk", self.lastmod_field)
+        )
 
-class ProductSitemap(Sitemap):
+
+class ProductSitemap(ShardedSitemap):
     changefreq = "never"
     priority = 0.5
+    url_name = "shopapp:product_details"
 
-    def items(self):
-        return Product.objects.all()
\ No newline at end of file
+    def get_queryset(self) -> QuerySet:
+        return Product.objects.filter(archived=False)
+
+
+def get_sections() -> dict:
+    return {
+        section: sitemap_class()
+        for section, sitemap_class in import_string(settings.SITEMAP_SECTIONS).items()
+    }
+
+
+def _absolute(path: str) -> str:
+    return settings.SITEMAP_BASE_URL.rstrip("/") + path
+
+
+def _language():
+    return translation.override(settings.LANGUAGES[0][0])
+
+
+def shard_filename(section: str, shard: int) -> str:
+    return f"sitemap-{section}-{shard}.xml.gz"
+
+
+def render_shard(sitemap: ShardedSitemap, shard: int) -> bytes:
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n']
+    with _language():
+        for pk, lastmod in sitemap.rows(shard).iterator(chunk_size=2000):
+            location = escape(_absolute(reverse(sitemap.url_name, kwargs={"pk": pk})))
+            lines.append(f"<url><loc>{location}</loc>")
+            if lastmod is not None:
+                lines.append(f"<lastmod>{lastmod.date().isoformat()}</lastmod>")
+            lines.append(f"<changefreq>{sitemap.changefreq}</changefreq><priority>{sitemap.priority}</priority></url>\n")
+    lines.append("</urlset>\n")
+    return "".join(lines).encode()
+
+
+def render_index(sections: dict) -> bytes:
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n']
+    with _language():
+        for section, sitemap in sections.items():
+            for shard, lastmod in sorted(sitemap.shards().items()):
+                location = escape(_absolute(reverse("sitemap_shard", kwargs={"section": section, "shard": shard})))
+                lines.append(f"<sitemap><loc>{location}</loc>")
+                if lastmod is not None:
+                    lines.append(f"<lastmod>{lastmod.isoformat()}</lastmod>")
+                lines.append("</sitemap>\n")
+    lines.append("</sitemapindex>\n")
+    return "".join(lines).encode()
+
+
+def _write(filename: str, content: bytes):
+    os.makedirs(settings.SITEMAP_ROOT, exist_ok=True)
+    path = os.path.join(settings.SITEMAP_ROOT, filename)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(content)
+    # Readers see either the old or the new file, never a half-written one
+    os.replace(tmp_path, path)
+
+
+def write_shard(section: str, sitemap: ShardedSitemap, shard: int):
+    """
+    Rewrites the shard file, removes it when the shard has no objects left.
+    """
+    content = render_shard(sitemap, shard)
+    if b"<url>" not in content:
+        try:
+            os.remove(os.path.join(settings.SITEMAP_ROOT, shard_filename(section, shard)))
+        except FileNotFoundError:
+            pass
+        return
+    _write(shard_filename(section, shard), gzip.compress(content, mtime=0))
+
+
+def write_index(sections: dict):
+    _write(INDEX_FILENAME, render_index(sections))
+
+
+def write_sitemaps() -> int:
+    """
+    Renders the index and every shard of every section, returns the number of shards.
+    """
+    started = timezone.now()
+    sections = get_sections()
+    count = 0
+    for section, sitemap in sections.items():
+        for shard in sitemap.shards():
+            write_shard(section, sitemap, shard)
+            count += 1
+    write_index(sections)
+    DirtySitemapShard.objects.filter(marked_at__lt=started).delete()
+    return count
+
+
+def write_dirty_sitemaps() -> int:
+    """
+    Rewrites the shards marked dirty and the index, whose ``lastmod`` of those shards changed.
+    Returns the number of shards rewritten.
+    """
+    sections = get_sections()
+    dirty = list(DirtySitemapShard.objects.order_by("section", "shard"))
+    for row in dirty:
+        if row.section in sections:
+            write_shard(row.section, sections[row.section], row.shard)
+        # A shard marked again meanwhile keeps its row for the next run
+        DirtySitemapShard.objects.filter(pk=row.pk, marked_at=row.marked_at).delete()
+    if dirty:
+        write_index(sections)
+    return len(dirty)
+
+
+def mark_sitemaps_dirty(model, pks):
+    """
+    Marks the shards holding ``pks`` of ``model`` dirty once the transaction commits.
+    """
+    pks = list(pks)
+
+    def mark():
+        now = timezone.now()
+        rows = [
+            DirtySitemapShard(section=section, shard=shard, marked_at=now)
+            for section, sitemap in get_sections().items()
+            if sitemap.get_queryset().model is model
+            for shard in {sitemap.shard_of(pk) for pk in pks}
+        ]
+        DirtySitemapShard.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=["section", "shard"],
+            update_fields=["marked_at"],
+        )
+
+    if pks:
+        transaction.on_commit(mark)
+
+
+def _serve(filename: str, content_type: str):
+    # Files are written by render_sitemaps only, a missing one is never rendered here
+    try:
+        file = open(os.path.join(settings.SITEMAP_ROOT, filename), "rb")
+    except FileNotFoundError:
+        raise Http404("No such sitemap")
+    return FileResponse(file, content_type=content_type)
+
+
+def sitemap_index(request):
+    return _serve(INDEX_FILENAME, "application/xml")
+
+
+def sitemap_shard(request, section: str, shard: int):
+    if section not in get_sections():
+        raise Http404("No such sitemap")
+    return _serve(shard_filename(section, shard), "application/gzip")
@@ -0,0 +1,123 @@
+"""
+Content-addressed, deduplicating file system storage for uploaded media.
+
+Every upload is hashed while it streams to a temporary file and kept once
+as a blob ``.blobs/<ab>/<cd>/<sha256>`` under ``MEDIA_ROOT``. The logical
+path chosen by ``upload_to`` (``products/product_1/images/photo.jpg``) is a
+hard link to that blob, so URLs, the web server and ``FieldFile`` keep working
+unchanged while identical uploads share one copy on disk.
+
+The link count of a blob is its reference count: deleting a logical file
+removes the blob together with its last reference. Orphaned blobs left by
+crashes are swept by the ``collect_media_blobs`` command.
+
+Settings::
+
+    STORAGES = {
+        "default": {"BACKEND": "shopapp.storage.DeduplicatingFileSystemStorage"},
+        ...
+    }
+"""
+import hashlib
+import os
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+
+BLOBS_DIR = ".blobs"
+
+
+def content_digest(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+class DeduplicatingFileSystemStorage(FileSystemStorage):
+    @property
+    def blobs_location(self) -> str:
+        return os.path.join(self.location, BLOBS_DIR)
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.blobs_location, digest[:2], digest[2:4], digest)
+
+    def _save(self, name, content):
+        full_path = self.path(name)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        tmp_dir = os.path.join(self.blobs_location, "tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    tmp.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(tmp_path, self.file_permissions_mode)
+            blob = self.blob_path(digest.hexdigest())
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            while True:
+                try:
+                    os.link(tmp_path, blob)
+                except FileExistsError:
+                    pass
+                try:
+                    os.link(blob, full_path)
+                except FileNotFoundError:
+                    # The blob lost its last reference meanwhile: store it again.
+                    continue
+                except FileExistsError:
+                    # Like FileSystemStorage: the name was taken after get_available_name().
+                    name = self.get_available_name(name)
+                    full_path = self.path(name)
+                    continue
+                break
+        finally:
+            os.remove(tmp_path)
+        return str(name).replace("\\", "/")
+
+    def delete(self, name):
+        if not name:
+            raise ValueError("The name must be given to delete().")
+        full_path = self.path(name)
+        try:
+            stat = os.stat(full_path)
+        except FileNotFoundError:
+            return
+        if stat.st_nlink == 2:
+            # The other link is probably the blob: drop it with its last reference.
+            blob = self.blob_path(self.digest(name))
+            try:
+                if os.path.samefile(blob, full_path):
+                    os.remove(blob)
+            except FileNotFoundError:
+                pass
+        super().delete(name)
+
+    def digest(self, name) -> str:
+        digest = hashlib.sha256()
+        with self.open(name, "rb") as file:
+            for chunk in file.chunks():
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def references(self, name) -> int:
+        """
+        Number of logical files sharing the content of ``name``.
+        """
+        return os.stat(self.path(name)).st_nlink - 1
+
+    def collect_blobs(self) -> int:
+        """
+        Removes blobs without logical files, returns their number.
+        """
+        removed = 0
+        for directory, _, filenames in os.walk(self.blobs_location):
+            if os.path.basename(directory) == "tmp":
+                continue
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                if os.stat(path).st_nlink == 1:
+                    os.remove(path)
+                    removed += 1
+        return removed
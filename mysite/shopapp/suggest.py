@@ -0,0 +1,207 @@
+"""
+In-process index of product names for typeahead suggestions.
+
+Every name is stored under the suffixes that start at its words
+(``"Gaming Laptop"`` -> ``"gaming laptop"``, ``"laptop"``) in one sorted list,
+so a query is a binary search followed by a short scan: it matches prefixes
+of the name and of any word inside it without touching the database.
+
+The index is built in a background thread on first use (until then
+suggestions come from a prefix query on the indexed name) and then kept up to date
+incrementally: product signals apply changes of this process, and writes of
+other processes (or bulk paths) are picked up through the ``Product`` cache
+generation or at the latest after ``sync_interval`` seconds, by reading the
+rows whose ``updated_at`` moved since the last sync and the
+:class:`~shopapp.models.ProductTombstone` rows of deleted products. Every
+``rebuild_interval`` the index is rebuilt in the background as well, which
+also catches deletes that bypassed the signals.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left, insort
+from datetime import timedelta
+
+from django.db import connection
+from django.utils import timezone
+
+from .cache import get_generation, model_scope
+from .models import Product, ProductTombstone
+
+log = logging.getLogger(__name__)
+
+MAX_KEY_LENGTH = 64
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.casefold().split())
+
+
+def name_keys(name: str) -> set:
+    normalized = normalize(name)
+    return {
+        normalized[position:position + MAX_KEY_LENGTH]
+        for position, char in enumerate(normalized)
+        if char.isalnum() and (position == 0 or not normalized[position - 1].isalnum())
+    }
+
+
+class ProductNameIndex:
+    sync_interval = 30
+    # Rows committed late may carry an updated_at before the previous sync
+    sync_overlap = timedelta(seconds=60)
+    rebuild_interval = 6 * 60 * 60
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._refreshing = threading.Lock()
+        self._entries = []
+        self._names = {}
+        self._generation = None
+        self._synced_at = None
+        self._checked = 0.0
+        self._built = 0.0
+
+    def __len__(self):
+        return len(self._names)
+
+    def add(self, pk, name: str):
+        with self._lock:
+            if self._names.get(pk) == name:
+                return
+            self.discard(pk)
+            self._names[pk] = name
+            for key in name_keys(name):
+                insort(self._entries, (key, pk))
+
+    def discard(self, pk):
+        with self._lock:
+            name = self._names.pop(pk, None)
+            if name is None:
+                return
+            for key in name_keys(name):
+                position = bisect_left(self._entries, (key, pk))
+                if position < len(self._entries) and self._entries[position] == (key, pk):
+                    del self._entries[position]
+
+    def apply(self, pk, name: str, archived: bool):
+        if archived:
+            self.discard(pk)
+        else:
+            self.add(pk, name)
+
+    def name(self, pk):
+        return self._names.get(pk)
+
+    def search(self, query: str, limit=10) -> list:
+        """
+        Returns up to ``limit`` (pk, name) whose name or a word in it starts with ``query``.
+        """
+        query = normalize(query)[:MAX_KEY_LENGTH]
+        if not query:
+            return []
+        self.refresh()
+        if not self.is_built():
+            return self.search_database(query, limit)
+        found = {}
+        with self._lock:
+            position = bisect_left(self._entries, (query,))
+            while position < len(self._entries) and len(found) < limit:
+                key, pk = self._entries[position]
+                if not key.startswith(query):
+                    break
+                found.setdefault(pk, self._names[pk])
+                position += 1
+        return self._ordered(found.items(), query)
+
+    def search_database(self, query: str, limit: int) -> list:
+        """
+        Names starting with the query, while the index is being built.
+
+        Words inside names are not matched: that would scan the whole table
+        on every keystroke.
+        """
+        rows = (
+            Product.objects
+            .filter(archived=False, name__istartswith=query)
+            .values_list("pk", "name")[:limit]
+        )
+        return self._ordered(rows, query)
+
+    @staticmethod
+    def _ordered(items, query: str) -> list:
+        # Names starting with the query come before matches inside them
+        return sorted(items, key=lambda item: (not normalize(item[1]).startswith(query), item[1]))
+
+    def refresh(self):
+        generation = get_generation(model_scope(Product))
+        now = time.monotonic()
+        if (
+            self._synced_at is not None
+            and generation == self._generation
+            and now - self._checked < self.sync_interval
+            and now - self._built < self.rebuild_interval
+        ):
+            return
+        # Other threads keep searching the current entries while one of them refreshes
+        if not self._refreshing.acquire(blocking=False):
+            return
+        if not self.is_built() or now - self._built > self.rebuild_interval:
+            self.start_rebuild()
+            return
+        try:
+            self.sync()
+        finally:
+            self._refreshing.release()
+
+    def start_rebuild(self):
+        """
+        Rebuilds the index in a background thread; the caller holds the refresh lock.
+        """
+        threading.Thread(target=self._rebuild_in_background, name="product-name-index", daemon=True).start()
+
+    def _rebuild_in_background(self):
+        try:
+            self.rebuild()
+        except Exception:
+            log.exception("Product name index rebuild failed")
+        finally:
+            connection.close()
+            self._refreshing.release()
+
+    def rebuild(self):
+        generation = get_generation(model_scope(Product))
+        synced_at = timezone.now()
+        rows = Product.objects.filter(archived=False).values_list("pk", "name").iterator(chunk_size=10000)
+        names = dict(rows)
+        entries = sorted((key, pk) for pk, name in names.items() for key in name_keys(name))
+        with self._lock:
+            self._names, self._entries = names, entries
+            self._synced_at = synced_at
+            self._generation = generation
+            self._checked = self._built = time.monotonic()
+        # Processes that have not synced for that long rebuild instead
+        ProductTombstone.objects.filter(deleted_at__lt=synced_at - 2 * timedelta(seconds=self.rebuild_interval)).delete()
+
+    def sync(self):
+        generation = get_generation(model_scope(Product))
+        synced_at = timezone.now()
+        since = self._synced_at - self.sync_overlap
+        rows = (
+            Product.objects
+            .filter(updated_at__gte=since)
+            .values_list("pk", "name", "archived")
+        )
+        for pk, name, archived in rows:
+            self.apply(pk, name, archived)
+        for pk in ProductTombstone.objects.filter(deleted_at__gte=since).values_list("product_id", flat=True):
+            self.discard(pk)
+        self._synced_at = synced_at
+        self._generation = generation
+        self._checked = time.monotonic()
+
+    def is_built(self) -> bool:
+        return self._synced_at is not None
+
+
+product_index = ProductNameIndex()
@@ -0,0 +1,158 @@
+"""
+Surrogate keys for the caching reverse proxy.
+
+Cacheable responses name what they were rendered from in the ``Surrogate-Key``
+header: a collection key per model (``shopapp.product``) and an instance key
+per object (``shopapp.product:42``). Writes send purge requests for those keys
+to the purger configured with ``SURROGATE_PURGER`` once the transaction commits,
+so the proxy can keep pages for hours and still drop exactly the stale ones.
+"""
+import logging
+import urllib.error
+import urllib.request
+from functools import wraps
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+log = logging.getLogger(__name__)
+
+SURROGATE_KEY_HEADER = "Surrogate-Key"
+CACHEABLE_STATUSES = (200, 304)
+
+
+def collection_key(model) -> str:
+    return model._meta.label_lower
+
+
+def instance_key(model, pk) -> str:
+    return f"{model._meta.label_lower}:{pk}"
+
+
+def add_surrogate_keys(response, keys, public=True):
+    """
+    Merges ``keys`` into the ``Surrogate-Key`` header of ``response``.
+
+    Public responses also get ``Surrogate-Control``, so the proxy keeps them
+    for ``SURROGATE_MAX_AGE`` seconds while browsers follow ``Cache-Control``.
+    """
+    keys = [*response.get(SURROGATE_KEY_HEADER, "").split(), *keys]
+    response.headers[SURROGATE_KEY_HEADER] = " ".join(dict.fromkeys(keys))
+    if public and not response.has_header("Surrogate-Control"):
+        response.headers["Surrogate-Control"] = f"max-age={settings.SURROGATE_MAX_AGE}"
+    return response
+
+
+def surrogate_keys(*models):
+    """
+    View decorator tagging successful GET responses with collection keys of ``models``.
+    """
+    keys = [collection_key(model) for model in models]
+
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            response = view_func(request, *args, **kwargs)
+            if request.method in ("GET", "HEAD") and response.status_code in CACHEABLE_STATUSES:
+                add_surrogate_keys(response, keys)
+            return response
+        return wrapper
+    return decorator
+
+
+class SurrogateKeyMixin:
+    """
+    Tags responses of class-based views (Django and DRF) with surrogate keys.
+
+    Detail views (with ``pk`` in the URL) get the instance key, lists get the
+    collection key. Views of private pages set ``surrogate_public = False``.
+    """
+    surrogate_model = None
+    surrogate_public = True
+
+    def get_surrogate_model(self):
+        if self.surrogate_model is not None:
+            return self.surrogate_model
+        return getattr(self, "model", None) or self.queryset.model
+
+    def get_surrogate_keys(self, response) -> list:
+        model = self.get_surrogate_model()
+        pk = self.kwargs.get("pk")
+        if pk is not None:
+            return [instance_key(model, pk)]
+        return [collection_key(model)]
+
+    def dispatch(self, request, *args, **kwargs):
+        response = super().dispatch(request, *args, **kwargs)
+        if request.method in ("GET", "HEAD") and response.status_code in CACHEABLE_STATUSES:
+            add_surrogate_keys(response, self.get_surrogate_keys(response), public=self.surrogate_public)
+        return response
+
+
+class BasePurger:
+    def __init__(self, options: dict):
+        self.options = options
+
+    def purge(self, keys: list):
+        raise NotImplementedError
+
+
+class LogPurger(BasePurger):
+    """
+    Stand-in purger: writes purged keys to the log.
+    """
+    def purge(self, keys: list):
+        log.info("Purge surrogate keys: %s", " ".join(keys))
+
+
+class LocmemPurger(BasePurger):
+    """
+    Test purger: collects purged keys in :data:`outbox`.
+    """
+    outbox = []
+
+    def purge(self, keys: list):
+        self.outbox.append(keys)
+
+
+class HTTPPurger(BasePurger):
+    """
+    Sends ``POST <URL>`` with the keys in the ``Surrogate-Key`` header.
+
+    Options: ``URL``, ``TOKEN`` (sent as ``Authorization: Bearer``), ``TIMEOUT``.
+    Failures are logged: the proxy then falls back to its TTL.
+    """
+    def purge(self, keys: list):
+        request = urllib.request.Request(
+            self.options["URL"],
+            method="POST",
+            headers={SURROGATE_KEY_HEADER: " ".join(keys)},
+        )
+        if self.options.get("TOKEN"):
+            request.add_header("Authorization", f"Bearer {self.options['TOKEN']}")
+        try:
+            with urllib.request.urlopen(request, timeout=self.options.get("TIMEOUT", 5)):
+                pass
+        except (urllib.error.URLError, OSError):
+            log.exception("Failed to purge surrogate keys: %s", " ".join(keys))
+
+
+def get_purger() -> BasePurger:
+    return import_string(settings.SURROGATE_PURGER)(settings.SURROGATE_PURGER_OPTIONS)
+
+
+def purge_keys(keys):
+    """
+    Purges ``keys`` from the proxy once the transaction commits.
+    """
+    keys = sorted(set(keys))
+    if keys:
+        transaction.on_commit(lambda: get_purger().purge(keys))
+
+
+def purge_instances(model, pks):
+    """
+    Purges the collection of ``model`` and its instances with ``pks``.
+    """
+    purge_keys([collection_key(model), *(instance_key(model, pk) for pk in pks)])
@@ -0,0 +1,46 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+
+from shopapp.images import variants_for
+
+register = template.Library()
+
+
+def _srcset(variants) -> str:
+    return ", ".join(f"{variant.file.url} {variant.width}w" for variant in variants)
+
+
+@register.simple_tag
+def picture(image, variants=None, sizes="100vw", alt=""):
+    """
+    Renders ``<picture>`` with WebP and JPEG ``srcset`` of the image variants.
+
+    ``variants`` is a mapping from :func:`shopapp.images.variants_for`; pass it
+    in lists to load variants of all images with one query. Images without
+    variants (not rendered yet) fall back to the original file.
+    """
+    if not image:
+        return ""
+    if variants is None:
+        variants = variants_for([image.name])
+    by_format = {}
+    for variant in variants.get(image.name, []):
+        by_format.setdefault(variant.format, []).append(variant)
+    fallback = by_format.get("jpeg") or by_format.get("webp")
+    if not fallback:
+        return format_html('<img src="{}" alt="{}" loading="lazy">', image.url, alt)
+    sources = format_html_join(
+        "",
+        '<source type="image/{}" srcset="{}" sizes="{}">',
+        ((fmt, _srcset(by_format[fmt]), sizes) for fmt in ("webp",) if fmt in by_format),
+    )
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" alt="{}" loading="lazy"></picture>',
+        sources,
+        fallback[0].file.url,
+        _srcset(fallback),
+        sizes,
+        fallback[0].width,
+        fallback[0].height,
+        alt,
+    )
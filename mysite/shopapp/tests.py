@@ -1,15 +1,77 @@
+import gzip
+import multiprocessing
+import os
+import pickle
+import tempfile
+import time
+import zipfile
+from decimal import Decimal
+from io import BytesIO, StringIO
 from string import ascii_letters
 from random import choices
+from unittest import mock
+from urllib.parse import parse_qsl, urlsplit
+
+from PIL import Image
 
 from django.conf import settings
-from django.contrib.auth.models import User
-from django.test import TestCase
+from django.contrib import admin
+from django.contrib.auth.models import Permission, User
+from django.core.management import call_command
+from django.db import connection
+from django.core.cache import cache, caches
+from django.core.cache.backends.base import CacheKeyWarning
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import translation
+from django.utils.html import escape
+
+from rest_framework.response import Response
 
-from shopapp.models import Product, Order
+from shopapp.admin import OrderAdmin, ProductAdmin, mark_archived
+from shopapp.cache import get_or_recompute
+from shopapp.cache_backends import SEQ, MmapCache
+from shopapp.imaging import render_variants
+from shopapp.images import save_product_images
+from shopapp.fastjson import FastJSONListMixin
+from shopapp.common import save_csv_products, save_csv_orders, sync_csv_products
+from shopapp.models import DirtySitemapShard, ImageVariant, Product, ProductImage, Order
+from shopapp.search import search_products
+from shopapp.sitemap import ProductSitemap, shard_filename, write_index, write_shard
+from shopapp.storage import DeduplicatingFileSystemStorage
+from shopapp.suggest import ProductNameIndex, product_index
+from shopapp.surrogate import LocmemPurger
 from shopapp.utils import add_two_numbers
 
 
+def setUpModule():
+    # Signals rewrite sitemap files after commit, keep them out of the project
+    sitemap_root = tempfile.TemporaryDirectory()
+    sitemaps = override_settings(SITEMAP_ROOT=sitemap_root.name)
+    sitemaps.enable()
+    unittest_cleanups.extend([sitemaps.disable, sitemap_root.cleanup])
+
+
+def tearDownModule():
+    while unittest_cleanups:
+        unittest_cleanups.pop(0)()
+
+
+unittest_cleanups = []
+
+
+class EnglishURLsMixin:
+    """
+    LANGUAGE_CODE "en-us" is not in LANGUAGES, so reverse() needs an active language.
+    """
+    def setUp(self) -> None:
+        super().setUp()
+        translation.activate("en")
+
+
 class AddTwoNumbersTestCase(TestCase):
     def test_add_two_numbers(self):
         result = add_two_numbers(2, 3)
@@ -190,3 +252,1523 @@ class OrdersExportViewTestCase(TestCase):
             orders_data["orders"],
             expected_data
         )
+
+
+class ProductsDownloadCSVTestCase(EnglishURLsMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Product.objects.create(name="Laptop", description="A laptop", price="999.99", discount=5)
+        Product.objects.create(name="Desktop", description="A desktop", price="1999.00")
+
+    def test_download_csv_streams_rows(self):
+        response = self.client.get(reverse("shopapp:product-download-csv"))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        content = b"".join(response.streaming_content).decode()
+        self.assertEqual(
+            content.splitlines(),
+            [
+                "name,description,price,discount",
+                "Desktop,A desktop,1999.00,0",
+                "Laptop,A laptop,999.99,5",
+            ],
+        )
+
+    def test_download_csv_keeps_filters(self):
+        response = self.client.get(
+            reverse("shopapp:product-download-csv"),
+            {"search": "lap"},
+            HTTP_ACCEPT_ENCODING="gzip, deflate",
+        )
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        content = gzip.decompress(b"".join(response.streaming_content)).decode()
+        self.assertEqual(len(content.splitlines()), 2)
+        self.assertIn("Laptop", content)
+
+
+class SaveCSVProductsTestCase(TestCase):
+    def test_import_in_batches_and_reject_bad_rows(self):
+        file = BytesIO(
+            b"name,description,price,discount\n"
+            b"Laptop 13,A smaller one,2099.99,3\n"
+            b"Laptop 15,A bigger one,not-a-price,5\n"
+            b",No name,10,0\n"
+            b"Laptop 17,The biggest one,2999.99,\n"
+        )
+        result = save_csv_products(file, encoding="utf-8", batch_size=1)
+        self.assertEqual(result.imported, 2)
+        self.assertEqual(result.rejected, 2)
+        self.assertEqual([error["line"] for error in result.errors], [3, 4])
+        self.assertIn("price", result.errors[0]["errors"])
+        product = Product.objects.get(name="Laptop 17")
+        self.assertEqual(product.price, Decimal("2999.99"))
+        self.assertEqual(product.discount, 0)
+
+    def test_unknown_columns(self):
+        file = BytesIO(b"name,colour\nLaptop,red\n")
+        with self.assertRaises(ValueError):
+            save_csv_products(file, encoding="utf-8")
+        self.assertFalse(Product.objects.exists())
+
+    def test_missing_name_column(self):
+        file = BytesIO(b"description,price\nThin laptop,10\n")
+        with self.assertRaises(ValueError):
+            save_csv_products(file, encoding="utf-8")
+        self.assertFalse(Product.objects.exists())
+
+
+class SaveCSVOrdersTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="csv_buyer", password="qwerty")
+        cls.laptop = Product.objects.create(name="Laptop")
+        cls.phone = Product.objects.create(name="Phone")
+
+    def test_import_orders_with_products(self):
+        file = BytesIO(
+            "delivery_address,promocode,user_id,username,product_ids,product_names\n"
+            f"Street 1,SALE,{self.user.pk},,{self.laptop.pk};{self.phone.pk},\n"
+            f"Street 2,,,csv_buyer,,Phone\n"
+            f"Street 3,,,ghost,,Phone\n"
+            f"Street 4,,{self.user.pk},,100500,\n".encode()
+        )
+        with self.assertNumQueries(8):
+            result = save_csv_orders(file, encoding="utf-8")
+        self.assertEqual(result.imported, 2)
+        self.assertEqual([error["line"] for error in result.errors], [4, 5])
+        first, second = Order.objects.order_by("pk")
+        self.assertEqual(set(first.products.all()), {self.laptop, self.phone})
+        self.assertEqual(list(second.products.all()), [self.phone])
+        self.assertEqual(second.user, self.user)
+
+
+class SyncCSVProductsTestCase(TestCase):
+    def test_upsert_writes_only_delta(self):
+        Product.objects.create(name="Laptop 13", description="A smaller one", price="2099.99", discount=3)
+        Product.objects.create(name="Laptop 15", description="A one more big", price="2599.99", discount=5)
+        Product.objects.create(name="Laptop 9", description="Discontinued", price="999")
+        file = BytesIO(
+            b"name,description,price,discount\n"
+            b"Laptop 13,A smaller one,2099.99,3\n"
+            b"Laptop 15,A one more big,2499.9,5\n"
+            b"Laptop 17,The biggest one,2999.99,0\n"
+        )
+        result = sync_csv_products(file, encoding="utf-8", archive_missing=True)
+        self.assertEqual(
+            (result.inserted, result.updated, result.unchanged, result.archived),
+            (1, 1, 1, 1),
+        )
+        self.assertEqual(Product.objects.get(name="Laptop 15").price, Decimal("2499.90"))
+        self.assertTrue(Product.objects.get(name="Laptop 9").archived)
+        self.assertEqual(Product.objects.count(), 4)
+
+    def test_key_only_feed_updates_nothing(self):
+        Product.objects.create(name="Laptop 13", price="2099.99")
+        file = BytesIO(b"name\nLaptop 13\nLaptop 17\n")
+        result = sync_csv_products(file, encoding="utf-8")
+        self.assertEqual((result.inserted, result.updated, result.unchanged), (1, 0, 1))
+        self.assertEqual(Product.objects.get(name="Laptop 13").price, Decimal("2099.99"))
+
+    def test_missing_key_or_name_column(self):
+        with self.assertRaises(ValueError):
+            sync_csv_products(BytesIO(b"description,price\nThin,10\n"), encoding="utf-8")
+        with self.assertRaises(ValueError):
+            sync_csv_products(BytesIO(b"description,price\nThin,10\n"), encoding="utf-8", key="description")
+        self.assertFalse(Product.objects.exists())
+
+
+class KeysetPaginationTestCase(EnglishURLsMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for name, price in [("A", 30), ("B", 10), ("C", 20), ("D", 10), ("E", 20)]:
+            Product.objects.create(name=name, price=price)
+
+    def walk(self, url, params):
+        names = []
+        response = self.client.get(url, params)
+        while True:
+            names.append([product["name"] for product in response.json()["results"]])
+            if not response.json()["next"]:
+                return names, response
+            response = self.client.get(response.json()["next"])
+
+    def test_pages_by_ordering_with_pk_tie_breaker(self):
+        url = reverse("shopapp:product-list")
+        names, last = self.walk(url, {"ordering": "-price", "page_size": 2})
+        self.assertEqual(names, [["A", "C"], ["E", "B"], ["D"]])
+        previous = self.client.get(last.json()["previous"]).json()
+        self.assertEqual([product["name"] for product in previous["results"]], ["E", "B"])
+
+    def test_pages_newest_first(self):
+        names, _ = self.walk(reverse("shopapp:product-list"), {"ordering": "-pk", "page_size": 2})
+        self.assertEqual(names, [["E", "D"], ["C", "B"], ["A"]])
+
+    def test_no_count_query_by_default(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("shopapp:product-list"), {"page_size": 2})
+        self.assertNotIn("count", response.json())
+        # The only aggregates are the conditional GET validator (MAX(updated_at), COUNT(*))
+        # and the facet counts, the page itself is not counted
+        self.assertFalse(any(
+            "COUNT(" in query["sql"] and "MAX(" not in query["sql"] and '"price:0-50"' not in query["sql"]
+            for query in queries
+        ))
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse("shopapp:product-list"), {"cursor": "garbage"})
+        self.assertEqual(response.status_code, 404)
+
+
+class ProductFullTextSearchTestCase(EnglishURLsMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.laptop_bag = Product.objects.create(name="Laptop bag", description="Fits any laptop")
+        cls.laptop = Product.objects.create(name="Gaming laptop", description="Fast")
+        Product.objects.create(name="Phone", description="Not a notebook")
+
+    def test_index_follows_saves_and_deletes(self):
+        self.assertEqual(set(search_products(Product.objects.all(), ["lapt"])), {self.laptop, self.laptop_bag})
+        self.laptop.name = "Gaming notebook"
+        self.laptop.save()
+        self.assertEqual(list(search_products(Product.objects.all(), ["gaming", "note"])), [self.laptop])
+        self.laptop_bag.delete()
+        self.assertEqual(list(search_products(Product.objects.all(), ["lapt"])), [])
+
+    def test_bulk_import_is_indexed(self):
+        save_csv_products(BytesIO(b"name,description\nUltrabook,Thin laptop\n"), encoding="utf-8")
+        names = [product.name for product in search_products(Product.objects.all(), ["ultra"])]
+        self.assertEqual(names, ["Ultrabook"])
+
+    def test_api_search_is_ranked_and_paginated(self):
+        ranked = [product.name for product in search_products(Product.objects.all(), ["laptop"])]
+        response = self.client.get(reverse("shopapp:product-list"), {"search": "laptop", "page_size": 1})
+        names = [product["name"] for product in response.json()["results"]]
+        response = self.client.get(response.json()["next"])
+        names += [product["name"] for product in response.json()["results"]]
+        self.assertIsNone(response.json()["next"])
+        self.assertEqual(names, ranked)
+        self.assertEqual(len(names), 2)
+
+
+class OrderTotalsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="totals_buyer", password="qwerty")
+        cls.laptop = Product.objects.create(name="Laptop", price="1000.00", discount=10)
+        cls.phone = Product.objects.create(name="Phone", price="500.00")
+
+    def assertTotals(self, order, total, count):
+        order.refresh_from_db()
+        self.assertEqual((order.total, order.products_count), (Decimal(total), count))
+
+    def test_totals_follow_products_and_prices(self):
+        order = Order.objects.create(user=self.user)
+        order.products.add(self.laptop, self.phone)
+        self.assertTotals(order, "1400.00", 2)
+
+        self.laptop.discount = 0
+        self.laptop.save()
+        self.assertTotals(order, "1500.00", 2)
+
+        self.phone.orders.remove(order)
+        self.assertTotals(order, "1000.00", 1)
+
+        order.products.clear()
+        self.assertTotals(order, "0", 0)
+
+    def test_deleted_product_leaves_order_totals(self):
+        order = Order.objects.create(user=self.user)
+        order.products.add(self.laptop, self.phone)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.phone.delete()
+        self.assertTotals(order, "900.00", 1)
+
+    def test_recompute_command(self):
+        order = Order.objects.create(user=self.user)
+        order.products.add(self.laptop, self.phone)
+        Order.objects.update(total=0, products_count=0)
+        call_command("recompute_order_totals", stdout=StringIO())
+        self.assertTotals(order, "1400.00", 2)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class UsersOrdersExportCacheTestCase(EnglishURLsMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user(username="alice", password="qwerty")
+        cls.bob = User.objects.create_user(username="bob_export", password="qwerty")
+        cls.laptop = Product.objects.create(name="Laptop")
+        cls.alice_order = Order.objects.create(user=cls.alice, delivery_address="Alice st")
+        Order.objects.create(user=cls.bob, delivery_address="Bob st")
+
+    def setUp(self) -> None:
+        super().setUp()
+        cache.clear()
+        self.client.force_login(self.alice)
+
+    def export(self, user):
+        response = self.client.get(reverse("shopapp:user_orders_export", kwargs={"pk": user.pk}))
+        return response.json()["orders"]
+
+    def test_cache_is_per_user(self):
+        self.assertEqual(self.export(self.alice)[0]["delivery_address"], "Alice st")
+        self.assertEqual(self.export(self.bob)[0]["delivery_address"], "Bob st")
+
+    def test_cache_is_invalidated_by_order_and_product_changes(self):
+        self.assertEqual(self.export(self.alice)[0]["products"], [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.alice_order.products.add(self.laptop)
+        self.assertEqual(self.export(self.alice)[0]["products"], ["Laptop"])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.laptop.name = "Notebook"
+            self.laptop.save()
+        self.assertEqual(self.export(self.alice)[0]["products"], ["Notebook"])
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class ProductListGenerationCacheTestCase(EnglishURLsMixin, TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        cache.clear()
+
+    def names(self):
+        response = self.client.get(reverse("shopapp:product-list"))
+        return [product["name"] for product in response.json()["results"]]
+
+    def test_list_is_cached_until_products_change(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            laptop = Product.objects.create(name="Laptop")
+        self.assertEqual(self.names(), ["Laptop"])
+        # Only the ETag / Last-Modified aggregate, the page itself comes from the cache
+        with self.assertNumQueries(1):
+            self.assertEqual(self.names(), ["Laptop"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name="Phone")
+        self.assertEqual(self.names(), ["Laptop", "Phone"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            mark_archived(None, None, Product.objects.filter(pk=laptop.pk))
+        self.assertEqual(
+            [product["archived"] for product in self.client.get(reverse("shopapp:product-list")).json()["results"]],
+            [True, False],
+        )
+
+
+class ConditionalGetTestCase(EnglishURLsMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.laptop = Product.objects.create(name="Laptop", price="1999.99")
+        Product.objects.create(name="Phone", price="999.99")
+
+    def test_unchanged_list_is_not_modified_with_one_query(self):
+        url = reverse("shopapp:products-export")
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header("Last-Modified"))
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+    def test_changes_and_bulk_paths_update_validators(self):
+        url = reverse("shopapp:product_details", kwargs={"pk": self.laptop.pk})
+        etag = self.client.get(url)["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        mark_archived(None, None, Product.objects.filter(pk=self.laptop.pk))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_api_detail_and_list_have_their_own_tags(self):
+        detail = self.client.get(reverse("shopapp:product-detail", kwargs={"pk": self.laptop.pk}))
+        listing = self.client.get(reverse("shopapp:product-list"))
+        self.assertNotEqual(detail["ETag"], listing["ETag"])
+        response = self.client.get(
+            reverse("shopapp:product-detail", kwargs={"pk": self.laptop.pk}),
+            HTTP_IF_NONE_MATCH=detail["ETag"],
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.client.get(reverse("shopapp:product-detail", kwargs={"pk": "abc"})).status_code, 404)
+
+
+@override_settings(SURROGATE_PURGER="shopapp.surrogate.LocmemPurger")
+class SurrogateKeysTestCase(EnglishURLsMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="surrogate", password="qwerty")
+        cls.laptop = Product.objects.create(name="Laptop")
+        cls.order = Order.objects.create(user=cls.user, delivery_address="Main st")
+        cls.order.products.add(cls.laptop)
+
+    def setUp(self) -> None:
+        super().setUp()
+        LocmemPurger.outbox.clear()
+
+    def keys(self, response):
+        return response["Surrogate-Key"].split()
+
+    def test_public_responses_are_tagged(self):
+        response = self.client.get(reverse("shopapp:product_details", kwargs={"pk": self.laptop.pk}))
+        self.assertEqual(self.keys(response), [f"shopapp.product:{self.laptop.pk}"])
+        self.assertEqual(response["Surrogate-Control"], f"max-age={settings.SURROGATE_MAX_AGE}")
+        self.assertEqual(self.keys(self.client.get(reverse("shopapp:product-list"))), ["shopapp.product"])
+        self.assertEqual(self.keys(self.client.get(reverse("shopapp:latest_products_feed"))), ["shopapp.product"])
+        self.assertEqual(
+            self.keys(self.client.get(reverse("sitemaps"))),
+            ["shopapp.product", "blogapp.articlevideo"],
+        )
+
+    def test_order_responses_are_private_and_name_their_products(self):
+        response = self.client.get(reverse("shopapp:order-detail", kwargs={"pk": self.order.pk}))
+        self.assertEqual(
+            self.keys(response),
+            [f"shopapp.order:{self.order.pk}", f"shopapp.product:{self.laptop.pk}"],
+        )
+        self.assertFalse(response.has_header("Surrogate-Control"))
+
+    def test_writes_purge_keys_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.laptop.name = "Notebook"
+            self.laptop.save()
+            self.assertEqual(LocmemPurger.outbox, [])
+        self.assertIn(["shopapp.product", f"shopapp.product:{self.laptop.pk}"], LocmemPurger.outbox)
+
+        LocmemPurger.outbox.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            mark_archived(None, None, Product.objects.filter(pk=self.laptop.pk))
+        self.assertEqual(LocmemPurger.outbox, [["shopapp.product", f"shopapp.product:{self.laptop.pk}"]])
+
+
+@mock.patch.object(ProductSitemap, "shard_size", 2)
+class SitemapTestCase(EnglishURLsMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = [Product.objects.create(name=f"Product {number}") for number in range(5)]
+        cls.archived = Product.objects.create(name="Archived", archived=True)
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.sitemap_root = settings.SITEMAP_ROOT
+
+    def read(self, response) -> bytes:
+        content = b"".join(response.streaming_content)
+        response.close()
+        return content
+
+    def shard_of(self, product: Product) -> int:
+        return product.pk // ProductSitemap.shard_size
+
+    def test_index_lists_shards_of_visible_products(self):
+        call_command("render_sitemaps", stdout=StringIO())
+        index = self.read(self.client.get(reverse("sitemaps"))).decode()
+        for shard in {self.shard_of(product) for product in self.products}:
+            self.assertIn(reverse("sitemap_shard", kwargs={"section": "products", "shard": shard}), index)
+        urls = "".join(
+            gzip.decompress(open(os.path.join(self.sitemap_root, filename), "rb").read()).decode()
+            for filename in os.listdir(self.sitemap_root)
+            if filename.startswith("sitemap-products-")
+        )
+        for product in self.products:
+            self.assertIn(reverse("shopapp:product_details", kwargs={"pk": product.pk}), urls)
+        self.assertNotIn(reverse("shopapp:product_details", kwargs={"pk": self.archived.pk}) + "<", urls)
+
+    def test_crawlers_do_not_query_the_database(self):
+        call_command("render_sitemaps", stdout=StringIO())
+        shard = self.shard_of(self.products[0])
+        with self.assertNumQueries(0):
+            index = self.client.get(reverse("sitemaps"))
+            response = self.client.get(reverse("sitemap_shard", kwargs={"section": "products", "shard": shard}))
+        self.assertEqual(index.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/gzip")
+        urls = gzip.decompress(self.read(response)).decode()
+        self.assertIn(reverse("shopapp:product_details", kwargs={"pk": self.products[0].pk}), urls)
+        self.read(index)
+
+    def test_missing_files_are_not_rendered(self):
+        empty_root = tempfile.TemporaryDirectory()
+        self.addCleanup(empty_root.cleanup)
+        with self.settings(SITEMAP_ROOT=empty_root.name), self.assertNumQueries(0):
+            index = self.client.get(reverse("sitemaps"))
+            response = self.client.get(reverse("sitemap_shard", kwargs={"section": "products", "shard": 0}))
+        self.assertEqual(index.status_code, 404)
+        self.assertEqual(response.status_code, 404)
+
+    def test_save_marks_its_shard_dirty_without_rendering(self):
+        call_command("render_sitemaps", stdout=StringIO())
+        # A product sharing its shard, so the shard stays
+        shards = [self.shard_of(product) for product in self.products]
+        product = next(product for product in self.products if shards.count(self.shard_of(product)) > 1)
+        with mock.patch("shopapp.sitemap.write_shard", wraps=write_shard) as written:
+            with self.captureOnCommitCallbacks(execute=True):
+                product.archived = True
+                product.save()
+        self.assertFalse(written.called)
+        self.assertEqual(
+            list(DirtySitemapShard.objects.values_list("section", "shard")),
+            [("products", self.shard_of(product))],
+        )
+
+        with mock.patch("shopapp.sitemap.write_shard", wraps=write_shard) as written, \
+                mock.patch("shopapp.sitemap.write_index", wraps=write_index) as index_written:
+            call_command("render_sitemaps", "--dirty", stdout=StringIO())
+        self.assertEqual([call.args[2] for call in written.call_args_list], [self.shard_of(product)])
+        # The index carries the new lastmod of the shard
+        self.assertEqual(index_written.call_count, 1)
+        self.assertFalse(DirtySitemapShard.objects.exists())
+        path = os.path.join(self.sitemap_root, shard_filename("products", self.shard_of(product)))
+        urls = gzip.decompress(open(path, "rb").read()).decode()
+        self.assertNotIn(reverse("shopapp:product_details", kwargs={"pk": product.pk}) + "<", urls)
+
+    def test_new_shard_rewrites_index(self):
+        call_command("render_sitemaps", stdout=StringIO())
+        shard = self.shard_of(self.products[-1]) + 3
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(pk=shard * ProductSitemap.shard_size, name="Far away")
+        call_command("render_sitemaps", "--dirty", stdout=StringIO())
+        index = self.read(self.client.get(reverse("sitemaps"))).decode()
+        self.assertIn(reverse("sitemap_shard", kwargs={"section": "products", "shard": shard}), index)
+
+
+class AdminExportTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="buyer", password="qwerty")
+        cls.laptop = Product.objects.create(name="Laptop", price=Decimal("999.90"))
+        cls.phone = Product.objects.create(name="=Phone")
+        cls.orders = [Order.objects.create(user=cls.user, delivery_address=f"Street {number}") for number in range(3)]
+        for order in cls.orders:
+            order.products.add(cls.laptop, cls.phone)
+
+    def read(self, response) -> bytes:
+        content = b"".join(response.streaming_content)
+        response.close()
+        return content
+
+    def test_orders_csv_fetches_related_fields_per_chunk(self):
+        order_admin = OrderAdmin(Order, admin.site)
+        with self.assertNumQueries(2):
+            content = self.read(order_admin.export_as_csv(None, Order.objects.order_by("pk"))).decode()
+        lines = content.splitlines()
+        self.assertEqual(lines[0], "id,delivery_address,promocode,created_at,user__username,total,products_count,products")
+        self.assertEqual(len(lines), 4)
+        self.assertIn("buyer", lines[1])
+        self.assertTrue(lines[1].endswith("Laptop;=Phone"))
+
+    def test_products_xlsx(self):
+        product_admin = ProductAdmin(Product, admin.site)
+        response = product_admin.export_as_xlsx(None, Product.objects.order_by("pk"))
+        self.assertIn("shopapp.product-export.xlsx", response["Content-Disposition"])
+        with zipfile.ZipFile(BytesIO(self.read(response))) as workbook:
+            sheet = workbook.read("xl/worksheets/sheet1.xml").decode()
+        self.assertIn("Laptop", sheet)
+        self.assertIn("999.9", sheet)
+        # Cells starting with "=" stay text instead of turning into formulas
+        self.assertNotIn("<f>", sheet)
+
+
+class FastChangeListTestCase(EnglishURLsMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(username="changelist", password="qwerty")
+        cls.products = [
+            Product.objects.create(name=f"Product {number}", description="x" * 1000)
+            for number in range(3)
+        ]
+        order = Order.objects.create(user=cls.admin, delivery_address="Main st")
+        order.products.add(*cls.products)
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.client.force_login(self.admin)
+
+    def changelist_queries(self, url_name, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(url_name), params)
+        self.assertEqual(response.status_code, 200)
+        return response, [query["sql"] for query in queries]
+
+    def test_products_changelist_loads_listed_columns(self):
+        response, queries = self.changelist_queries("admin:shopapp_product_changelist")
+        self.assertContains(response, "x" * 48 + "...")
+        selects = [sql for sql in queries if sql.startswith('SELECT "shopapp_product"')]
+        self.assertEqual(len(selects), 1)
+        self.assertNotIn(', "shopapp_product"."description"', selects[0])
+        self.assertEqual(len([sql for sql in queries if "COUNT" in sql]), 1)
+
+    def test_large_tables_are_not_counted(self):
+        with mock.patch("shopapp.pagination.EstimatedCountPaginator.estimate_threshold", 1):
+            response, queries = self.changelist_queries("admin:shopapp_product_changelist")
+            self.assertFalse([sql for sql in queries if "COUNT" in sql])
+            self.assertContains(response, "Product 0")
+            # Filtered lists are counted exactly
+            _, queries = self.changelist_queries("admin:shopapp_product_changelist", q="Product")
+            self.assertTrue([sql for sql in queries if "COUNT" in sql])
+
+    def test_orders_changelist_does_not_prefetch_products(self):
+        response, queries = self.changelist_queries("admin:shopapp_order_changelist")
+        self.assertContains(response, "Main st")
+        self.assertFalse([sql for sql in queries if "shopapp_order_products" in sql])
+
+
+class PaginatedInlinesTestCase(EnglishURLsMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(username="inlines", password="qwerty")
+        cls.laptop = Product.objects.create(name="Laptop")
+        cls.phone = Product.objects.create(name="Phone")
+        cls.orders = Order.objects.bulk_create(
+            Order(user=cls.admin, delivery_address=f"Street {number}") for number in range(45)
+        )
+        for order in cls.orders[:25]:
+            order.products.add(cls.laptop)
+        for order in cls.orders:
+            order.products.add(cls.phone)
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.client.force_login(self.admin)
+
+    def change_page(self, product: Product, **params):
+        url = reverse("admin:shopapp_product_change", kwargs={"object_id": product.pk})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_change_form_renders_a_page_of_orders(self):
+        self.change_page(self.laptop)
+        _, laptop_queries = self.change_page(self.laptop)
+        response, phone_queries = self.change_page(self.phone)
+        self.assertEqual(laptop_queries, phone_queries)
+        formset = response.context["inline_admin_formsets"][0].formset
+        self.assertEqual(len(formset.initial_forms), 20)
+        self.assertTrue(formset.has_next)
+        self.assertContains(response, f"?{formset.prefix}-page=2")
+        # The autocomplete widget renders selected orders only, not all of them
+        self.assertContains(response, "admin-autocomplete")
+
+        response, _ = self.change_page(self.phone, **{formset.page_param(): 3})
+        formset = response.context["inline_admin_formsets"][0].formset
+        self.assertEqual(len(formset.initial_forms), 5)
+        self.assertFalse(formset.has_next)
+
+    def test_page_links_keep_the_rest_of_the_query(self):
+        response, _ = self.change_page(self.phone)
+        page_param = response.context["inline_admin_formsets"][0].formset.page_param()
+        params = {"_changelist_filters": "archived__exact=0", "other-page": "4", page_param: "2"}
+        response, _ = self.change_page(self.phone, **params)
+        formset = response.context["inline_admin_formsets"][0].formset
+        self.assertEqual(dict(parse_qsl(formset.previous_query)), {**params, page_param: "1"})
+        self.assertEqual(dict(parse_qsl(formset.next_query)), {**params, page_param: "3"})
+        self.assertContains(response, f'href="?{escape(formset.next_query)}"')
+
+    def test_orders_autocomplete_by_pk_and_username_prefix(self):
+        url = reverse("admin:autocomplete")
+        params = {"app_label": "shopapp", "model_name": "order_products", "field_name": "order"}
+        response = self.client.get(url, {**params, "term": str(self.orders[3].pk)})
+        self.assertEqual([result["id"] for result in response.json()["results"]], [str(self.orders[3].pk)])
+        response = self.client.get(url, {**params, "term": "inl"})
+        self.assertEqual(len(response.json()["results"]), 20)
+        self.assertTrue(response.json()["pagination"]["more"])
+
+
+class ProductSuggestTestCase(EnglishURLsMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="picker", password="qwerty")
+        cls.laptop = Product.objects.create(name="Gaming Laptop")
+        cls.lamp = Product.objects.create(name="Lamp")
+        cls.archived = Product.objects.create(name="Laptop stand", archived=True)
+
+    def setUp(self) -> None:
+        super().setUp()
+        product_index.rebuild()
+
+    def test_index_matches_name_and_word_prefixes(self):
+        index = ProductNameIndex()
+        index.rebuild()
+        self.assertEqual(index.search("la"), [(self.lamp.pk, "Lamp"), (self.laptop.pk, "Gaming Laptop")])
+        self.assertEqual(index.search("gaming lap"), [(self.laptop.pk, "Gaming Laptop")])
+        self.assertEqual(index.search("aptop"), [])
+        index.apply(self.laptop.pk, "Office Laptop", archived=False)
+        index.apply(self.lamp.pk, "Lamp", archived=True)
+        self.assertEqual(index.search("la"), [(self.laptop.pk, "Office Laptop")])
+        self.assertEqual(index.search("gaming"), [])
+
+    def test_suggestions_do_not_query_the_database(self):
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("shopapp:products_suggest"), {"q": "LAP"})
+        self.assertEqual(response.json(), {"results": [{"id": self.laptop.pk, "name": "Gaming Laptop"}]})
+
+    def test_deletes_of_other_processes_are_synced(self):
+        index = ProductNameIndex()
+        index.rebuild()
+        # The signal only updates product_index, the other index learns from the tombstone
+        Product.objects.filter(pk=self.lamp.pk).delete()
+        self.assertEqual(index.search("lamp"), [(self.lamp.pk, "Lamp")])
+        index.sync()
+        self.assertEqual(index.search("lamp"), [])
+
+    def test_index_is_rebuilt_outside_the_request(self):
+        index = ProductNameIndex()
+        with mock.patch.object(index, "start_rebuild") as start_rebuild:
+            self.assertEqual(index.search("gam"), [(self.laptop.pk, "Gaming Laptop")])
+            # Words inside names wait for the index
+            self.assertEqual(index.search("lap"), [])
+        start_rebuild.assert_called_once()
+        self.assertFalse(index.is_built())
+
+        index = ProductNameIndex()
+        index.rebuild()
+        index._built -= index.rebuild_interval + 1
+        with mock.patch.object(index, "start_rebuild") as start_rebuild, self.assertNumQueries(0):
+            self.assertEqual(index.search("lamp"), [(self.lamp.pk, "Lamp")])
+        start_rebuild.assert_called_once()
+
+    def test_saved_products_are_suggested_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(name="Laptop bag")
+        self.assertIn((product.pk, "Laptop bag"), product_index.search("lap"))
+
+    def create_order(self, products):
+        data = {"delivery_address": "Main st", "user": self.user.pk, "products": [product.pk for product in products]}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse("shopapp:order_create"), data)
+        return response, len(queries)
+
+    def test_order_form_validates_products_with_one_query(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("shopapp:order_create"))
+        self.assertNotContains(response, "Gaming Laptop")
+
+        response, small_catalog = self.create_order([self.laptop, self.lamp])
+        self.assertRedirects(response, reverse("shopapp:orders_list"), fetch_redirect_response=False)
+        order = Order.objects.latest("pk")
+        self.assertEqual(set(order.products.all()), {self.laptop, self.lamp})
+
+        Product.objects.bulk_create(Product(name=f"Product {number}") for number in range(200))
+        _, large_catalog = self.create_order([self.laptop, self.lamp])
+        self.assertEqual(small_catalog, large_catalog)
+
+        response, _ = self.create_order([self.laptop, self.archived])
+        self.assertEqual(response.status_code, 200)
+        self.assertFormError(
+            response.context["form"],
+            "products",
+            f"Select a valid choice. {self.archived.pk} is not one of the available choices.",
+        )
+
+    def test_orders_are_created_only_for_yourself_without_permission(self):
+        response = self.client.get(reverse("shopapp:order_create"))
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(str(settings.LOGIN_URL), response["Location"])
+
+        other = User.objects.create_user(username="other", password="qwerty")
+        self.client.force_login(other)
+        response, _ = self.create_order([self.laptop])
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("user", response.context["form"].errors)
+        self.assertFalse(Order.objects.exists())
+
+        other.user_permissions.add(Permission.objects.get(codename="add_order"))
+        response, _ = self.create_order([self.laptop])
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Order.objects.get().user, self.user)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class ProductFacetsTestCase(EnglishURLsMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Product.objects.create(name="Cable", price=Decimal("10"))
+        Product.objects.create(name="Chair", price=Decimal("75"), discount=15)
+        Product.objects.create(name="Laptop", price=Decimal("600"), discount=60)
+        Product.objects.create(name="Old phone", price=Decimal("80"), archived=True)
+
+    def setUp(self) -> None:
+        super().setUp()
+        cache.clear()
+
+    def get(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("shopapp:product-list"), params)
+        self.assertEqual(response.status_code, 200)
+        facet_queries = [query for query in queries if '"price:0-50"' in query["sql"]]
+        return response.json(), len(facet_queries)
+
+    def names(self, **params):
+        return [product["name"] for product in self.get(**params)[0]["results"]]
+
+    def test_range_and_bucket_filters(self):
+        self.assertEqual(self.names(price_min=50, archived=False), ["Chair", "Laptop"])
+        self.assertEqual(self.names(price_bucket="50-100"), ["Chair", "Old phone"])
+        self.assertEqual(self.names(on_sale=True), ["Chair", "Laptop"])
+        self.assertEqual(self.names(discount_bucket="50+"), ["Laptop"])
+        self.assertEqual(self.names(created_bucket="day", price_max=10), ["Cable"])
+        self.assertEqual(self.names(created_bucket="older"), [])
+
+    def test_facets_are_counted_once_per_filter_signature(self):
+        data, facet_queries = self.get(archived=False)
+        self.assertEqual(facet_queries, 1)
+        self.assertEqual(data["facets"]["price"], {"0-50": 1, "50-100": 1, "100-500": 0, "500-1000": 1, "1000+": 0})
+        self.assertEqual(data["facets"]["discount"]["0"], 1)
+        self.assertEqual(data["facets"]["created"]["day"], 3)
+        self.assertEqual(data["facets"]["archived"], {"active": 3, "archived": 0})
+
+        # Another page of the same result set reuses the counts
+        _, facet_queries = self.get(archived=False, page_size=1)
+        self.assertEqual(facet_queries, 0)
+        # and so do the same results with another set of fields
+        _, facet_queries = self.get(archived=False, fields="pk,name")
+        self.assertEqual(facet_queries, 0)
+        _, facet_queries = self.get(archived=False, omit="description")
+        self.assertEqual(facet_queries, 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name="Desk", price=Decimal("120"))
+        data, facet_queries = self.get(archived=False, page_size=1)
+        self.assertEqual(facet_queries, 1)
+        self.assertEqual(data["facets"]["price"]["100-500"], 1)
+
+
+class SparseFieldsetsTestCase(EnglishURLsMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="sparse", password="qwerty")
+        cls.laptop = Product.objects.create(name="Laptop", description="x" * 1000, price=Decimal("999.90"))
+        cls.phone = Product.objects.create(name="Phone", price=Decimal("500"))
+        for number in range(3):
+            order = Order.objects.create(user=cls.user, delivery_address=f"Street {number}")
+            order.products.add(cls.laptop, cls.phone)
+
+    def get(self, url_name, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(url_name), params)
+        return response, [query["sql"] for query in queries]
+
+    def test_products_select_only_requested_columns(self):
+        response, queries = self.get("shopapp:product-list", fields="pk,name,price", ordering="-price")
+        self.assertEqual(response.json()["results"][0], {"pk": self.laptop.pk, "name": "Laptop", "price": "999.90"})
+        page_query = [sql for sql in queries if 'FROM "shopapp_product"' in sql and "LIMIT" in sql][0]
+        self.assertNotIn('"shopapp_product"."description"', page_query)
+
+        response, _ = self.get("shopapp:product-list", omit="description,preview")
+        self.assertNotIn("description", response.json()["results"][0])
+        self.assertIn("created_at", response.json()["results"][0])
+
+    def test_orders_prefetch_products_only_when_serialized(self):
+        response, queries = self.get("shopapp:order-list")
+        self.assertEqual(response.json()["results"][0]["products"], [self.laptop.pk, self.phone.pk])
+        self.assertEqual(len([sql for sql in queries if "shopapp_order_products" in sql]), 1)
+
+        response, queries = self.get("shopapp:order-list", fields="delivery_address,user")
+        self.assertEqual(response.json()["results"][0], {"delivery_address": "Street 0", "user": self.user.pk})
+        self.assertFalse([sql for sql in queries if "shopapp_order_products" in sql])
+
+    def test_unknown_fields_are_rejected(self):
+        response, _ = self.get("shopapp:product-list", fields="pk,secret")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("secret", response.json()["fields"][0])
+
+
+class ExpandTestCase(EnglishURLsMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="expand", password="qwerty", first_name="Ann")
+        cls.staff = User.objects.create_user(username="staff", password="qwerty", is_staff=True)
+        cls.laptop = Product.objects.create(name="Laptop", price=Decimal("999.90"))
+        cls.phone = Product.objects.create(name="Phone", price=Decimal("500"))
+
+    def create_orders(self, count):
+        for number in range(count):
+            order = Order.objects.create(user=self.user, delivery_address=f"Street {number}")
+            order.products.add(self.laptop, self.phone)
+
+    def get_orders(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("shopapp:order-list"), {"page_size": 50, **params})
+        return response, len(queries)
+
+    def test_expanded_orders_cost_fixed_number_of_queries(self):
+        self.client.force_login(self.staff)
+        self.create_orders(2)
+        response, few = self.get_orders(expand="products,user")
+        order = response.json()["results"][0]
+        self.assertEqual(order["user"], {"pk": self.user.pk, "username": "expand", "first_name": "Ann", "last_name": ""})
+        self.assertEqual([product["name"] for product in order["products"]], ["Laptop", "Phone"])
+
+        self.create_orders(20)
+        response, many = self.get_orders(expand="products,user")
+        self.assertEqual(len(response.json()["results"]), 22)
+        self.assertEqual(few, many)
+
+    def test_expand_respects_sparse_fields(self):
+        self.client.force_login(self.staff)
+        self.create_orders(1)
+        response, _ = self.get_orders(expand="products,user", fields="user,delivery_address")
+        self.assertEqual(response.json()["results"][0], {
+            "delivery_address": "Street 0",
+            "user": {"pk": self.user.pk, "username": "expand", "first_name": "Ann", "last_name": ""},
+        })
+
+    def test_only_staff_expands_customers(self):
+        self.create_orders(1)
+        response, _ = self.get_orders(expand="user")
+        self.assertEqual(response.status_code, 403)
+        self.client.force_login(self.user)
+        response, _ = self.get_orders(expand="user")
+        self.assertEqual(response.status_code, 403)
+        response, _ = self.get_orders(expand="products")
+        self.assertEqual(response.json()["results"][0]["products"][0]["name"], "Laptop")
+
+    def test_unknown_expansion_is_rejected(self):
+        response, _ = self.get_orders(expand="products.orders")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("products.orders", response.json()["expand"][0])
+
+
+class FastJSONListTestCase(EnglishURLsMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="fast", password="qwerty")
+        names = ["Laptop", "Phone \u2028 line", "Чайник \"Classic\"", "Tab\tlet", "Mouse"]
+        products = [
+            Product.objects.create(
+                name=name,
+                description="é" * number,
+                price=Decimal(number * 250) / 3,
+                discount=number * 7,
+                archived=number == 3,
+                preview=f"products/product_{number}/preview/image.png" if number % 2 else "",
+            )
+            for number, name in enumerate(names)
+        ]
+        for number in range(4):
+            order = Order.objects.create(
+                user=cls.user,
+                delivery_address=None if number == 2 else f"Street {number}",
+                promocode="SALE" * number,
+                total=Decimal("10.5") * number,
+            )
+            order.products.set(products[number:])
+
+    def assertSameAsSerializer(self, url_name, **params):
+        url = reverse(url_name)
+        fast = self.client.get(url, params)
+        self.assertNotIsInstance(fast, Response)
+        with mock.patch.object(FastJSONListMixin, "fast_json", False):
+            regular = self.client.get(url, params)
+        self.assertIsInstance(regular, Response)
+        self.assertEqual(fast.status_code, regular.status_code)
+        self.assertEqual(fast["Content-Type"], regular["Content-Type"])
+        self.assertEqual(fast.content, regular.content)
+        return fast.json()
+
+    def test_products_output_parity(self):
+        data = self.assertSameAsSerializer("shopapp:product-list")
+        self.assertIn("http://testserver/media/products/product_1/preview/image.png", [item["preview"] for item in data["results"]])
+        data = self.assertSameAsSerializer("shopapp:product-list", ordering="-price", page_size=2)
+        self.assertSameAsSerializer("shopapp:product-list", **dict(parse_qsl(urlsplit(data["next"]).query)))
+        self.assertSameAsSerializer("shopapp:product-list", fields="pk,price,preview", discount_min=7)
+
+    def test_orders_output_parity(self):
+        self.assertSameAsSerializer("shopapp:order-list")
+        self.assertSameAsSerializer("shopapp:order-list", ordering="-total", page_size=3)
+        self.assertSameAsSerializer("shopapp:order-list", omit="products")
+
+    def test_regular_path_for_expand_and_browsable_api(self):
+        response = self.client.get(reverse("shopapp:order-list"), {"expand": "products"})
+        self.assertIsInstance(response, Response)
+        response = self.client.get(reverse("shopapp:product-list"), HTTP_ACCEPT="text/html")
+        self.assertIsInstance(response, Response)
+
+
+def make_image(name, size, fmt="PNG") -> SimpleUploadedFile:
+    content = BytesIO()
+    Image.new("RGBA" if fmt == "PNG" else "RGB", size, "red").save(content, fmt)
+    return SimpleUploadedFile(name, content.getvalue())
+
+
+@override_settings(IMAGE_VARIANT_WORKERS=0, IMAGE_VARIANT_WIDTHS=(50, 100, 400))
+class ImageVariantsTestCase(EnglishURLsMixin, TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media = override_settings(MEDIA_ROOT=media_root.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.media_root = media_root.name
+
+    def test_variants_are_rendered_beside_the_original(self):
+        product = Product.objects.create(name="Laptop")
+        with self.captureOnCommitCallbacks(execute=True):
+            image = ProductImage.objects.create(product=product, image=make_image("photo.png", (200, 100)))
+        variants = ImageVariant.objects.filter(source=image.image.name).order_by("width", "format")
+        # 400 is wider than the original, so it collapses into 200
+        self.assertEqual(
+            [(variant.width, variant.height, variant.format) for variant in variants],
+            [(50, 25, "jpeg"), (50, 25, "webp"), (100, 50, "jpeg"), (100, 50, "webp"), (200, 100, "jpeg"), (200, 100, "webp")],
+        )
+        self.assertEqual(
+            variants[0].file.name,
+            f"products/product_{product.pk}/images/variants/photo-50w.jpg",
+        )
+        self.assertTrue(os.path.exists(variants[0].file.path))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+        self.assertFalse(ImageVariant.objects.exists())
+        self.assertFalse(os.path.exists(variants[0].file.path))
+
+    def test_same_picture_is_rendered_once(self):
+        product = Product.objects.create(name="Laptop")
+        picture = make_image("photo.png", (200, 100))
+        with mock.patch("shopapp.images.render_variants", wraps=render_variants) as render:
+            for _ in range(3):
+                picture.seek(0)
+                with self.captureOnCommitCallbacks(execute=True):
+                    ProductImage.objects.create(product=product, image=picture)
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(ImageVariant.objects.values("source").distinct().count(), 3)
+
+    def test_failed_rendering_keeps_the_saved_image(self):
+        product = Product.objects.create(name="Laptop")
+        with mock.patch("shopapp.images.default_storage.open", side_effect=OSError("Storage is down")), \
+                self.assertLogs("shopapp.images", "ERROR"), \
+                self.captureOnCommitCallbacks(execute=True):
+            image = ProductImage.objects.create(product=product, image=make_image("photo.png", (200, 100)))
+        self.assertTrue(ProductImage.objects.filter(pk=image.pk).exists())
+        self.assertFalse(ImageVariant.objects.exists())
+
+    def test_listing_uses_srcset_with_one_variants_query(self):
+        for number in range(3):
+            with self.captureOnCommitCallbacks(execute=True):
+                Product.objects.create(name=f"Product {number}", preview=make_image(f"p{number}.jpg", (800, 600), "JPEG"))
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("shopapp:products_list"))
+        self.assertContains(response, '<source type="image/webp" srcset="', count=3)
+        self.assertContains(response, "p0-50w.jpg 50w, ")
+        self.assertNotContains(response, 'src="/media/products/product_None/preview/p0.jpg"')
+
+
+@override_settings(IMAGE_VARIANT_WORKERS=0, IMAGE_VARIANT_WIDTHS=(50,))
+class BulkImageUploadTestCase(EnglishURLsMixin, TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media = override_settings(MEDIA_ROOT=media_root.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.product = Product.objects.create(name="Laptop", price=10)
+
+    def files(self):
+        return [
+            SimpleUploadedFile("broken.jpg", b"not an image"),
+            *(make_image(f"photo{number}.jpg", (120, 80), "JPEG") for number in range(3)),
+        ]
+
+    def test_api_uploads_valid_files_with_one_insert(self):
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse("shopapp:product-upload-images", kwargs={"pk": self.product.pk}),
+                {"images": self.files(), "description": "Gallery"},
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()["uploaded"]), 3)
+        self.assertEqual([error["file"] for error in response.json()["errors"]], ["broken.jpg"])
+        inserts = [query for query in queries if query["sql"].startswith('INSERT INTO "shopapp_productimage"')]
+        self.assertEqual(len(inserts), 1)
+        images = ProductImage.objects.filter(product=self.product)
+        self.assertEqual(images.count(), 3)
+        self.assertTrue(all(image.description == "Gallery" for image in images))
+        self.assertEqual(ImageVariant.objects.filter(source__in=[image.image.name for image in images]).count(), 6)
+
+    def test_no_files_write_nothing(self):
+        with self.assertNumQueries(0), self.captureOnCommitCallbacks() as callbacks:
+            result = save_product_images(self.product, [])
+        self.assertEqual(result.as_dict(), {"uploaded": [], "errors": []})
+        self.assertEqual(callbacks, [])
+
+    def test_update_view_reports_broken_files(self):
+        response = self.client.post(
+            reverse("shopapp:product_update", kwargs={"pk": self.product.pk}),
+            {"name": "Laptop", "price": 10, "discount": 0, "description": "", "images": self.files()},
+            follow=True,
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(ProductImage.objects.filter(product=self.product).count(), 3)
+        self.assertContains(response, "broken.jpg: Not a valid image")
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class GetOrRecomputeTestCase(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return self.calls
+
+    def test_fresh_value_is_served_from_cache(self):
+        self.assertEqual(get_or_recompute("swr-test", self.compute, timeout=60), 1)
+        self.assertEqual(get_or_recompute("swr-test", self.compute, timeout=60), 1)
+        self.assertEqual(self.calls, 1)
+
+    def test_stale_value_is_served_while_another_worker_recomputes(self):
+        get_or_recompute("swr-test", self.compute, timeout=0, stale_timeout=60)
+        cache.add("swr-test:lock", 1, 30)
+        self.assertEqual(get_or_recompute("swr-test", self.compute, timeout=0, stale_timeout=60), 1)
+        self.assertEqual(self.calls, 1)
+        cache.delete("swr-test:lock")
+        self.assertEqual(get_or_recompute("swr-test", self.compute, timeout=0, stale_timeout=60), 2)
+
+    def test_other_generation_is_never_served(self):
+        get_or_recompute("swr-test", self.compute, timeout=60, generation=1)
+        cache.add("swr-test:lock", 1, 30)
+
+        def other_worker_finishes(seconds):
+            cache.set("swr-test", ("computed elsewhere", time.time() + 60, 0.1, 2), 600)
+
+        with mock.patch("shopapp.cache.time.sleep", side_effect=other_worker_finishes):
+            self.assertEqual(get_or_recompute("swr-test", self.compute, generation=2), "computed elsewhere")
+        # The lock holder died: the old generation is not served, it is recomputed
+        cache.set("swr-test", (1, time.time() + 60, 0.1, 1), 600)
+        self.assertEqual(get_or_recompute("swr-test", self.compute, generation=2, wait_timeout=0), 2)
+        cache.delete("swr-test:lock")
+        self.assertEqual(get_or_recompute("swr-test", self.compute, timeout=60, generation=2), 2)
+        self.assertEqual(self.calls, 2)
+
+    def test_miss_waits_for_the_worker_holding_the_lock(self):
+        cache.add("swr-test:lock", 1, 30)
+
+        def other_worker_finishes(seconds):
+            cache.set("swr-test", ("computed elsewhere", time.time() + 60, 0.1, 1), 600)
+
+        with mock.patch("shopapp.cache.time.sleep", side_effect=other_worker_finishes):
+            self.assertEqual(get_or_recompute("swr-test", self.compute, generation=1), "computed elsewhere")
+        self.assertEqual(self.calls, 0)
+        # The lock holder died: compute after waiting
+        cache.delete("swr-test")
+        self.assertEqual(get_or_recompute("swr-test", self.compute, generation=1, wait_timeout=0), 1)
+
+
+class DeduplicatingStorageTestCase(SimpleTestCase):
+    def setUp(self) -> None:
+        location = tempfile.TemporaryDirectory()
+        self.addCleanup(location.cleanup)
+        self.storage = DeduplicatingFileSystemStorage(location=location.name)
+
+    def test_identical_uploads_share_one_blob(self):
+        content = os.urandom(200_000)
+        first = self.storage.save("products/product_1/images/photo.jpg", ContentFile(content))
+        second = self.storage.save("products/product_2/preview/photo.jpg", ContentFile(content))
+        other = self.storage.save("orders/receipts/receipt.pdf", ContentFile(b"receipt"))
+        self.assertTrue(os.path.samefile(self.storage.path(first), self.storage.path(second)))
+        self.assertEqual(self.storage.references(first), 2)
+        self.assertEqual(self.storage.references(other), 1)
+        with self.storage.open(second) as file:
+            self.assertEqual(file.read(), content)
+
+        blob = self.storage.blob_path(self.storage.digest(first))
+        self.storage.delete(first)
+        self.assertTrue(os.path.exists(blob))
+        self.assertEqual(self.storage.references(second), 1)
+        self.storage.delete(second)
+        self.assertFalse(os.path.exists(blob))
+        self.assertEqual(self.storage.collect_blobs(), 0)
+
+    def test_taken_names_get_a_suffix_and_orphans_are_collected(self):
+        first = self.storage.save("avatars/me.png", ContentFile(b"one"))
+        second = self.storage.save("avatars/me.png", ContentFile(b"two"))
+        self.assertNotEqual(first, second)
+        os.remove(self.storage.path(first))
+        self.assertEqual(self.storage.collect_blobs(), 1)
+        with self.storage.open(second) as file:
+            self.assertEqual(file.read(), b"two")
+
+
+class MmapCacheTestCase(SimpleTestCase):
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "cache.mmap")
+        self.cache = self.make_cache()
+
+    def make_cache(self, **options):
+        options = {"SLOTS": 64, "SLOT_SIZE": 512, **options}
+        return MmapCache(self.path, {"OPTIONS": options, "TIMEOUT": 60})
+
+    def test_basic_contract(self):
+        cache = self.cache
+        self.assertIsNone(cache.get("missing"))
+        self.assertEqual(cache.get("missing", "default"), "default")
+        cache.set("key", {"value": [1, Decimal("2.50")]})
+        self.assertEqual(cache.get("key"), {"value": [1, Decimal("2.50")]})
+        self.assertTrue(cache.has_key("key"))
+        self.assertFalse(cache.add("key", "other"))
+        self.assertTrue(cache.add("new", "value"))
+        self.assertTrue(cache.delete("key"))
+        self.assertFalse(cache.delete("key"))
+        self.assertIsNone(cache.get("key"))
+        cache.set("ключ", "значение")
+        self.assertEqual(cache.get("ключ"), "значение")
+        cache.set("falsy", None)
+        self.assertTrue(cache.has_key("falsy"))
+
+    def test_many_versions_and_counters(self):
+        cache = self.cache
+        cache.set_many({"a": 1, "b": 2})
+        self.assertEqual(cache.get_many(["a", "b", "c"]), {"a": 1, "b": 2})
+        cache.delete_many(["a"])
+        self.assertEqual(cache.get_many(["a", "b"]), {"b": 2})
+        cache.set("versioned", "v1", version=1)
+        cache.set("versioned", "v2", version=2)
+        self.assertEqual(cache.get("versioned", version=1), "v1")
+        self.assertEqual(cache.get("versioned", version=2), "v2")
+        self.assertEqual(cache.incr("b", 10), 12)
+        self.assertEqual(cache.decr("b"), 11)
+        with self.assertRaises(ValueError):
+            cache.incr("missing")
+        self.assertEqual(cache.get_or_set("lazy", lambda: "computed"), "computed")
+        cache.clear()
+        self.assertIsNone(cache.get("b"))
+
+    def test_expiry_and_touch(self):
+        cache = self.cache
+        cache.set("expired", "value", timeout=0)
+        self.assertIsNone(cache.get("expired"))
+        cache.set("forever", "value", timeout=None)
+        self.assertTrue(cache.touch("forever", timeout=0))
+        self.assertIsNone(cache.get("forever"))
+        self.assertFalse(cache.touch("missing"))
+        with mock.patch("time.time", return_value=time.time() + 61):
+            cache.set("soon", "value")
+        self.assertEqual(cache.get("soon"), "value")
+        cache.set("short", "value", timeout=1)
+        with mock.patch("shopapp.cache_backends.time.time", return_value=time.time() + 2):
+            self.assertIsNone(cache.get("short"))
+
+    def test_too_large_values_and_eviction(self):
+        cache = self.make_cache(SLOTS=4, PROBE=4)
+        with self.assertLogs("shopapp.cache_backends", "WARNING"):
+            cache.set("big", "x" * 1024)
+        self.assertIsNone(cache.get("big"))
+        for number in range(10):
+            cache.set(f"key{number}", number)
+        cached = [number for number in range(10) if cache.get(f"key{number}") is not None]
+        self.assertEqual(len(cached), 4)
+        self.assertIn(9, cached)
+
+    @override_settings(CACHES={"overflow": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_large_values_spill_to_fallback(self):
+        cache = self.make_cache(FALLBACK="overflow")
+        cache.set("big", "x" * 1024)
+        self.assertEqual(cache.get("big"), "x" * 1024)
+        self.assertTrue(cache.touch("big", timeout=120))
+        self.assertEqual(cache.get("big"), "x" * 1024)
+        cache.delete("big")
+        self.assertIsNone(cache.get("big"))
+
+    def test_slot_of_dead_writer_is_reclaimed(self):
+        cache = self.cache
+        cache.set("key", "value")
+        index = cache._find(cache.make_key("key"))[0]
+        offset = cache._offset(index)
+        # A writer died between making the sequence odd and finishing the slot
+        SEQ.pack_into(cache._map, offset, SEQ.unpack_from(cache._map, offset)[0] + 1)
+        self.assertIsNone(cache.get("key"))
+        cache.set("key", "new value")
+        self.assertEqual(cache.get("key"), "new value")
+        SEQ.pack_into(cache._map, offset, SEQ.unpack_from(cache._map, offset)[0] + 1)
+        cache.clear()
+        cache.set("key", "after clear")
+        self.assertEqual(cache.get("key"), "after clear")
+
+    def test_new_layout_does_not_resize_mapped_file(self):
+        self.cache.set("key", "value")
+        other = self.make_cache(SLOTS=32)
+        other.set("key", "other layout")
+        self.assertNotEqual(other.path, self.cache.path)
+        self.assertEqual(self.cache.get("key"), "value")
+        self.assertEqual(other.get("key"), "other layout")
+
+    def test_shared_between_processes(self):
+        self.cache.set("parent", "from parent")
+        context = multiprocessing.get_context("fork")
+        process = context.Process(target=_mmap_cache_child, args=(self.path,))
+        process.start()
+        process.join(10)
+        self.assertEqual(process.exitcode, 0)
+        self.assertEqual(self.cache.get("child"), "from parent and child")
+
+
+class Unpicklable:
+    def __getstate__(self):
+        raise pickle.PickleError()
+
+
+class MmapCacheContractTestCase(SimpleTestCase):
+    """
+    Cases of Django's BaseCacheTests (tests/cache/tests.py, not shipped with
+    Django) that apply to MmapCache. Left out: memcached and database specific
+    cases, custom key functions and the cache middleware.
+    """
+
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.location = os.path.join(directory.name, "cache.mmap")
+        self.cache = self.make_cache()
+
+    def make_cache(self, **params):
+        options = {"SLOTS": 256, "SLOT_SIZE": 1024, **params.pop("OPTIONS", {})}
+        return MmapCache(self.location, {"OPTIONS": options, **params})
+
+    def later(self, seconds):
+        return mock.patch("time.time", return_value=time.time() + seconds)
+
+    def test_simple(self):
+        cache = self.cache
+        cache.set("key", "value")
+        self.assertEqual(cache.get("key"), "value")
+        self.assertIsNone(cache.get("does_not_exist"))
+        self.assertEqual(cache.get("does_not_exist", "bang!"), "bang!")
+        cache.set("key_default_none", None)
+        self.assertIsNone(cache.get("key_default_none", default="default"))
+
+    def test_add(self):
+        cache = self.cache
+        self.assertIs(cache.add("addkey1", "value"), True)
+        self.assertIs(cache.add("addkey1", "newvalue"), False)
+        self.assertEqual(cache.get("addkey1"), "value")
+
+    def test_prefix(self):
+        prefixed = self.make_cache(KEY_PREFIX="cacheprefix")
+        self.cache.set("somekey", "value")
+        self.assertIs(prefixed.has_key("somekey"), False)
+        prefixed.set("somekey", "other")
+        self.assertEqual(self.cache.get("somekey"), "value")
+        self.assertEqual(prefixed.get("somekey"), "other")
+
+    def test_get_set_delete_many(self):
+        cache = self.cache
+        self.assertEqual(cache.set_many({"a": "a", "b": "b", "c": "c", "d": "d"}), [])
+        self.assertEqual(cache.get_many(["a", "c", "d"]), {"a": "a", "c": "c", "d": "d"})
+        self.assertEqual(cache.get_many(iter(["a", "b", "e"])), {"a": "a", "b": "b"})
+        self.assertIsNone(cache.delete_many(["a", "b"]))
+        self.assertIsNone(cache.delete_many([]))
+        self.assertEqual(cache.get_many(["a", "b", "c"]), {"c": "c"})
+
+    def test_set_many_returns_values_that_do_not_fit(self):
+        with self.assertLogs("shopapp.cache_backends", "WARNING"):
+            failed = self.cache.set_many({"small": "x", "big": "x" * 2048})
+        self.assertEqual(failed, ["big"])
+        self.assertEqual(self.cache.get_many(["small", "big"]), {"small": "x"})
+
+    def test_delete_and_has_key(self):
+        cache = self.cache
+        cache.set("key1", "spam")
+        self.assertIs(cache.delete("key1"), True)
+        self.assertIs(cache.delete("key1"), False)
+        self.assertIs(cache.has_key("key1"), False)
+        cache.set("null", None)
+        self.assertIs(cache.has_key("null"), True)
+        self.assertIn("null", cache)
+        self.assertIs(cache.add("null", "value"), False)
+
+    def test_incr_decr(self):
+        cache = self.cache
+        cache.set("answer", 41)
+        self.assertEqual(cache.incr("answer"), 42)
+        self.assertEqual(cache.incr("answer", 10), 52)
+        self.assertEqual(cache.incr("answer", -10), 42)
+        self.assertEqual(cache.decr("answer", -10), 52)
+        self.assertEqual(cache.decr("answer"), 51)
+        with self.assertRaises(ValueError):
+            cache.incr("does_not_exist")
+        with self.assertRaises(ValueError):
+            cache.decr("does_not_exist", -1)
+        cache.set("null", None)
+        with self.assertRaises(TypeError):
+            cache.incr("null")
+        cache.set("text", "value")
+        with self.assertRaises(TypeError):
+            cache.incr("text")
+        self.assertEqual(cache.get("text"), "value")
+
+    def test_incr_keeps_expiry(self):
+        cache = self.cache
+        cache.set("counter", 1, 10)
+        cache.incr("counter")
+        with self.later(11):
+            self.assertIsNone(cache.get("counter"))
+
+    def test_data_types(self):
+        data = {
+            "string": "this is a string",
+            "int": 42,
+            "bool": True,
+            "list": [1, 2, 3, 4],
+            "tuple": (1, 2, 3, 4),
+            "dict": {"A": 1, "B": 2},
+            "float": 1.5,
+            "decimal": Decimal("9.99"),
+            "bytes": b"\x00\xff" * 20,
+            "unicode": "Ä ä Ö ö Ü ü ß 清",
+            "model": Product(name="Laptop", price=Decimal("10")),
+        }
+        self.cache.set("data", data)
+        cached = self.cache.get("data")
+        self.assertEqual(cached.pop("model").name, "Laptop")
+        data.pop("model")
+        self.assertEqual(cached, data)
+
+    def test_expiration(self):
+        cache = self.cache
+        cache.set("expire1", "very quickly", 1)
+        cache.set("expire2", "very quickly", 1)
+        cache.set("expire3", "very quickly", 1)
+        with self.later(2):
+            self.assertIsNone(cache.get("expire1"))
+            self.assertIs(cache.add("expire2", "newvalue"), True)
+            self.assertEqual(cache.get("expire2"), "newvalue")
+            self.assertIs(cache.has_key("expire3"), False)
+            self.assertIs(cache.touch("expire3"), False)
+            self.assertIs(cache.delete("expire3"), False)
+
+    def test_touch(self):
+        cache = self.cache
+        cache.set("expire1", "very quickly", timeout=1)
+        self.assertIs(cache.touch("expire1", timeout=4), True)
+        with self.later(2):
+            self.assertIs(cache.has_key("expire1"), True)
+        with self.later(5):
+            self.assertIs(cache.has_key("expire1"), False)
+        cache.set("expire1", "very quickly", timeout=1)
+        self.assertIs(cache.touch("expire1"), True)
+        with self.later(2):
+            self.assertIs(cache.has_key("expire1"), True)
+        self.assertIs(cache.touch("nonexistent"), False)
+
+    def test_timeouts(self):
+        cache = self.cache
+        cache.set("key1", "eggs", 60 * 60 * 24 * 30 + 1)
+        self.assertEqual(cache.get("key1"), "eggs")
+        cache.set("forever", "ham", None)
+        self.assertIs(cache.add("forever", "spam", None), False)
+        self.assertIs(cache.touch("forever", None), True)
+        with self.later(60 * 60 * 24 * 365):
+            self.assertEqual(cache.get("forever"), "ham")
+        cache.set("float", "spam", 1.5)
+        self.assertEqual(cache.get("float"), "spam")
+
+    def test_zero_timeout(self):
+        cache = self.cache
+        cache.set("key1", "eggs", 0)
+        self.assertIsNone(cache.get("key1"))
+        self.assertIs(cache.add("key2", "ham", 0), True)
+        self.assertIsNone(cache.get("key2"))
+        self.assertEqual(cache.set_many({"key3": "ham", "key4": "spam"}, 0), [])
+        self.assertEqual(cache.get_many(["key3", "key4"]), {})
+        cache.set("key5", "belgian fries", timeout=1)
+        self.assertIs(cache.touch("key5", timeout=0), True)
+        self.assertIsNone(cache.get("key5"))
+
+    def test_versioning(self):
+        cache = self.cache
+        other = self.make_cache(VERSION=2)
+        cache.set("answer", 42)
+        self.assertEqual(cache.get("answer", version=1), 42)
+        self.assertIsNone(cache.get("answer", version=2))
+        self.assertIsNone(other.get("answer"))
+        self.assertEqual(other.get("answer", version=1), 42)
+        self.assertIs(cache.add("answer", 37, version=2), True)
+        self.assertIs(cache.has_key("answer", version=2), True)
+        self.assertEqual(cache.incr("answer", version=2), 38)
+        self.assertEqual(cache.get_many(["answer"], version=2), {"answer": 38})
+        cache.delete("answer", version=2)
+        self.assertEqual(cache.get("answer"), 42)
+        self.assertIsNone(cache.get("answer", version=2))
+
+    def test_incr_decr_version(self):
+        cache = self.cache
+        cache.set("answer", 42, version=2)
+        self.assertEqual(cache.incr_version("answer", version=2), 3)
+        self.assertIsNone(cache.get("answer", version=2))
+        self.assertEqual(cache.get("answer", version=3), 42)
+        self.assertEqual(cache.decr_version("answer", version=3), 2)
+        self.assertEqual(cache.get("answer", version=2), 42)
+        with self.assertRaises(ValueError):
+            cache.incr_version("does_not_exist")
+
+    def test_invalid_keys_warn(self):
+        cache = self.cache
+        for key in ["key with spaces and 清", "a" * 251]:
+            with self.subTest(key=key[:20]):
+                for operation in [
+                    lambda: cache.get(key),
+                    lambda: cache.set(key, 1),
+                    lambda: cache.add(key, 1),
+                    lambda: cache.touch(key),
+                    lambda: cache.incr(key),
+                    lambda: cache.delete(key),
+                    lambda: cache.has_key(key),
+                    lambda: cache.get_many([key]),
+                    lambda: cache.set_many({key: 1}),
+                    lambda: cache.delete_many([key]),
+                    lambda: cache.get_or_set(key, 1),
+                ]:
+                    with self.assertWarns(CacheKeyWarning):
+                        try:
+                            operation()
+                        except ValueError:
+                            pass
+
+    def test_get_or_set(self):
+        cache = self.cache
+        self.assertEqual(cache.get_or_set("projector", 42), 42)
+        self.assertEqual(cache.get("projector"), 42)
+        self.assertIsNone(cache.get_or_set("null", None))
+        self.assertIs(cache.has_key("null"), True)
+        self.assertEqual(cache.get_or_set("callable", lambda: "value"), "value")
+        self.assertEqual(cache.get_or_set("brian", 1979, version=2), 1979)
+        self.assertIsNone(cache.get("brian", version=1))
+        with mock.patch.object(cache, "add", return_value=False):
+            self.assertEqual(cache.get_or_set("racing", "value"), "value")
+
+    def test_unpicklable_values_raise(self):
+        cache = self.cache
+        with self.assertRaises(pickle.PickleError):
+            cache.set("unpicklable", Unpicklable())
+        with self.assertRaises(pickle.PickleError):
+            cache.add("unpicklable", Unpicklable())
+        self.assertIs(cache.has_key("unpicklable"), False)
+
+    def test_clear(self):
+        cache = self.cache
+        cache.set("key1", "spam")
+        cache.set("key2", "eggs")
+        cache.clear()
+        self.assertIsNone(cache.get("key1"))
+        self.assertIsNone(cache.get("key2"))
+
+    @override_settings(CACHES={"overflow": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_clear_keeps_other_entries_of_the_fallback(self):
+        cache = self.make_cache(OPTIONS={"FALLBACK": "overflow"})
+        caches["overflow"].set("foreign", "kept")
+        cache.set("big", "x" * 2048)
+        cache.clear()
+        self.assertIsNone(cache.get("big"))
+        self.assertIsNone(caches["overflow"].get(cache.make_key("big")))
+        self.assertEqual(caches["overflow"].get("foreign"), "kept")
+
+
+
+def _mmap_cache_child(path):
+    cache = MmapCache(path, {"OPTIONS": {"SLOTS": 64, "SLOT_SIZE": 512}})
+    cache.set("child", cache.get("parent") + " and child")
@@ -0,0 +1,79 @@
+"""
+Maintenance of the denormalized ``Order.total`` and ``Order.products_count``.
+
+The total is the sum of discount-aware product prices (see :func:`effective_price`).
+Adding products and repricing them is applied as a delta with ``F()`` expressions,
+removals and bulk changes recompute the affected orders from the link table.
+"""
+from decimal import Decimal
+
+from django.db.models import F
+
+from .cache import invalidate_models
+from .models import Order, Product, effective_price
+from .utils import batched
+
+OrderProducts = Order.products.through
+
+
+def effective_prices(product_pks) -> dict:
+    return {
+        pk: effective_price(price, discount)
+        for pk, price, discount in Product.objects.filter(pk__in=product_pks).values_list("pk", "price", "discount")
+    }
+
+
+def add_products(order_pks, product_pks):
+    """
+    Adds every product of ``product_pks`` to the totals of every order of ``order_pks``.
+    """
+    if not order_pks or not product_pks:
+        return
+    delta = sum(effective_prices(product_pks).values(), Decimal(0))
+    Order.objects.filter(pk__in=order_pks).update(
+        total=F("total") + delta,
+        products_count=F("products_count") + len(product_pks),
+    )
+    invalidate_models(Order)
+
+
+def reprice_product(product_pk, old_price: Decimal, new_price: Decimal):
+    if old_price == new_price:
+        return
+    Order.objects.filter(products=product_pk).update(total=F("total") + (new_price - old_price))
+    invalidate_models(Order)
+
+
+def recompute_orders(order_pks):
+    """
+    Recomputes totals of the given orders from scratch with one read and one bulk update.
+    """
+    totals = {pk: Decimal(0) for pk in order_pks}
+    counts = dict.fromkeys(order_pks, 0)
+    rows = (
+        OrderProducts.objects
+        .filter(order_id__in=order_pks)
+        .values_list("order_id", "product__price", "product__discount")
+    )
+    for order_pk, price, discount in rows:
+        totals[order_pk] += effective_price(price, discount)
+        counts[order_pk] += 1
+    Order.objects.bulk_update(
+        [
+            Order(pk=pk, total=totals[pk], products_count=counts[pk])
+            for pk in order_pks
+        ],
+        ["total", "products_count"],
+    )
+    invalidate_models(Order)
+
+
+def recompute_orders_for_products(product_pks, batch_size=1000):
+    order_pks = (
+        OrderProducts.objects
+        .filter(product_id__in=product_pks)
+        .values_list("order_id", flat=True)
+        .distinct()
+    )
+    for batch in batched(order_pks.iterator(chunk_size=batch_size), batch_size):
+        recompute_orders(batch)
@@ -8,10 +8,12 @@ from .views import (
     ProductsListView,
     OrdersListView,
     OrderDetailView,
+    OrderCreateView,
     ProductCreateView,
     ProductUpdateView,
     ProductDeleteView,
     ProductsDataExportView,
+    ProductSuggestView,
     ProductViewSet,
     OrderViewSet,
     LatestProductsFeed,
@@ -30,12 +32,14 @@ urlpatterns = [
     path("api/", include(routers.urls)),
     path("products/", ProductsListView.as_view(), name="products_list"),
     path("products/export/", ProductsDataExportView.as_view(), name="products-export"),
+    path("products/suggest/", ProductSuggestView.as_view(), name="products_suggest"),
     path("products/create/", ProductCreateView.as_view(), name="product_create"),
     path("products/<int:pk>/", ProductDetailsView.as_view(), name="product_details"),
     path("products/<int:pk>/update/", ProductUpdateView.as_view(), name="product_update"),
     path("products/<int:pk>/archive/", ProductDeleteView.as_view(), name="product_delete"),
     path("products/latest/feed/", LatestProductsFeed(), name="latest_products_feed"),
     path("orders/", OrdersListView.as_view(), name="orders_list"),
+    path("orders/create/", OrderCreateView.as_view(), name="order_create"),
     path("orders/<int:pk>/", OrderDetailView.as_view(), name="order_details"),
     path("users/<int:pk>/orders/", UserOrdersListView.as_view(), name="user_orders"),
     path("users/<int:pk>/orders/export/", UsersOrdersExportView.as_view(), name="user_orders_export")
@@ -1,2 +1,11 @@
+from itertools import islice
+
+
 def add_two_numbers(a, b):
     return a + b
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
@@ -4,66 +4,100 @@
 Разные view интернет-магазина: по товарам, заказам и т.д.
 """
 import logging
+import re
 from timeit import default_timer
-from csv import DictWriter
 
 import django.contrib.auth.models
 from django.http import Http404
 from django.core.exceptions import ObjectDoesNotExist
+from django.contrib import messages
 from django.contrib.auth.models import User
 from django.contrib.syndication.views import Feed
-from django.http import HttpResponse, HttpRequest, HttpResponseRedirect, JsonResponse
+from django.http import HttpResponse, HttpRequest, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, reverse
 from django.urls import reverse_lazy
+from django.utils.cache import patch_vary_headers
 from django.utils.decorators import method_decorator
-from django.core.cache import cache
+from django.utils.text import compress_sequence
+from django.db.models import Prefetch
 from django.views import View
 from django.views.decorators.cache import cache_page
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin, UserPassesTestMixin
+from rest_framework import status
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.filters import SearchFilter, OrderingFilter
 from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import IsAdminUser
 from django_filters.rest_framework import DjangoFilterBackend
 from drf_spectacular.utils import extend_schema, OpenApiResponse
 
-from .common import save_csv_products
-from .models import Product, Order, ProductImage
+from .cache import (
+    cache_page_for_models,
+    get_generation,
+    get_or_recompute,
+    model_scope,
+    user_orders_scope,
+)
+from .conditional import conditional_on
+from .facets import get_facets
+from .fastjson import FastJSONListMixin
+from .fieldsets import SparseFieldsetsMixin
+from .filters import ProductFilter, ProductFullTextSearchFilter
+from .images import save_product_images, variants_for
+from .common import save_csv_products, sync_csv_products, iter_csv
+from .models import Product, Order
+from .pagination import KeysetPagination
 from .forms import OrderForm, ProductForm
 from .serializers import ProductSerializer, OrderSerializer
+from .suggest import product_index
+from .surrogate import SurrogateKeyMixin, collection_key, instance_key, surrogate_keys
 
 log = logging.getLogger(__name__)
 
+accepts_gzip = re.compile(r"\bgzip\b")
+
+
+def all_products(request, *args, **kwargs):
+    return Product.objects.all()
+
+
+def product_by_pk(request, pk, *args, **kwargs):
+    return Product.objects.filter(pk=pk)
+
 
 @extend_schema(description="Product views CRUD")
-class ProductViewSet(ModelViewSet):
+class ProductViewSet(SurrogateKeyMixin, SparseFieldsetsMixin, FastJSONListMixin, ModelViewSet):
     """
     Набор представлений для действия над Product
     Полный CRUD для сущностей товара
     """
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    pagination_class = KeysetPagination
     filter_backends = [
-        SearchFilter,
+        ProductFullTextSearchFilter,
         DjangoFilterBackend,
         OrderingFilter
     ]
     search_fields = ["name", "description"]
-    filterset_fields = [
+    filterset_class = ProductFilter
+    ordering_fields = [
+        "pk",
         "name",
-        "description",
         "price",
         "discount",
-        "archived",
     ]
-    ordering_fields = [
+    csv_export_fields = [
         "name",
+        "description",
         "price",
         "discount",
     ]
+    csv_export_chunk_size = 2000
 
     @extend_schema(
         summary="Get one product by ID",
@@ -73,46 +107,92 @@ class ProductViewSet(ModelViewSet):
             404: OpenApiResponse(description="Empty response, product by ID not found")
         }
     )
+    @method_decorator(conditional_on(product_by_pk))
     def retrieve(self, *args, **kwargs):
         return super().retrieve(*args, **kwargs)
 
 
-    @method_decorator(cache_page(60 * 2))
+    @method_decorator(conditional_on(all_products))
+    @method_decorator(cache_page_for_models(60 * 60, Product))
     def list(self, *args, **kwargs):
         return super().list(*args, **kwargs)
 
+    def get_paginated_response(self, data):
+        """
+        Страница списка вместе с количеством товаров по корзинам цены, скидки,
+        даты создания и архивности для всего отфильтрованного набора.
+        """
+        response = super().get_paginated_response(data)
+        queryset = self.filter_queryset(self.get_queryset())
+        response.data["facets"] = get_facets(queryset, self.request.query_params)
+        return response
+
     @action(methods=["get"], detail=False)
     def download_csv(self, request: Request):
-        response = HttpResponse(content_type="text/csv")
-        filename = "products-export.csv"
-        response["Content-Disposition"] = f"attachment; filename={filename}"
+        """
+        Потоковая выгрузка товаров в CSV: строки читаются из БД пачками,
+        поэтому память не растёт с размером каталога.
+        """
+        fields = self.csv_export_fields
         queryset = self.filter_queryset(self.get_queryset())
-        fields = [
-            "name",
-            "description",
-            "price",
-            "discount",
-        ]
-        queryset = queryset.only(*fields)
-        writer = DictWriter(response, fieldnames=fields)
-        writer.writeheader()
-
-        for product in queryset:
-            writer.writerow({
-                field: getattr(product, field)
-                for field in fields
-            })
+        rows = queryset.values_list(*fields).iterator(chunk_size=self.csv_export_chunk_size)
+        content = (
+            chunk.encode()
+            for chunk in iter_csv(fields, rows, chunk_size=self.csv_export_chunk_size)
+        )
+        gzipped = accepts_gzip.search(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        if gzipped:
+            content = compress_sequence(content)
 
+        response = StreamingHttpResponse(content, content_type="text/csv")
+        filename = "products-export.csv"
+        response["Content-Disposition"] = f"attachment; filename={filename}"
+        if gzipped:
+            response["Content-Encoding"] = "gzip"
+        patch_vary_headers(response, ("Accept-Encoding",))
         return response
-    
+
     @action(methods=["post"], detail=False, parser_classes=[MultiPartParser])
     def upload_csv(self, request: Request):
-        products = save_csv_products(
-            file=request.FILES["file"].file,
-            encoding=request.encoding,
+        """
+        Загрузка товаров из CSV. С ``?mode=upsert`` товары обновляются по ключу
+        (``?key=name`` по умолчанию), ``?archive_missing=1`` архивирует
+        товары, которых нет в файле.
+        """
+        try:
+            if request.query_params.get("mode") == "upsert":
+                result = sync_csv_products(
+                    file=request.FILES["file"].file,
+                    encoding=request.encoding,
+                    key=request.query_params.get("key", "name"),
+                    archive_missing=request.query_params.get("archive_missing") in ("1", "true"),
+                )
+            else:
+                result = save_csv_products(
+                    file=request.FILES["file"].file,
+                    encoding=request.encoding,
+                )
+        except ValueError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result.as_dict())
+
+
+    @action(methods=["post"], detail=True, parser_classes=[MultiPartParser])
+    def upload_images(self, request: Request, pk=None):
+        """
+        Массовая загрузка картинок товара: файлы из поля ``images``
+        проверяются параллельно, битые возвращаются в ``errors``.
+        """
+        files = request.FILES.getlist("images")
+        if not files:
+            return Response({"detail": "No images uploaded"}, status=status.HTTP_400_BAD_REQUEST)
+        result = save_product_images(
+            self.get_object(),
+            files,
+            description=request.data.get("description", ""),
         )
-        serializer = self.get_serializer(products, many=True)
-        return Response(serializer.data)
+        response_status = status.HTTP_201_CREATED if result.uploaded else status.HTTP_400_BAD_REQUEST
+        return Response(result.as_dict(), status=response_status)
 
 
 class LatestProductsFeed(Feed):
@@ -120,8 +200,19 @@ class LatestProductsFeed(Feed):
     description = "Information about new products"
     link = reverse_lazy("shopapp:products_list")
 
+    @method_decorator(surrogate_keys(Product))
+    @method_decorator(conditional_on(all_products))
+    def __call__(self, request, *args, **kwargs):
+        return super().__call__(request, *args, **kwargs)
+
     def items(self):
-        return Product.objects.all()[:5]
+        generation = get_generation(model_scope(Product))
+        return get_or_recompute(
+            "latest_products_feed",
+            lambda: list(Product.objects.all()[:5]),
+            timeout=60,
+            generation=generation,
+        )
 
     def item_title(self, item: Product):
         return item.name
@@ -131,9 +222,13 @@ class LatestProductsFeed(Feed):
 
 
 
-class OrderViewSet(ModelViewSet):
+class OrderViewSet(SurrogateKeyMixin, SparseFieldsetsMixin, FastJSONListMixin, ModelViewSet):
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
+    pagination_class = KeysetPagination
+    surrogate_public = False
+    # Покупатели видны только персоналу
+    expand_permissions = {"user": [IsAdminUser]}
     filter_backends = [
         SearchFilter,
         DjangoFilterBackend,
@@ -150,8 +245,20 @@ class OrderViewSet(ModelViewSet):
         "delivery_address",
         "promocode",
         "user",
+        "total",
+        "products_count",
     ]
 
+    def get_surrogate_keys(self, response):
+        keys = super().get_surrogate_keys(response)
+        if "pk" not in self.kwargs:
+            return [*keys, collection_key(Product)]
+        # В заказе выводятся товары, их изменение тоже должно сбрасывать кэш
+        products = getattr(response, "data", {}).get("products", [])
+        # С ?expand=products вместо id приходят объекты товаров
+        pks = [product["pk"] if isinstance(product, dict) else product for product in products]
+        return [*keys, *(instance_key(Product, pk) for pk in pks)]
+
 
 class ShopIndexView(View):
     #@method_decorator(cache_page(60 * 2))
@@ -172,19 +279,35 @@ class ShopIndexView(View):
         return render(request, 'shopapp/shop-index.html', context=context)
 
 
-class ProductDetailsView(DetailView):
+class ProductDetailsView(SurrogateKeyMixin, DetailView):
     queryset = Product.objects.prefetch_related("images")
     template_name = "shopapp/products-details.html"
     model = Product
     context_object_name = "product"
 
+    @method_decorator(conditional_on(product_by_pk))
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        names = [self.object.preview.name, *(image.image.name for image in self.object.images.all())]
+        context["image_variants"] = variants_for(names)
+        return context
 
-class ProductsListView(ListView):
+
+class ProductsListView(SurrogateKeyMixin, ListView):
     template_name = "shopapp/products-list.html"
     # model = Product
     context_object_name = "products"
     queryset = Product.objects.filter(archived=False)
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Варианты превью всех товаров страницы одним запросом
+        context["image_variants"] = variants_for(product.preview.name for product in context["products"])
+        return context
+
 
 class UserOrdersListView(ListView):
     context_object_name = "orders"
@@ -214,22 +337,29 @@ class UsersOrdersExportView(LoginRequiredMixin, View):
             username = user_info.get()
         except ObjectDoesNotExist:
             raise Http404
-        cache_key = "orders_data_export"
-        orders_data = cache.get(cache_key)
-
-        if orders_data is None:
-            orders = Order.objects.filter(user_id=pk).order_by("pk").all()
-            orders_data = [
+        # Поколение меняется при любом изменении заказов пользователя или их товаров
+        generation = get_generation(user_orders_scope(pk))
+        cache_key = f"orders_data_export:{pk}"
+
+        def get_orders_data():
+            orders = (
+                Order.objects
+                .filter(user_id=pk)
+                .order_by("pk")
+                .prefetch_related(Prefetch("products", queryset=Product.objects.only("name")))
+            )
+            return [
                 {
                     "pk": order.pk,
                     "delivery_address": order.delivery_address,
                     "promocode": order.promocode,
-                    "user": order.user.username,
+                    "user": username.username,
                     "products": [product.name for product in order.products.all()]
                 }
                 for order in orders
             ]
-            cache.set(cache_key, orders_data, 300)
+
+        orders_data = get_or_recompute(cache_key, get_orders_data, timeout=300, generation=generation)
         return JsonResponse({"orders": orders_data})
 
 
@@ -254,11 +384,9 @@ class ProductUpdateView(UpdateView):
 
     def form_valid(self, form):
         response = super(ProductUpdateView, self).form_valid(form)
-        for image in form.files.getlist("images"):
-            ProductImage.objects.create(
-                product=self.object,
-                image=image
-            )
+        result = save_product_images(self.object, form.files.getlist("images"))
+        for error in result.errors:
+            messages.warning(self.request, f"{error['file']}: {error['error']}")
 
         return response
 
@@ -274,31 +402,43 @@ class ProductDeleteView(DeleteView):
         return HttpResponseRedirect(success_url)
 
 
-class OrdersListView(LoginRequiredMixin, ListView):
+class OrdersListView(SurrogateKeyMixin, LoginRequiredMixin, ListView):
     queryset = (
         Order.objects
         .select_related("user")
         .prefetch_related("products")
     )
+    surrogate_public = False
 
+    def get_surrogate_keys(self, response):
+        return [*super().get_surrogate_keys(response), collection_key(Product)]
 
-class OrderDetailView(PermissionRequiredMixin, DetailView):
+
+class OrderDetailView(SurrogateKeyMixin, PermissionRequiredMixin, DetailView):
     permission_required = "shopapp.view_order"
     queryset = (
         Order.objects
         .select_related("user")
         .prefetch_related("products")
     )
+    surrogate_public = False
+
+    def get_surrogate_keys(self, response):
+        products = self.object.products.all()
+        return [*super().get_surrogate_keys(response), *(instance_key(Product, product.pk) for product in products)]
 
 
-class ProductsDataExportView(View):
+class ProductsDataExportView(SurrogateKeyMixin, View):
+    surrogate_model = Product
+
+    @method_decorator(conditional_on(all_products))
     def get(self, request: HttpRequest) -> JsonResponse:
+        generation = get_generation(model_scope(Product))
         cache_key = "products_data_export"
-        products_data = cache.get(cache_key)
 
-        if products_data is None:
+        def get_products_data():
             products = Product.objects.order_by("pk").all()
-            products_data = [
+            return [
                 {
                     "pk": product.pk,
                     "name": product.name,
@@ -307,28 +447,66 @@ class ProductsDataExportView(View):
                 }
                 for product in products
             ]
-            cache.set(cache_key, products_data, 300)
+
+        products_data = get_or_recompute(cache_key, get_products_data, timeout=300, generation=generation)
         return JsonResponse({"products": products_data})
 
 
 
 class OrdersDataExportView(View):
     def get(self, request: HttpRequest) -> JsonResponse:
-        orders = Order.objects.order_by("pk").all()
-        orders_data = [
-            {
-                "pk": order.pk,
-                "delivery_address": order.delivery_address,
-                "promocode": order.promocode,
-                "user": order.user.pk,
-                "products": [product.pk for product in order.products.all()]
-            }
-            for order in orders
-        ]
+        generation = get_generation(model_scope(Order))
+        cache_key = "orders_data_export"
+
+        def get_orders_data():
+            orders = (
+                Order.objects
+                .order_by("pk")
+                .prefetch_related(Prefetch("products", queryset=Product.objects.only("pk")))
+            )
+            return [
+                {
+                    "pk": order.pk,
+                    "delivery_address": order.delivery_address,
+                    "promocode": order.promocode,
+                    "user": order.user_id,
+                    "products": [product.pk for product in order.products.all()]
+                }
+                for order in orders
+            ]
+
+        orders_data = get_or_recompute(cache_key, get_orders_data, timeout=300, generation=generation)
         return JsonResponse({"orders": orders_data})
 
 
-class OrderCreateView(CreateView):
+class OrderCreateView(LoginRequiredMixin, CreateView):
+    """
+    Создание заказа. Без права shopapp.add_order заказ можно оформить
+    только на себя, с ним - на любого покупателя.
+    """
     model = Order
     form_class = OrderForm
-    success_url = reverse_lazy("shopapp:orders_list")
\ No newline at end of file
+    success_url = reverse_lazy("shopapp:orders_list")
+
+    def get_form(self, form_class=None):
+        form = super().get_form(form_class)
+        if not self.request.user.has_perm("shopapp.add_order"):
+            form.fields["user"].queryset = User.objects.filter(pk=self.request.user.pk)
+            form.fields["user"].initial = self.request.user.pk
+        return form
+
+
+class ProductSuggestView(View):
+    """
+    Подсказки товаров для поля ввода: поиск по началу названия или его слов
+    в индексе в памяти процесса, без запросов к БД.
+    """
+    max_limit = 20
+
+    def get(self, request: HttpRequest) -> JsonResponse:
+        try:
+            limit = min(int(request.GET.get("limit", 10)), self.max_limit)
+        except ValueError:
+            limit = 10
+        results = product_index.search(request.GET.get("q", ""), limit=max(limit, 1))
+        return JsonResponse({"results": [{"id": pk, "name": name} for pk, name in results]})